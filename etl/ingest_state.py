@@ -0,0 +1,61 @@
+"""
+Last ingested observation time per location, kept in a small local JSON file.
+
+Open-Meteo's `current` block only moves forward every 15 minutes, so consecutive ETL runs
+often get the same observation back. Comparing against this state lets the ETL drop those
+before building records, and skip the database round-trip entirely when a batch has nothing new.
+"""
+import os
+import json
+import threading
+from datetime import datetime, timezone
+
+STATE_PATH = os.getenv("ETL_STATE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".state", "last_ingested.json"))
+
+def parse_observation_time(value):
+    """
+    Open-Meteo timestamp ("2026-01-01T12:00", UTC when timezone=UTC) as an aware datetime,
+    or None when it is missing or malformed.
+    """
+    if not isinstance(value, str):
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+class IngestionState:
+    """
+    location name -> last stored weather_timestamp. Safe to share between the upsert threads.
+    """
+    def __init__(self, path=STATE_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.last = {}
+        if os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self.last = {name: datetime.fromisoformat(ts) for name, ts in json.load(f).items()}
+            except (OSError, ValueError) as e:
+                print(f"Warning: ignoring unreadable ingestion state {path}: {e}")
+
+    def is_new(self, name, observed_at):
+        with self.lock:
+            last = self.last.get(name)
+        return last is None or observed_at > last
+
+    def mark(self, observations):
+        """
+        Record stored (name, observed_at) pairs and persist the state.
+        """
+        with self.lock:
+            for name, observed_at in observations:
+                if name not in self.last or observed_at > self.last[name]:
+                    self.last[name] = observed_at
+            snapshot = {name: ts.isoformat() for name, ts in self.last.items()}
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, self.path)
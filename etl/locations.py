@@ -0,0 +1,173 @@
+"""
+Array-backed registry of the locations the ETL fetches and the models predict for.
+
+Names, ids and coordinates live in parallel NumPy arrays. Lookups by name or id go through
+hash maps, and nearest-location and radius queries through a KD-tree over points on the
+unit sphere, so none of them scan the registry. The registry loads from the CITIES list,
+a CSV or a Parquet file (columns: name, latitude, longitude and optionally id).
+"""
+import os
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+GRID_CELL_DEGREES = 5.0  # Side of the lat/lon cells fetch batches are packed by
+
+def _unit_vectors(latitude, longitude):
+    lat, lon = np.radians(latitude), np.radians(longitude)
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+def _chord_to_km(chord):
+    # Straight-line distance between unit vectors -> great-circle (haversine) distance
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.clip(np.asarray(chord) / 2, 0, 1))
+
+def _km_to_chord(km):
+    return 2 * np.sin(np.minimum(np.asarray(km, dtype=float) / (2 * EARTH_RADIUS_KM), np.pi / 2))
+
+class LocationRegistry:
+    """
+    Sequence of locations. Indexing with an integer returns the location as a
+    {"id", "name", "latitude", "longitude"} dict (the shape of a CITIES entry); indexing
+    with a slice or an index array returns a registry over those locations.
+    """
+    def __init__(self, names, latitude, longitude, ids=None):
+        self.names = np.asarray(names, dtype=object)
+        self.latitude = np.asarray(latitude, dtype=np.float64)
+        self.longitude = np.asarray(longitude, dtype=np.float64)
+        self.ids = np.arange(len(self.names), dtype=np.int64) if ids is None else np.asarray(ids, dtype=np.int64)
+        if not (len(self.names) == len(self.latitude) == len(self.longitude) == len(self.ids)):
+            raise ValueError("Location names, ids and coordinates must have the same length.")
+
+        self._by_name = {name: i for i, name in enumerate(self.names.tolist())}
+        self._by_id = {location_id: i for i, location_id in enumerate(self.ids.tolist())}
+        if len(self._by_name) != len(self.names):
+            raise ValueError("Location names must be unique.")
+        if len(self._by_id) != len(self.ids):
+            raise ValueError("Location ids must be unique.")
+        self._tree = None
+
+    @classmethod
+    def from_records(cls, records):
+        """
+        Registry from dicts with name, latitude, longitude (and optionally id), e.g. CITIES.
+        """
+        ids = [record["id"] for record in records] if records and "id" in records[0] else None
+        return cls(
+            [record["name"] for record in records],
+            [record["latitude"] for record in records],
+            [record["longitude"] for record in records],
+            ids,
+        )
+
+    @classmethod
+    def load(cls, path):
+        """
+        Registry from a CSV or Parquet file.
+        """
+        import pandas as pd
+
+        if path.endswith(".parquet"):
+            df = pd.read_parquet(path)
+        else:
+            df = pd.read_csv(path)
+        missing = {"name", "latitude", "longitude"} - set(df.columns)
+        if missing:
+            raise ValueError(f"Location file {path} is missing columns: {sorted(missing)}")
+        ids = df["id"].to_numpy() if "id" in df.columns else None
+        return cls(df["name"].astype(str).to_numpy(), df["latitude"].to_numpy(), df["longitude"].to_numpy(), ids)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            return {
+                "id": int(self.ids[key]),
+                "name": self.names[key],
+                "latitude": float(self.latitude[key]),
+                "longitude": float(self.longitude[key]),
+            }
+        return LocationRegistry(self.names[key], self.latitude[key], self.longitude[key], self.ids[key])
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def __contains__(self, name):
+        return name in self._by_name
+
+    def index_of(self, name):
+        """
+        Position of a location by name, or -1.
+        """
+        return self._by_name.get(name, -1)
+
+    def indices_of(self, names):
+        """
+        Positions of several locations by name, -1 for unknown ones.
+        """
+        return np.fromiter((self._by_name.get(name, -1) for name in names), dtype=np.int64)
+
+    def by_name(self, name):
+        return self[self._by_name[name]]
+
+    def by_id(self, location_id):
+        return self[self._by_id[location_id]]
+
+    @property
+    def tree(self):
+        """
+        KD-tree over the locations as unit vectors, built on first spatial query.
+        """
+        if self._tree is None:
+            from scipy.spatial import cKDTree
+            self._tree = cKDTree(_unit_vectors(self.latitude, self.longitude))
+        return self._tree
+
+    def nearest(self, latitude, longitude, k=1):
+        """
+        (positions, distances in km) of the k nearest locations to each query point,
+        shaped like the query (with a trailing k axis when k > 1).
+        """
+        points = _unit_vectors(np.atleast_1d(latitude), np.atleast_1d(longitude))
+        chord, idx = self.tree.query(points, k=k)
+        if np.ndim(latitude) == 0:
+            chord, idx = chord[0], idx[0]
+        return idx, _chord_to_km(chord)
+
+    def within_radius(self, latitude, longitude, radius_km):
+        """
+        Positions of the locations within `radius_km` of a point, sorted by distance.
+        """
+        point = _unit_vectors(np.atleast_1d(latitude), np.atleast_1d(longitude))[0]
+        idx = np.asarray(self.tree.query_ball_point(point, r=float(_km_to_chord(radius_km))), dtype=np.int64)
+        if len(idx) == 0:
+            return idx
+        chord = np.linalg.norm(self.tree.data[idx] - point, axis=1)
+        return idx[np.argsort(chord, kind="stable")]
+
+    def grid_cells(self, cell_degrees=GRID_CELL_DEGREES):
+        """
+        (row, column) of the lat/lon grid cell of every location.
+        """
+        rows = np.floor((self.latitude + 90) / cell_degrees).astype(np.int64)
+        cols = np.floor((self.longitude + 180) / cell_degrees).astype(np.int64)
+        return rows, cols
+
+    def grid_batches(self, batch_size, cell_degrees=GRID_CELL_DEGREES):
+        """
+        Split the registry into batches of at most `batch_size` nearby locations.
+
+        Locations are ordered by grid cell, walking the cell rows in alternating directions
+        so consecutive cells touch, and the ordering is cut into batches. A batch then covers
+        one or a few neighbouring cells instead of points spread around the globe.
+        """
+        rows, cols = self.grid_cells(cell_degrees)
+        serpentine = np.where(rows % 2 == 0, cols, -cols)
+        order = np.lexsort((self.longitude, self.latitude, serpentine, rows))
+        return [self[order[i:i + batch_size]] for i in range(0, len(order), batch_size)]
+
+def load_locations(records, path=None):
+    """
+    Registry from LOCATIONS_PATH (CSV or Parquet) when set, otherwise from `records`.
+    """
+    path = path or os.getenv("LOCATIONS_PATH")
+    return LocationRegistry.load(path) if path else LocationRegistry.from_records(records)
@@ -1,114 +1,478 @@
 import os
+import sys
 import time
-import requests
-import pandas as pd
+import asyncio
+import argparse
+import functools
 from datetime import datetime, timezone
 from dotenv import load_dotenv
-from supabase import create_client, Client
-from cities import CITIES
 
-# Load environment variables
-load_dotenv()
+# Run as a script, so make the etl package importable; its modules are only ever imported as
+# etl.*, which keeps one copy of each (and of their cached clients) when ml_pipeline imports them
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
 
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY") # Use service role for ETL to bypass RLS if needed, or ANON if policy allows
+from etl.cities import CITIES
+from etl.ingest_state import IngestionState, parse_observation_time
+from etl.spool import Spool, drain
 
-if not SUPABASE_URL or not SUPABASE_KEY:
-    print("Error: SUPABASE_URL or SUPABASE_SERVICE_ROLE_KEY not set in environment.")
-    # For local development/testing without env vars, we might want to fail gracefully or mock.
-    # But for production code, we should exit.
-    # exit(1) 
+# HTTP, dataframe and Supabase libraries are imported inside the functions that use them,
+# so importing this module is cheap and each run only loads what its mode needs.
 
-# Initialize Supabase client
-try:
-    supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-except Exception as e:
-    print(f"Warning: Could not initialize Supabase client: {e}")
-    supabase = None
+@functools.lru_cache(maxsize=None)
+def supabase_credentials():
+    """
+    (url, service role key), reading .env on first use.
+    """
+    load_dotenv()
+    url = os.getenv("SUPABASE_URL")
+    key = os.getenv("SUPABASE_SERVICE_ROLE_KEY") # Use service role for ETL to bypass RLS if needed, or ANON if policy allows
+    if not url or not key:
+        print("Error: SUPABASE_URL or SUPABASE_SERVICE_ROLE_KEY not set in environment.")
+    return url, key
+
+@functools.lru_cache(maxsize=None)
+def get_supabase():
+    """
+    Shared Supabase client, created on first use; None if it cannot be created.
+    """
+    from supabase import create_client
+    try:
+        return create_client(*supabase_credentials())
+    except Exception as e:
+        print(f"Warning: Could not initialize Supabase client: {e}")
+        return None
+
+@functools.lru_cache(maxsize=None)
+def get_postgres_store():
+    """
+    Direct Postgres store when STORAGE_BACKEND=postgres (see postgres_store.py), else None
+    and writes go through PostgREST.
+    """
+    load_dotenv()
+    if os.getenv("STORAGE_BACKEND", "supabase") != "postgres":
+        return None
+    from etl.postgres_store import PostgresStore
+    return PostgresStore(os.getenv("DATABASE_URL"))
+
+@functools.lru_cache(maxsize=None)
+def get_locations():
+    """
+    Location registry (see locations.py): LOCATIONS_PATH if set, otherwise CITIES.
+    """
+    from etl.locations import load_locations
+    load_dotenv()
+    return load_locations(CITIES)
+
+@functools.lru_cache(maxsize=None)
+def get_ingestion_state():
+    """
+    Last stored observation time per location (see ingest_state.py), loaded once per process.
+    """
+    return IngestionState()
+
+@functools.lru_cache(maxsize=None)
+def get_spool():
+    """
+    Local spool fetched records are written to before they are stored (see spool.py).
+    """
+    return Spool()
 
 OPEN_METEO_URL = "https://api.open-meteo.com/v1/forecast"
 
+BATCH_SIZE = 50 # Open-Meteo generally handles this well
+
+# Concurrent fetch configuration
+MAX_CONCURRENT_REQUESTS = 8  # Open-Meteo requests in flight at any time
+REQUESTS_PER_SECOND = 2.0    # Sustained request rate (token bucket refill)
+RATE_LIMIT_BURST = 4         # Requests allowed back-to-back before throttling
+FETCH_RETRIES = 2            # Extra attempts for a failed Open-Meteo request
+FETCH_RETRY_DELAY = 2.0      # Seconds before the first retry, doubled for each further one
+
+# Spool replay configuration
+SPOOL_DRAIN_BATCH = 1000         # Spooled records stored per request
+SPOOL_RETRY_BASE_SECONDS = 1.0   # Backoff while the store is failing, doubled per failed replay...
+SPOOL_RETRY_MAX_SECONDS = 60.0   # ...up to this
+SPOOL_DRAIN_TIMEOUT = 120.0      # Seconds a run keeps replaying after fetching; the rest waits for the next run
+
+# Historical backfill configuration
+# Hourly history comes from the reanalysis archive, 15-minute history from the historical forecast API.
+HISTORY_URLS = {
+    "hourly": "https://archive-api.open-meteo.com/v1/archive",
+    "minutely_15": "https://historical-forecast-api.open-meteo.com/v1/forecast",
+}
+BACKFILL_BATCH_SIZE = 10                 # Locations per history request (each returns long arrays)
+BACKFILL_CHUNK_BYTES = 2 * 1024 * 1024   # Target JSON payload size per upsert request
+
+# Rollup and retention (see supabase/migrations/20261018_weather_rollups.sql)
+ROLLUP_AFTER_HOURS = 2        # Raw rows are aggregated once their hour is this far in the past
+RAW_RETENTION_DAYS = 90       # Raw rows older than this are deleted once rolled up
+HOURLY_RETENTION_DAYS = 365   # Hourly buckets older than this are deleted; daily ones are kept
+
 def fetch_weather_data_batch(cities_batch):
     """
     Fetch weather data for a batch of cities using Open-Meteo API.
     """
-    lats = [str(city["latitude"]) for city in cities_batch]
-    longs = [str(city["longitude"]) for city in cities_batch]
+    import requests
+
+    params = build_batch_params(cities_batch)
     
-    params = {
-        "latitude": ",".join(lats),
-        "longitude": ",".join(longs),
+    try:
+        response = requests.get(OPEN_METEO_URL, params=params, timeout=10)
+        response.raise_for_status()
+        return response.json()
+    except requests.exceptions.RequestException as e:
+        print(f"Error fetching data batch: {e}")
+        return None
+
+def build_batch_params(cities_batch):
+    """
+    Build the Open-Meteo query parameters for a batch of cities.
+    """
+    return {
+        "latitude": ",".join(str(city["latitude"]) for city in cities_batch),
+        "longitude": ",".join(str(city["longitude"]) for city in cities_batch),
         "current": "temperature_2m,relative_humidity_2m",
         "timezone": "UTC"
     }
-    
+
+class TokenBucket:
+    """
+    Asyncio token-bucket rate limiter.
+
+    Allows bursts of up to `capacity` requests and refills at `rate` tokens per second,
+    replacing the fixed sleep between batches.
+    """
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+async def fetch_weather_data_batch_async(client, cities_batch, limiter, semaphore):
+    """
+    Fetch weather data for a batch of cities over a shared async HTTP client.
+    """
+    import httpx
+
+    async with semaphore:
+        for attempt in range(FETCH_RETRIES + 1):
+            await limiter.acquire()
+            try:
+                response = await client.get(OPEN_METEO_URL, params=build_batch_params(cities_batch))
+                response.raise_for_status()
+                return response.json()
+            except httpx.HTTPError as e:
+                if attempt == FETCH_RETRIES:
+                    names = ", ".join(city["name"] for city in cities_batch)
+                    print(f"Error fetching data batch after {attempt + 1} attempts: {e} (locations: {names})")
+                    return None
+                print(f"Error fetching data batch, retrying: {e}")
+                await asyncio.sleep(FETCH_RETRY_DELAY * 2 ** attempt)
+
+def fetch_weather_history_batch(cities_batch, start_date, end_date, resolution="hourly"):
+    """
+    Fetch hourly or 15-minute history for a batch of cities between two dates (inclusive).
+    """
+    import requests
+
+    if resolution not in HISTORY_URLS:
+        raise ValueError(f"Unknown resolution: {resolution}")
+
+    params = {
+        "latitude": ",".join(str(city["latitude"]) for city in cities_batch),
+        "longitude": ",".join(str(city["longitude"]) for city in cities_batch),
+        "start_date": str(start_date),
+        "end_date": str(end_date),
+        resolution: "temperature_2m,relative_humidity_2m",
+        "timezone": "UTC",
+        "timeformat": "unixtime"
+    }
+
     try:
-        response = requests.get(OPEN_METEO_URL, params=params, timeout=10)
+        response = requests.get(HISTORY_URLS[resolution], params=params, timeout=60)
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException as e:
-        print(f"Error fetching data batch: {e}")
+        print(f"Error fetching history batch: {e}")
         return None
 
+def history_to_frame(data_list, cities_batch, resolution="hourly"):
+    """
+    Turn per-location history arrays into one columnar DataFrame.
+
+    Arrays are concatenated as a whole, so no Python object is built per row.
+    """
+    import numpy as np
+    import pandas as pd
+
+    if not isinstance(data_list, list):
+        data_list = [data_list]
+
+    cities, lats, lons, times, temps, hums = [], [], [], [], [], []
+    for data, city_info in zip(data_list, cities_batch):
+        if "error" in data:
+            print(f"Error for city {city_info['name']}: {data.get('reason')}")
+            continue
+        block = data.get(resolution) or {}
+        t = np.asarray(block.get("time", []), dtype=np.int64)
+        if len(t) == 0:
+            continue
+        times.append(t)
+        temps.append(np.asarray(block.get("temperature_2m"), dtype=np.float64))
+        hums.append(np.asarray(block.get("relative_humidity_2m"), dtype=np.float64))
+        cities.append(np.full(len(t), city_info["name"], dtype=object))
+        lats.append(np.full(len(t), city_info["latitude"]))
+        lons.append(np.full(len(t), city_info["longitude"]))
+
+    if not times:
+        return pd.DataFrame()
+
+    df = pd.DataFrame({
+        "city": np.concatenate(cities),
+        "latitude": np.concatenate(lats),
+        "longitude": np.concatenate(lons),
+        "temperature": np.concatenate(temps),
+        "humidity": np.concatenate(hums),
+        "weather_timestamp": pd.to_datetime(np.concatenate(times), unit="s", utc=True),
+    })
+    # Missing observations come back as null; the table requires both measurements.
+    df = df.dropna(subset=["temperature", "humidity"])
+    df["data_source"] = "open-meteo"
+    return df
+
+def upsert_frame_chunked(df, chunk_bytes=BACKFILL_CHUNK_BYTES, session=None):
+    """
+    Upsert a DataFrame into weather_data in chunks sized to roughly `chunk_bytes` of JSON.
+
+    Rows are serialized by pandas straight to JSON and sent to the PostgREST endpoint
+    with merge-duplicates on the (city, weather_timestamp) unique index.
+    """
+    import requests
+    import pandas as pd
+
+    if df.empty:
+        return 0
+    store = get_postgres_store()
+    if store is not None:
+        try:
+            stored = store.upsert_weather(df)
+            print(f"Successfully inserted/updated {stored} records through COPY.")
+            return stored
+        except Exception as e:
+            print(f"Error upserting {len(df)} records into Postgres: {e}")
+            return 0
+    url, key = supabase_credentials()
+    if not url or not key:
+        print(f"Processed {len(df)} records (Supabase not connected).")
+        return 0
+
+    # Estimate bytes per row from a sample and size chunks to the target payload.
+    sample = df.head(min(len(df), 200)).to_json(orient="records", date_format="iso")
+    bytes_per_row = max(1, len(sample) // min(len(df), 200))
+    chunk_rows = max(1, chunk_bytes // bytes_per_row)
+
+    session = session or requests.Session()
+    endpoint = f"{url}/rest/v1/weather_data"
+    headers = {
+        "apikey": key,
+        "Authorization": f"Bearer {key}",
+        "Content-Type": "application/json",
+        "Prefer": "resolution=merge-duplicates,return=minimal",
+    }
+
+    stored = 0
+    for start in range(0, len(df), chunk_rows):
+        # Stamped per request, so ingestion order follows write order
+        chunk = df.iloc[start:start + chunk_rows].assign(ingestion_time=pd.Timestamp.now(tz="UTC"))
+        payload = chunk.to_json(orient="records", date_format="iso")
+        try:
+            response = session.post(endpoint, params={"on_conflict": "city,weather_timestamp"},
+                                    data=payload, headers=headers, timeout=60)
+            response.raise_for_status()
+            stored += len(chunk)
+        except requests.exceptions.RequestException as e:
+            print(f"Error upserting chunk of {len(chunk)} records: {e}")
+    print(f"Successfully inserted/updated {stored} records in chunks of {chunk_rows}.")
+    return stored
+
+def backfill(start_date, end_date, resolution="hourly", cities=None, batch_size=BACKFILL_BATCH_SIZE):
+    """
+    Backfill weather_data with historical observations for a date range, for every registered
+    location or only the ones named in `cities`.
+    """
+    import requests
+
+    locations = get_locations()
+    if cities:
+        indices = locations.indices_of(cities)
+        unknown = [name for name, i in zip(cities, indices) if i < 0]
+        if unknown:
+            raise ValueError(f"Unknown cities: {unknown}")
+        cities = locations[indices]
+    else:
+        cities = locations
+    print(f"Starting {resolution} backfill for {len(cities)} cities from {start_date} to {end_date}...")
+    session = requests.Session()
+    total = 0
+    for n, batch in enumerate(cities.grid_batches(batch_size)):
+        print(f"Backfilling batch {n + 1} ({len(batch)} cities)...")
+        data = fetch_weather_history_batch(batch, start_date, end_date, resolution)
+        if data:
+            total += upsert_frame_chunked(history_to_frame(data, batch, resolution), session=session)
+    print(f"Backfill completed: {total} records stored.")
+
 def process_and_store_data(data_list, cities_batch):
     """
-    Process API response and store in Supabase.
+    Process API response and spool the new observations for storage (see drain_spool).
+
+    Observations that are not newer than the last one spooled for their location are skipped,
+    so a batch with nothing new leads to no database request at all. Returns the number of
+    records spooled.
     """
     if not data_list:
-        return
+        return 0
 
     # Open-Meteo returns a list of results if multiple locations are requested, 
     # or a single object if only one.
     if not isinstance(data_list, list):
         data_list = [data_list]
-        
-    records_to_insert = []
-    current_time = datetime.now(timezone.utc).isoformat()
+    if len(data_list) != len(cities_batch):
+        print(f"Warning: got {len(data_list)} results for {len(cities_batch)} locations.")
+
+    state = get_ingestion_state()
+    records_to_insert, observed = [], []
+    skipped, malformed = 0, []
     
-    for i, data in enumerate(data_list):
-        city_info = cities_batch[i]
-        
+    for data, city_info in zip(data_list, cities_batch):
         # Check for error in individual result
         if "error" in data:
-            print(f"Error for city {city_info['name']}: {data.get('reason')}")
+            malformed.append(f"{city_info['name']} ({data.get('reason')})")
             continue
             
-        current_weather = data.get("current", {})
+        current_weather = data.get("current") or {}
+        observed_at = parse_observation_time(current_weather.get("time"))
+        temperature = current_weather.get("temperature_2m")
+        humidity = current_weather.get("relative_humidity_2m")
+        if observed_at is None or temperature is None or humidity is None:
+            malformed.append(f"{city_info['name']} (missing time or measurements)")
+            continue
+        if not state.is_new(city_info["name"], observed_at):
+            skipped += 1
+            continue
         
-        record = {
+        records_to_insert.append({
             "city": city_info["name"],
             "latitude": city_info["latitude"],
             "longitude": city_info["longitude"],
-            "temperature": current_weather.get("temperature_2m"),
-            "humidity": current_weather.get("relative_humidity_2m"),
-            "weather_timestamp": current_weather.get("time") + "Z", # Open-Meteo returns ISO without Z for UTC usually if timezone=UTC is set, but let's ensure
-            "ingestion_time": current_time,
+            "temperature": temperature,
+            "humidity": humidity,
+            "weather_timestamp": observed_at.isoformat(),
             "data_source": "open-meteo"
-        }
-        
-        records_to_insert.append(record)
-        
-    if records_to_insert and supabase:
-        try:
-            # Upsert data based on city and weather_timestamp (unique constraint)
-            # We use `upsert` to avoid duplicates if the script runs multiple times for the same timestamp
-            response = supabase.table("weather_data").upsert(records_to_insert, on_conflict="city,weather_timestamp").execute()
-            print(f"Successfully inserted/updated {len(records_to_insert)} records.")
-        except Exception as e:
-            print(f"Error inserting into Supabase: {e}")
-    else:
-        print(f"Processed {len(records_to_insert)} records (Supabase not connected or empty batch).")
-        # For debugging/logging if Supabase is not active
-        # print(records_to_insert)
+        })
+        observed.append((city_info["name"], observed_at))
+
+    print(f"Batch of {len(cities_batch)}: {len(records_to_insert)} new, {skipped} unchanged, "
+          f"{len(malformed)} malformed.")
+    if malformed:
+        print(f"Malformed entries: {', '.join(malformed)}")
+    if not records_to_insert:
+        return 0
+
+    # Durable once spooled: the drainer stores them, retrying through database failures
+    get_spool().append(records_to_insert)
+    state.mark(observed)
+    return len(records_to_insert)
+
+def storage_configured():
+    return get_postgres_store() is not None or get_supabase() is not None
+
+def store_records(records):
+    """
+    Upsert weather records on (city, weather_timestamp); raises if they were not stored.
+
+    ingestion_time is stamped here, at write time, not when the record was fetched: a batch
+    replayed after a failure must still sort after every row readers have synced past.
+    """
+    # Replayed batches can hold the same key twice, which one upsert statement cannot apply
+    records = list({(r["city"], r["weather_timestamp"]): r for r in records}.values())
+    store = get_postgres_store()
+    if store is not None:
+        import pandas as pd
+
+        store.upsert_weather(pd.DataFrame(records))
+        print(f"Successfully inserted/updated {len(records)} records through COPY.")
+        return len(records)
+
+    supabase = get_supabase()
+    if supabase is None:
+        raise RuntimeError("Supabase not connected")
+    ingestion_time = datetime.now(timezone.utc).isoformat()
+    records = [dict(r, ingestion_time=ingestion_time) for r in records]
+    # Upsert data based on city and weather_timestamp (unique constraint)
+    supabase.table("weather_data").upsert(records, on_conflict="city,weather_timestamp").execute()
+    print(f"Successfully inserted/updated {len(records)} records.")
+    return len(records)
+
+def write_rejected(error):
+    """
+    Whether a failed store_records call was refused because of the records themselves rather
+    than the store being unreachable or failing: Postgres data exceptions and integrity
+    violations (SQLSTATE classes 22 and 23, reported by psycopg and by PostgREST alike), or
+    records store_records could not build a request from.
+    """
+    sqlstate = getattr(error, "sqlstate", None) or getattr(error, "code", None)
+    if isinstance(sqlstate, str) and sqlstate[:2] in ("22", "23"):
+        return True
+    return isinstance(error, (KeyError, TypeError, ValueError))
+
+async def drain_spool(stop=None, timeout=SPOOL_DRAIN_TIMEOUT):
+    """
+    Replay the spool until `stop` is set (immediately if None) and the spool is empty, or
+    until `timeout` seconds after that.
+    """
+    spool = get_spool()
+    if not storage_configured():
+        print(f"Storage not configured; {spool.pending()} records kept in the spool.")
+        return 0
+    if stop is None:
+        stop = asyncio.Event()
+        stop.set()
+    task = asyncio.create_task(drain(
+        spool, store_records, stop, SPOOL_DRAIN_BATCH, SPOOL_RETRY_BASE_SECONDS, SPOOL_RETRY_MAX_SECONDS,
+        write_rejected
+    ))
+    await stop.wait()
+    try:
+        stored = await asyncio.wait_for(task, timeout)
+    except asyncio.TimeoutError:
+        stored = 0
+    pending = spool.pending()
+    if pending:
+        print(f"{pending} records remain in the spool for the next run.")
+    dead = spool.dead_letters()
+    if dead:
+        print(f"{dead} records are in the spool's dead letters (requeue with --requeue-dead-letters).")
+    return stored
 
 def main():
-    print(f"Starting ETL pipeline for {len(CITIES)} cities...")
+    cities = get_locations()
+    print(f"Starting ETL pipeline for {len(cities)} cities...")
     
-    BATCH_SIZE = 50 # Open-Meteo generally handles this well
-    
-    for i in range(0, len(CITIES), BATCH_SIZE):
-        batch = CITIES[i:i + BATCH_SIZE]
-        print(f"Processing batch {i//BATCH_SIZE + 1} ({len(batch)} cities)...")
+    # Batches of nearby locations, packed by spatial grid cell
+    for n, batch in enumerate(cities.grid_batches(BATCH_SIZE)):
+        print(f"Processing batch {n + 1} ({len(batch)} cities)...")
         
         data = fetch_weather_data_batch(batch)
         if data:
@@ -116,8 +480,114 @@ def main():
         
         # Respect rate limits (though batching helps, adding a small sleep is good practice)
         time.sleep(1) 
-        
+
+    # Store everything spooled by this run (and earlier runs that could not)
+    asyncio.run(drain_spool())
+    print("ETL pipeline completed.")
+
+async def main_async(cities=None, batch_size=BATCH_SIZE, max_concurrency=MAX_CONCURRENT_REQUESTS,
+                     requests_per_second=REQUESTS_PER_SECOND, burst=RATE_LIMIT_BURST, client=None):
+    """
+    Concurrent ETL: a bounded number of in-flight Open-Meteo requests over a pooled
+    keep-alive client. Fetched records go to the local spool, and a drainer stores them in
+    bulk alongside the fetches, so slow or failing writes never hold up fetching.
+
+    A long-running caller can pass its own httpx.AsyncClient to keep connections open across
+    runs. Returns the number of records spooled.
+    """
+    import httpx
+
+    cities = cities or get_locations()
+    batches = cities.grid_batches(batch_size)
+    print(f"Starting concurrent ETL pipeline for {len(cities)} cities in {len(batches)} batches "
+          f"(max {max_concurrency} in flight, {requests_per_second} req/s)...")
+
+    # Created here rather than by the drainer thread, and the spool before any fetch thread
+    if get_postgres_store() is None:
+        get_supabase()
+    get_spool()
+    limiter = TokenBucket(requests_per_second, burst)
+    fetch_semaphore = asyncio.Semaphore(max_concurrency)
+    limits = httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency)
+    fetched = asyncio.Event()
+    drainer = asyncio.create_task(drain_spool(stop=fetched))
+
+    async def fetch_and_spool(client, batch_number, batch):
+        data = await fetch_weather_data_batch_async(client, batch, limiter, fetch_semaphore)
+        if not data:
+            return 0
+        print(f"Fetched batch {batch_number} ({len(batch)} cities), spooling...")
+        return await asyncio.to_thread(process_and_store_data, data, batch)
+
+    async def fetch_all(client):
+        return await asyncio.gather(*(
+            fetch_and_spool(client, n + 1, batch) for n, batch in enumerate(batches)
+        ))
+
+    try:
+        if client is None:
+            async with httpx.AsyncClient(timeout=10, limits=limits) as client:
+                spooled = await fetch_all(client)
+        else:
+            spooled = await fetch_all(client)
+    finally:
+        fetched.set()
+        await drainer
+
     print("ETL pipeline completed.")
+    return sum(spooled)
+
+def rollup(rollup_after_hours=ROLLUP_AFTER_HOURS, raw_retention_days=RAW_RETENTION_DAYS,
+           hourly_retention_days=HOURLY_RETENTION_DAYS):
+    """
+    Refresh the hourly and daily weather tiers and prune expired raw and hourly rows.
+    """
+    store = get_postgres_store()
+    try:
+        if store is not None:
+            counts = store.rollup_weather(rollup_after_hours, raw_retention_days, hourly_retention_days)
+        else:
+            supabase = get_supabase()
+            if supabase is None:
+                return
+            counts = supabase.rpc("rollup_weather_data", {
+                "rollup_after": f"{rollup_after_hours} hours",
+                "raw_retention": f"{raw_retention_days} days",
+                "hourly_retention": f"{hourly_retention_days} days",
+            }).execute().data
+        print(f"Rollup: {counts['hourly_rows']} hourly and {counts['daily_rows']} daily buckets refreshed, "
+              f"{counts['raw_pruned']} raw and {counts['hourly_pruned']} hourly rows pruned.")
+    except Exception as e:
+        print(f"Error running weather rollup: {e}")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Open-Meteo weather ETL")
+    parser.add_argument("--concurrent", action="store_true",
+                        help="Fetch batches concurrently with asyncio instead of one after another")
+    parser.add_argument("--max-concurrency", type=int, default=MAX_CONCURRENT_REQUESTS)
+    parser.add_argument("--requests-per-second", type=float, default=REQUESTS_PER_SECOND)
+    parser.add_argument("--backfill", nargs=2, metavar=("START_DATE", "END_DATE"),
+                        help="Backfill history between two YYYY-MM-DD dates instead of ingesting current data")
+    parser.add_argument("--resolution", choices=sorted(HISTORY_URLS), default="hourly",
+                        help="Resolution of the backfilled history")
+    parser.add_argument("--cities", nargs="+", metavar="CITY",
+                        help="Only backfill these registered cities (all by default)")
+    parser.add_argument("--requeue-dead-letters", action="store_true",
+                        help="Move records the spool gave up on back into it before the run")
+    parser.add_argument("--rollup", action="store_true",
+                        help="Refresh the hourly/daily rollup tables and prune expired rows after the run")
+    return parser.parse_args()
 
 if __name__ == "__main__":
-    main()
+    args = parse_args()
+    if args.requeue_dead_letters:
+        print(f"Requeued {get_spool().requeue()} dead-lettered records.")
+    if args.backfill:
+        backfill(*args.backfill, resolution=args.resolution, cities=args.cities)
+    elif args.concurrent:
+        asyncio.run(main_async(max_concurrency=args.max_concurrency,
+                               requests_per_second=args.requests_per_second))
+    else:
+        main()
+    if args.rollup:
+        rollup()
@@ -0,0 +1,187 @@
+"""
+Durable local spool between fetching and storing weather records.
+
+Fetched records are appended to a SQLite table (WAL journal, fsync on commit) before any
+database write is attempted, so an upsert failure or a database outage delays records
+instead of losing them; Open-Meteo's `current` endpoint cannot be asked for them again.
+A drainer replays pending records in bulk. When the store is unreachable or failing it backs
+off exponentially as a whole and leaves the records untouched; when it rejects the records
+themselves, the batch is bisected until the rejected ones are isolated, and only those are
+moved to a dead-letter table instead of blocking the others.
+"""
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import threading
+
+SPOOL_PATH = os.getenv("ETL_SPOOL_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".state", "spool.sqlite3"))
+
+class Spool:
+    def __init__(self, path=SPOOL_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.lock = threading.Lock()
+        # Shared by the fetch threads and the drainer; every use is under self.lock
+        self.conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=FULL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS spool (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                record TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt REAL NOT NULL DEFAULT 0
+            )
+            """
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS spool_next_attempt ON spool(next_attempt, id)")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS dead_letters (
+                id INTEGER PRIMARY KEY,
+                record TEXT NOT NULL,
+                attempts INTEGER NOT NULL,
+                error TEXT,
+                failed_at REAL NOT NULL
+            )
+            """
+        )
+
+    def append(self, records):
+        """
+        Durably append records (JSON-serializable dicts) in one transaction.
+        """
+        if not records:
+            return 0
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            self.conn.executemany("INSERT INTO spool (record) VALUES (?)", ((json.dumps(r),) for r in records))
+            self.conn.execute("COMMIT")
+        return len(records)
+
+    def ready(self, limit):
+        """
+        Up to `limit` of the oldest records due for a (re)try, as (ids, records); None if none are.
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT id, record FROM spool WHERE next_attempt <= ? ORDER BY id LIMIT ?", (time.time(), limit)
+            ).fetchall()
+        if not rows:
+            return None
+        return [row[0] for row in rows], [json.loads(row[1]) for row in rows]
+
+    def ack(self, ids):
+        """
+        Remove records that were stored.
+        """
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            self.conn.executemany("DELETE FROM spool WHERE id = ?", ((i,) for i in ids))
+            self.conn.execute("COMMIT")
+
+    def dead_letter(self, ids, error):
+        """
+        Move records the store rejected out of the spool, keeping them for inspection and requeue().
+        """
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            self.conn.executemany(
+                "INSERT INTO dead_letters (id, record, attempts, error, failed_at) "
+                "SELECT id, record, attempts + 1, ?, ? FROM spool WHERE id = ?",
+                ((error, time.time(), i) for i in ids),
+            )
+            self.conn.executemany("DELETE FROM spool WHERE id = ?", ((i,) for i in ids))
+            self.conn.execute("COMMIT")
+
+    def requeue(self):
+        """
+        Put every dead-lettered record back in the spool with a fresh attempt count; returns
+        how many were requeued.
+        """
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            count = self.conn.execute("SELECT count(*) FROM dead_letters").fetchone()[0]
+            self.conn.execute("INSERT INTO spool (record) SELECT record FROM dead_letters ORDER BY id")
+            self.conn.execute("DELETE FROM dead_letters")
+            self.conn.execute("COMMIT")
+        return count
+
+    def dead_letters(self):
+        with self.lock:
+            return self.conn.execute("SELECT count(*) FROM dead_letters").fetchone()[0]
+
+    def pending(self):
+        with self.lock:
+            return self.conn.execute("SELECT count(*) FROM spool").fetchone()[0]
+
+    def next_ready_in(self):
+        """
+        Seconds until the next record is due (0 if one is due now), or None when empty.
+        """
+        with self.lock:
+            next_attempt = self.conn.execute("SELECT min(next_attempt) FROM spool").fetchone()[0]
+        return None if next_attempt is None else max(0.0, next_attempt - time.time())
+
+async def _store(spool, write, rejected, ids, records):
+    """
+    Write a batch, bisecting it while the store rejects its records, so the records that are
+    accepted are stored and only the rejected ones are dead-lettered. Returns how many were
+    stored; errors `rejected` does not recognise propagate with the unwritten part spooled.
+    """
+    try:
+        await asyncio.to_thread(write, records)
+    except Exception as e:
+        if not rejected(e):
+            raise
+        if len(ids) == 1:
+            print(f"Spooled record rejected by the store, moved to dead letters: {e} ({records[0]})")
+            await asyncio.to_thread(spool.dead_letter, ids, str(e))
+            return 0
+        half = len(ids) // 2
+        stored = await _store(spool, write, rejected, ids[:half], records[:half])
+        return stored + await _store(spool, write, rejected, ids[half:], records[half:])
+    await asyncio.to_thread(spool.ack, ids)
+    return len(ids)
+
+async def drain(spool, write, stop, batch_size, base_delay, max_delay, rejected, poll_interval=1.0):
+    """
+    Replay spooled records through `write(records)` (blocking; run in a thread) in batches of
+    up to `batch_size`, acknowledging them on success.
+
+    `rejected(error)` tells whether a failed write was refused because of the records
+    themselves (bad values, constraint violations): such a batch is bisected and the records
+    that keep being refused are dead-lettered. Any other error (connection failures, 5xx)
+    means the store is down, so the drainer as a whole waits base_delay * 2 ** failures
+    seconds (capped at max_delay) and retries the same records, which stay in the spool
+    untouched however long the outage lasts.
+
+    Runs until `stop` is set and the spool is empty, so callers bound it with a timeout;
+    whatever is left stays spooled for the next drain. Returns the number of records stored.
+    """
+    stored = 0
+    failures = 0
+    while True:
+        batch = await asyncio.to_thread(spool.ready, batch_size)
+        if batch:
+            try:
+                stored += await _store(spool, write, rejected, *batch)
+            except Exception as e:
+                delay = min(max_delay, base_delay * 2 ** failures)
+                failures += 1
+                print(f"Error storing spooled records (failure {failures}), retrying in {delay:.0f}s: {e}")
+                await asyncio.sleep(delay)
+            else:
+                failures = 0
+            continue
+
+        wait = spool.next_ready_in()
+        if stop.is_set() and wait is None:
+            return stored
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=poll_interval if wait is None else min(wait, poll_interval))
+        except asyncio.TimeoutError:
+            pass
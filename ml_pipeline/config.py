@@ -6,15 +6,80 @@ load_dotenv()
 # Database Configuration
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+# "postgres" reads and writes through a pooled direct connection (DATABASE_URL) with binary COPY
+# instead of PostgREST JSON; see etl/postgres_store.py
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "supabase")
+DATABASE_URL = os.getenv("DATABASE_URL")
+# Months of the partitioned predictions history older than this are dropped after each inference run
+PREDICTION_RETENTION_DAYS = 30
+
+# Rollup and Retention Configuration
+# rollup_weather_data() aggregates raw rows older than ROLLUP_AFTER_HOURS into hourly and daily
+# tiers, then prunes raw rows past RAW_RETENTION_DAYS and hourly rows past HOURLY_RETENTION_DAYS
+ROLLUP_AFTER_HOURS = 2
+RAW_RETENTION_DAYS = 90  # Also the longest history training sees at the 30-minute resolution
+HOURLY_RETENTION_DAYS = 365
+RESOLUTION_TABLES = {"raw": "weather_data", "hourly": "weather_data_hourly", "daily": "weather_data_daily"}
 
 # Data Configuration
 TARGET_VARIABLES = ["temperature", "humidity"]
 TIME_COL = "weather_timestamp"
 CITY_COL = "city"
+ID_COL = "id"
+INGESTION_COL = "ingestion_time"
+FETCH_PAGE_SIZE = 1000  # Rows per keyset page (keep <= the PostgREST max-rows setting)
+
+# Parallel Loading Configuration
+# Only the columns the pipeline uses are fetched (and cached), in compact dtypes
+PIPELINE_COLUMNS = [
+    "id", "city", "latitude", "longitude", "temperature", "humidity", "weather_timestamp", "ingestion_time"
+]
+MEASUREMENT_COLUMNS = ["latitude", "longitude", "temperature", "humidity"]
+LOAD_SHARDS = 8   # Time-range shards fetched concurrently
+LOAD_WORKERS = 4  # Threads fetching shards
+
+# Local History Cache Configuration
+# Day-partitioned Parquet copy of weather_data, synced incrementally on ingestion_time
+CACHE_DIR = os.getenv("WEATHER_CACHE_DIR", os.path.join(os.path.dirname(__file__), ".cache", "weather_data"))
+# Versioned trained models loaded by inference instead of retraining every run
+MODEL_REGISTRY_DIR = os.getenv("MODEL_REGISTRY_DIR", os.path.join(os.path.dirname(__file__), ".cache", "models"))
+# Persisted per-city ring buffers and running sums used to emit the latest features incrementally
+FEATURE_STATE_PATH = os.getenv("FEATURE_STATE_PATH", os.path.join(os.path.dirname(__file__), ".cache", "feature_state.npz"))
+
+# Out-of-core training: features are built a few cached day partitions at a time and streamed
+# into an XGBoost external-memory matrix, so peak memory does not grow with the history length
+STREAMING_TRAINING = False  # train_models.py --streaming turns it on for one run
+STREAM_CHUNK_DAYS = 7       # Day partitions per chunk
+STREAM_CACHE_DIR = os.getenv("STREAM_CACHE_DIR", os.path.join(os.path.dirname(__file__), ".cache", "external_memory"))
+
+# Scheduler Daemon Configuration
+# scheduler.py runs ETL -> feature update -> prediction in one long-lived process on a cron
+# schedule evaluated in local time, keeping models, clients and per-city state in memory
+SCHEDULER_CRON = os.getenv("SCHEDULER_CRON", "*/30 * * * *")
+# Full retraining (train_models.py) in the same process; runs reload the new version. Empty disables
+SCHEDULER_TRAIN_CRON = os.getenv("SCHEDULER_TRAIN_CRON", "0 3 * * *")
+SCHEDULER_TIMEZONE = os.getenv("SCHEDULER_TIMEZONE")  # IANA name; the system time zone when unset
+SCHEDULER_HEALTH_HOST = os.getenv("SCHEDULER_HEALTH_HOST", "127.0.0.1")
+SCHEDULER_HEALTH_PORT = int(os.getenv("SCHEDULER_HEALTH_PORT", "8080"))  # /healthz and /metrics
+SCHEDULER_ROLLUP = True  # Refresh the rollup tiers after each run's predictions are saved
+
+# Forecast horizons in grid steps: 30m, 60m, 120m
+HORIZONS = [1, 2, 4]
+HORIZON_LABELS = {1: "30m", 2: "60m", 4: "120m"}
 
 # Feature Engineering Configuration
 LAGS = [1, 2, 3]  # 30, 60, 90 minutes (assuming 30min freq)
 ROLLING_WINDOWS = [4, 12]  # 2 hours (4 * 30min), 6 hours (12 * 30min)
+GRID_FREQ = "30min"  # Regular time grid of the dense city x time x variable tensor
+
+# Neighbor Features Configuration
+# Inverse-distance weighted means of each target over the k nearest locations (haversine), at the
+# row's grid step and NEIGHBOR_LAGS steps earlier, from a kNN graph built once and cached on disk
+NEIGHBOR_K = 5
+NEIGHBOR_LAGS = [1, 2]
+NEIGHBOR_POWER = 1.0          # Weight = distance ** -power
+NEIGHBOR_MIN_DISTANCE_KM = 1.0  # Floor on distances, so co-located points get a finite weight
+NEIGHBOR_GRAPH_PATH = os.getenv("NEIGHBOR_GRAPH_PATH", os.path.join(os.path.dirname(__file__), ".cache", "neighbor_graph.npz"))
 
 # Model Configuration
 MODEL_PARAMS = {
@@ -35,6 +100,18 @@ MODEL_PARAMS = {
     }
 }
 
+# Multi-output mode: one XGBoost model over every (target, horizon) pair
+# "one_output_per_tree" grows one tree per output per round over shared histogram cuts;
+# "multi_output_tree" grows vector-leaf trees (fewer trees, but slower to fit on our features)
+MULTI_OUTPUT_STRATEGY = "one_output_per_tree"
+MULTI_OUTPUT_INFERENCE = True  # Inference trains a single multi-output model instead of one per output
+TREE_TABLE_INFERENCE = True  # Inference scores the registry's NumPy tree tables instead of loading native boosters
+
+# Boosting rounds added when a warm-started model is updated with new rows only
+WARM_START_ROUNDS = 20
+
 # Evaluation Configuration
+EVAL_THREAD_BUDGET = os.cpu_count() or 1  # Threads shared by all evaluation workers
+EVAL_WORKERS = min(4, EVAL_THREAD_BUDGET)  # Processes fitting (target, fold, horizon, model) tasks
 WALK_FORWARD_STEPS = 3  # Predict t+1, t+2, t+3
 TEST_SIZE_HOURS = 24  # Size of each fold in hours (example)
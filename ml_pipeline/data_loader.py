@@ -1,38 +1,71 @@
+import io
 import pandas as pd
-from supabase import create_client, Client
-from ml_pipeline.config import SUPABASE_URL, SUPABASE_KEY, TIME_COL
+from concurrent.futures import ThreadPoolExecutor
+from ml_pipeline.lazy import get_supabase, get_postgres_store
+from ml_pipeline.config import (
+    SUPABASE_URL, SUPABASE_KEY, STORAGE_BACKEND, TIME_COL, CITY_COL, ID_COL, INGESTION_COL, FETCH_PAGE_SIZE,
+    PIPELINE_COLUMNS, MEASUREMENT_COLUMNS, LOAD_SHARDS, LOAD_WORKERS, RESOLUTION_TABLES
+)
+
+def _rollup_frame(df):
+    """
+    Shape an hourly/daily aggregate frame like the raw one: `bucket` becomes the timestamp and
+    the means become the measurements; the min/max/sample_count columns are kept alongside.
+    """
+    df = df.rename(columns={"bucket": TIME_COL, "temperature_mean": "temperature", "humidity_mean": "humidity"})
+    df[TIME_COL] = pd.to_datetime(df[TIME_COL], utc=True)
+    df[CITY_COL] = df[CITY_COL].astype("category")
+    for col in df.columns:
+        if col not in (CITY_COL, TIME_COL, "sample_count"):
+            df[col] = df[col].astype("float32")
+    return df.sort_values(by=[TIME_COL, CITY_COL], kind="stable").reset_index(drop=True)
 
 class DataLoader:
     def __init__(self):
         if not SUPABASE_URL or not SUPABASE_KEY:
             raise ValueError("Supabase credentials not found in environment variables.")
-        self.supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 
-    def fetch_data(self, limit=50000):
+    @property
+    def supabase(self):
+        # Shared client, only created once a query is actually made
+        return get_supabase()
+
+    def fetch_data(self, limit=None, page_size=FETCH_PAGE_SIZE, sort_col=TIME_COL, after=None, columns=None):
         """
-        Fetch weather data from Supabase with pagination.
+        Fetch weather data from Supabase with keyset pagination on (sort_col, id).
+
+        Each page continues strictly after the last row of the previous one, so the
+        cost per page is constant and no rows are skipped or repeated.
+        `after` is an optional (sort_col value, id) key to start from, used for
+        incremental syncs on ingestion_time. `columns` projects the rows (all by default).
         """
         try:
             all_data = []
-            offset = 0
-            batch_size = 1000
+            last_key = after
             
-            print(f"Fetching up to {limit} records...")
+            print(f"Fetching {'all' if limit is None else f'up to {limit}'} records...")
             
-            while len(all_data) < limit:
-                # Fetch batch
-                response = self.supabase.table("weather_data") \
-                    .select("*") \
-                    .order(TIME_COL, desc=False) \
-                    .range(offset, offset + batch_size - 1) \
-                    .execute()
+            while limit is None or len(all_data) < limit:
+                batch_size = page_size if limit is None else min(page_size, limit - len(all_data))
+                query = self.supabase.table("weather_data") \
+                    .select(",".join(columns) if columns else "*") \
+                    .order(sort_col, desc=False) \
+                    .order(ID_COL, desc=False) \
+                    .limit(batch_size)
                 
-                batch = response.data
+                if last_key is not None:
+                    last_value, last_id = last_key
+                    query = query.or_(
+                        f'{sort_col}.gt."{last_value}",'
+                        f'and({sort_col}.eq."{last_value}",{ID_COL}.gt.{last_id})'
+                    )
+                
+                batch = query.execute().data
                 if not batch:
                     break
                     
                 all_data.extend(batch)
-                offset += len(batch)
+                last_key = (batch[-1][sort_col], batch[-1][ID_COL])
                 
                 if len(batch) < batch_size:
                     break
@@ -47,6 +80,8 @@ class DataLoader:
             
             # Convert timestamp to datetime
             df[TIME_COL] = pd.to_datetime(df[TIME_COL])
+            if INGESTION_COL in df.columns:
+                df[INGESTION_COL] = pd.to_datetime(df[INGESTION_COL])
             
             # Ensure unique index per city and time
             df = df.drop_duplicates(subset=["city", TIME_COL])
@@ -56,3 +91,246 @@ class DataLoader:
         except Exception as e:
             print(f"Error fetching data: {e}")
             return pd.DataFrame()
+
+    def _fetch_time_bound(self, desc):
+        response = self.supabase.table("weather_data") \
+            .select(TIME_COL) \
+            .order(TIME_COL, desc=desc) \
+            .limit(1) \
+            .execute()
+        return pd.Timestamp(response.data[0][TIME_COL]) if response.data else None
+
+    def _fetch_newest_key(self):
+        response = self.supabase.table("weather_data") \
+            .select(f"{INGESTION_COL},{ID_COL}") \
+            .order(INGESTION_COL, desc=True, nullsfirst=False) \
+            .order(ID_COL, desc=True) \
+            .limit(1) \
+            .execute()
+        if not response.data:
+            return None
+        return pd.Timestamp(response.data[0][INGESTION_COL]), response.data[0][ID_COL]
+
+    def _fetch_shard(self, columns, start, end, include_end, page_size):
+        """
+        Fetch one [start, end) time range as CSV pages, keyset-paginated on (weather_timestamp, id).
+        """
+        pages = []
+        last_key = None
+        select = ",".join(columns)
+        dtypes = {col: "float32" for col in MEASUREMENT_COLUMNS if col in columns}
+
+        while True:
+            query = self.supabase.table("weather_data") \
+                .select(select) \
+                .gte(TIME_COL, start.isoformat())
+            query = query.lte(TIME_COL, end.isoformat()) if include_end else query.lt(TIME_COL, end.isoformat())
+            if last_key is not None:
+                last_time, last_id = last_key
+                query = query.or_(
+                    f'{TIME_COL}.gt."{last_time}",'
+                    f'and({TIME_COL}.eq."{last_time}",{ID_COL}.gt.{last_id})'
+                )
+            text = query.order(TIME_COL, desc=False) \
+                .order(ID_COL, desc=False) \
+                .limit(page_size) \
+                .csv() \
+                .execute().data
+            if not text:
+                break
+
+            # Parse CSV straight into typed columns instead of a list of dicts.
+            page = pd.read_csv(io.StringIO(text), dtype=dtypes)
+            if page.empty:
+                break
+            pages.append(page)
+            last_key = (page[TIME_COL].iloc[-1], page[ID_COL].iloc[-1])
+
+            if len(page) < page_size:
+                break
+
+        return pages
+
+    def fetch_data_parallel(self, columns=PIPELINE_COLUMNS, n_shards=LOAD_SHARDS,
+                            max_workers=LOAD_WORKERS, page_size=FETCH_PAGE_SIZE):
+        """
+        Fetch weather data as concurrent time-range shards with a projected column set.
+
+        `city` is returned as a categorical and the measurements as float32, which keeps
+        the frame handed to feature engineering compact.
+
+        Shards are read at different moments, so with ingestion_time among the columns the
+        rows written after the fetch started are dropped: the result is then complete up to
+        its newest (ingestion_time, id) key, which an incremental sync can continue from.
+        """
+        columns = list(dict.fromkeys(list(columns) + [ID_COL, TIME_COL]))
+        try:
+            newest = self._fetch_newest_key() if INGESTION_COL in columns else None
+            start, end = self._fetch_time_bound(desc=False), self._fetch_time_bound(desc=True)
+            if start is None:
+                print("No data found in Supabase.")
+                return pd.DataFrame()
+
+            bounds = pd.date_range(start, end, periods=n_shards + 1) if end > start else pd.DatetimeIndex([start, end])
+            shards = [(bounds[i], bounds[i + 1], i == len(bounds) - 2) for i in range(len(bounds) - 1)]
+            print(f"Fetching {start} to {end} in {len(shards)} shards over {max_workers} threads...")
+
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                results = list(executor.map(
+                    lambda shard: self._fetch_shard(columns, *shard, page_size), shards
+                ))
+
+            pages = [page for shard_pages in results for page in shard_pages]
+            if not pages:
+                print("No data found in Supabase.")
+                return pd.DataFrame()
+
+            df = pd.concat(pages, ignore_index=True)
+            print(f"Total records fetched: {len(df)}")
+
+            df[TIME_COL] = pd.to_datetime(df[TIME_COL], utc=True)
+            if CITY_COL in df.columns:
+                df[CITY_COL] = df[CITY_COL].astype("category")
+            if INGESTION_COL in df.columns:
+                df[INGESTION_COL] = pd.to_datetime(df[INGESTION_COL], utc=True)
+                if newest is not None:
+                    newest_time, newest_id = newest
+                    later = (df[INGESTION_COL] > newest_time) | (
+                        (df[INGESTION_COL] == newest_time) & (df[ID_COL] > newest_id)
+                    )
+                    df = df[~later]
+            df = df.drop_duplicates(subset=[CITY_COL, TIME_COL])
+
+            return df
+
+        except Exception as e:
+            print(f"Error fetching data: {e}")
+            return pd.DataFrame()
+
+    def fetch_resolution(self, resolution="raw", start=None, page_size=FETCH_PAGE_SIZE):
+        """
+        Fetch weather data at "raw", "hourly" or "daily" resolution.
+
+        Raw rows come from weather_data (only kept for RAW_RETENTION_DAYS); the coarser tiers
+        come from the rollup tables, keyset-paginated on (bucket, city) as CSV.
+        `start` optionally limits the result to buckets at or after it.
+        """
+        if resolution not in RESOLUTION_TABLES:
+            raise ValueError(f"Unknown resolution: {resolution}")
+        if resolution == "raw":
+            df = self.fetch_data_parallel(page_size=page_size)
+            if start is not None and not df.empty:
+                df = df[df[TIME_COL] >= pd.Timestamp(start)].reset_index(drop=True)
+            return df
+
+        table = RESOLUTION_TABLES[resolution]
+        try:
+            pages = []
+            last_key = None
+            while True:
+                query = self.supabase.table(table).select("*")
+                if start is not None:
+                    query = query.gte("bucket", pd.Timestamp(start).isoformat())
+                if last_key is not None:
+                    last_bucket, last_city = last_key
+                    query = query.or_(
+                        f'bucket.gt."{last_bucket}",'
+                        f'and(bucket.eq."{last_bucket}",{CITY_COL}.gt."{last_city}")'
+                    )
+                text = query.order("bucket", desc=False) \
+                    .order(CITY_COL, desc=False) \
+                    .limit(page_size) \
+                    .csv() \
+                    .execute().data
+                if not text:
+                    break
+                page = pd.read_csv(io.StringIO(text), dtype={CITY_COL: str, "bucket": str})
+                if page.empty:
+                    break
+                pages.append(page)
+                last_key = (page["bucket"].iloc[-1], page[CITY_COL].iloc[-1])
+                if len(page) < page_size:
+                    break
+
+            if not pages:
+                print(f"No data found in {table}.")
+                return pd.DataFrame()
+            df = pd.concat(pages, ignore_index=True)
+            print(f"Total {resolution} records fetched: {len(df)}")
+            return _rollup_frame(df)
+
+        except Exception as e:
+            print(f"Error fetching data: {e}")
+            return pd.DataFrame()
+
+class PostgresLoader:
+    """
+    DataLoader counterpart that reads weather_data over a direct Postgres connection.
+
+    Rows arrive through one binary COPY stream per call instead of JSON/CSV pages, so
+    there is no pagination and no per-row parsing.
+    """
+    def __init__(self):
+        self.store = get_postgres_store()
+
+    def fetch_data(self, limit=None, page_size=None, sort_col=TIME_COL, after=None, columns=None):
+        """
+        Same contract as DataLoader.fetch_data; `after` is an (ingestion_time, id) key.
+        """
+        if after is not None and sort_col != INGESTION_COL:
+            raise ValueError("PostgresLoader only resumes after an ingestion_time key.")
+        try:
+            df = self.store.read_weather(after=after)
+        except Exception as e:
+            print(f"Error fetching data: {e}")
+            return pd.DataFrame()
+        print(f"Total records fetched: {len(df)}")
+        if df.empty:
+            return df
+
+        df = df.sort_values(by=[sort_col, ID_COL], kind="stable").reset_index(drop=True)
+        if limit is not None:
+            df = df.head(limit)
+        if columns:
+            df = df[columns]
+        return df.drop_duplicates(subset=[CITY_COL, TIME_COL])
+
+    def fetch_data_parallel(self, columns=PIPELINE_COLUMNS, **kwargs):
+        """
+        Same frame as DataLoader.fetch_data_parallel, from a single COPY stream. The stream
+        reads one snapshot, so it is always complete up to its newest ingestion_time key.
+        """
+        df = self.fetch_data()
+        if df.empty:
+            return df
+        columns = list(dict.fromkeys(list(columns) + [ID_COL, TIME_COL]))
+        df = df[columns].copy()
+        for col in MEASUREMENT_COLUMNS:
+            if col in df.columns:
+                df[col] = df[col].astype("float32")
+        return df
+
+    def fetch_resolution(self, resolution="raw", start=None, **kwargs):
+        """
+        Same contract as DataLoader.fetch_resolution, from a single COPY stream per tier.
+        """
+        if resolution not in RESOLUTION_TABLES:
+            raise ValueError(f"Unknown resolution: {resolution}")
+        if resolution == "raw":
+            df = self.fetch_data_parallel()
+            if start is not None and not df.empty:
+                df = df[df[TIME_COL] >= pd.Timestamp(start)].reset_index(drop=True)
+            return df
+        try:
+            df = self.store.read_rollup(RESOLUTION_TABLES[resolution], start=start)
+        except Exception as e:
+            print(f"Error fetching data: {e}")
+            return pd.DataFrame()
+        print(f"Total {resolution} records fetched: {len(df)}")
+        return df if df.empty else _rollup_frame(df)
+
+def make_loader():
+    """
+    Loader for the configured STORAGE_BACKEND.
+    """
+    return PostgresLoader() if STORAGE_BACKEND == "postgres" else DataLoader()
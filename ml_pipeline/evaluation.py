@@ -1,156 +1,284 @@
+import os
+import time
 import pandas as pd
 import numpy as np
-from sklearn.metrics import mean_absolute_error, mean_squared_error
-from ml_pipeline.models import MLModelWrapper, NaiveBaseline
-from ml_pipeline.config import MODEL_PARAMS, CITY_COL, TIME_COL
+from concurrent.futures import ProcessPoolExecutor
+from ml_pipeline.models import MLModelWrapper, MultiOutputModelWrapper, build_dataset, subset_dataset
+from ml_pipeline.config import MODEL_PARAMS, CITY_COL, TIME_COL, EVAL_WORKERS, EVAL_THREAD_BUDGET
+from ml_pipeline.tensor import WeatherTensor
+
+# Models compared in every (target, fold, horizon) cell, in report order
+EVAL_MODELS = [("Baseline", None), ("XGBoost", "xgboost"), ("LightGBM", "lightgbm")]
+# Single XGBoost model over every (target, horizon) output, compared when multi_output is on
+MULTI_OUTPUT_MODEL = ("XGBoost-MultiOutput", "xgboost-multi")
+
+# Matrices shared with worker processes, set once per worker by _init_worker
+_WORKER_DATA = {}
+
+def _init_worker(data):
+    _WORKER_DATA.update(data)
+
+def _score(y_true, pred):
+    """
+    (MAE, RMSE), computed in float64.
+    """
+    error = np.asarray(y_true, dtype=np.float64) - np.asarray(pred, dtype=np.float64)
+    return np.mean(np.abs(error)), np.sqrt(np.mean(error ** 2))
+
+def _multi_output_fold(models, fold, X_train, X_test, labels, train_slice, test_slice, n_jobs, warm_start):
+    """
+    Fit one multi-output model on the fold (rows where every label is present) and score
+    each (target, horizon) output from a single predict call.
+    """
+    keys = list(labels)
+    Y_train = np.column_stack([labels[key][train_slice] for key in keys])
+    train_valid = ~np.isnan(Y_train).any(axis=1)
+    if "multi" not in models and not train_valid.any():
+        return []
+
+    start = time.perf_counter()
+    if "multi" not in models:
+        params = dict(MODEL_PARAMS["xgboost"])
+        if n_jobs is not None:
+            params["n_jobs"] = n_jobs
+        models["multi"] = MultiOutputModelWrapper(keys, params, warm_start=warm_start)
+    model = models["multi"]
+    if train_valid.any():
+        rows = np.flatnonzero(train_valid)
+        X_fit = X_train if train_valid.all() else X_train[rows]
+        model.fit_dataset(build_dataset("xgboost", X_fit), Y_train[rows])
+    fit_seconds = time.perf_counter() - start
+    preds = model.predict_outputs(X_test)
+    total_seconds = time.perf_counter() - start
+
+    results = []
+    for (target_col, h), pred in preds.items():
+        y_test = labels[(target_col, h)][test_slice]
+        test_valid = ~np.isnan(y_test)
+        if not test_valid.any():
+            continue
+        mae, rmse = _score(y_test[test_valid], pred[test_valid])
+        results.append({
+            "fold": fold,
+            "horizon": h,
+            "model": MULTI_OUTPUT_MODEL[0],
+            "target": target_col,
+            "mae": mae,
+            "rmse": rmse,
+            # One fit serves every output, so its cost is shared between them
+            "fit_seconds": fit_seconds / len(preds),
+            "total_seconds": total_seconds / len(preds),
+        })
+    return results
+
+def _run_task(task):
+    """
+    Fit and score one model on its folds for every target and horizon.
+
+    Runs in a worker process (or inline when evaluating serially). Rows are sorted by
+    time, so a fold is the index range [0, train_end) for training and
+    [train_end, test_end) for testing: both are views into the shared float32 matrix.
+    The binned dataset is built once per fold and reused for every label whose rows
+    are all present; only the label changes between targets and horizons.
+
+    With warm_start the task holds all folds in order and each fold continues boosting
+    the previous fold's model on the rows added since, [previous train_end, train_end).
+    """
+    X = _WORKER_DATA["X"]
+    labels = _WORKER_DATA["labels"]
+    current = _WORKER_DATA["current"]
+    folds, model_name, model_type, n_jobs, warm_start = task
+
+    models = {}
+    results = []
+    train_start = 0
+
+    for fold, train_end, test_end in folds:
+        X_train, X_test = X[train_start:train_end], X[train_end:test_end]
+        dataset = None
+
+        if model_type == MULTI_OUTPUT_MODEL[1]:
+            results.extend(_multi_output_fold(
+                models, fold, X_train, X_test, labels,
+                slice(train_start, train_end), slice(train_end, test_end), n_jobs, warm_start
+            ))
+            if warm_start:
+                train_start = train_end
+            continue
+
+        for key, y in labels.items():
+            target_col, h = key
+            # Drop NaNs in target (mostly at the end of the series)
+            y_train, y_test = y[train_start:train_end], y[train_end:test_end]
+            train_valid, test_valid = ~np.isnan(y_train), ~np.isnan(y_test)
+            if not test_valid.any() or (key not in models and not train_valid.any()):
+                continue
+
+            start = time.perf_counter()
+            if model_type is None:
+                # Naive persistence: pred(T+h) = val(T), the most recent observation at T
+                pred = current[target_col][train_end:test_end]
+                fit_seconds = 0.0
+            else:
+                if key not in models:
+                    params = dict(MODEL_PARAMS[model_type])
+                    if n_jobs is not None:
+                        params["n_jobs"] = n_jobs
+                    models[key] = MLModelWrapper(model_type, params, warm_start=warm_start)
+                model = models[key]
+                if train_valid.any():
+                    if dataset is None:
+                        dataset = build_dataset(model_type, X_train)
+                    if train_valid.all():
+                        train_set, y_fit = dataset, y_train
+                    else:
+                        rows = np.flatnonzero(train_valid)
+                        train_set, y_fit = subset_dataset(model_type, dataset, X_train, rows), y_train[rows]
+                    model.fit_dataset(train_set, y_fit)
+                fit_seconds = time.perf_counter() - start
+                pred = model.predict(X_test)
+
+            mae, rmse = _score(y_test[test_valid], pred[test_valid])
+            results.append({
+                "fold": fold,
+                "horizon": h,
+                "model": model_name,
+                "target": target_col,
+                "mae": mae,
+                "rmse": rmse,
+                "fit_seconds": fit_seconds,
+                "total_seconds": time.perf_counter() - start,
+            })
+
+        if warm_start:
+            train_start = train_end
+
+    return results
 
 class Evaluator:
-    def __init__(self):
-        pass
+    def __init__(self, n_workers=EVAL_WORKERS, thread_budget=EVAL_THREAD_BUDGET, warm_start=False,
+                 multi_output=False):
+        """
+        n_workers: processes fitting models concurrently (1 evaluates in-process).
+        thread_budget: total threads shared by all workers; each model gets
+        thread_budget // n_workers threads so nested parallelism does not oversubscribe.
+        warm_start: continue each fold's models from the previous fold on the newly added
+        rows only, instead of refitting the whole expanding window.
+        multi_output: also evaluate a single XGBoost model over every (target, horizon)
+        output against the per-output models.
+        """
+        self.n_workers = max(1, n_workers)
+        self.thread_budget = max(1, thread_budget)
+        self.warm_start = warm_start
+        self.models = EVAL_MODELS + ([MULTI_OUTPUT_MODEL] if multi_output else [])
 
-    def evaluate_walk_forward(self, df, feature_cols, target_col, horizons=[1, 2, 4], n_splits=5):
+    def _folds(self, times, n_splits):
         """
-        Perform Walk-Forward Validation.
-        
-        horizons: list of steps to predict (e.g., [1, 2, 4] for 30m, 60m, 120m)
+        Split points for an expanding window: train until split_time, test until next_split_time.
         """
-        # Ensure data is sorted
-        df = df.sort_values(by=TIME_COL)
-        
         # Get unique timestamps to define splits
-        unique_times = df[TIME_COL].unique()
-        unique_times = np.sort(unique_times)
-        
+        unique_times = np.unique(times)
+
         # Define split points (simple approach: divide time range into n_splits + 1 chunks)
         # We start training with at least some data.
         n_samples = len(unique_times)
         fold_size = n_samples // (n_splits + 1)
-        
-        results = []
-        
-        print(f"Starting Walk-Forward Validation with {n_splits} splits...")
-        
+
+        folds = []
         for i in range(1, n_splits + 1):
-            split_idx = i * fold_size
-            split_time = unique_times[split_idx]
-            
-            print(f"Fold {i}/{n_splits}: Training until {split_time}")
-            
-            # Train/Test Split
-            train_mask = df[TIME_COL] <= split_time
-            # Test set: next 'fold_size' samples (or less for the last fold)
-            # Actually, walk-forward usually tests on the immediate next window.
-            # Let's define test window as the next fold_size time steps.
-            next_split_idx = min((i + 1) * fold_size, n_samples - 1)
-            next_split_time = unique_times[next_split_idx]
-            
-            test_mask = (df[TIME_COL] > split_time) & (df[TIME_COL] <= next_split_time)
-            
-            train_df = df[train_mask]
-            test_df = df[test_mask]
-            
-            if len(test_df) == 0:
+            split_time = unique_times[i * fold_size]
+            # Walk-forward tests on the immediate next window of fold_size time steps
+            next_split_time = unique_times[min((i + 1) * fold_size, n_samples - 1)]
+            if next_split_time <= split_time:
                 break
+            folds.append((i, split_time, next_split_time))
+        return folds
+
+    def _build_matrices(self, df, feature_cols, target_cols, horizons):
+        """
+        Feature matrix, labels and persistence values as contiguous float32 arrays sorted by time.
+        """
+        # Ensure data is sorted; rows with missing features can never be used
+        df = df.dropna(subset=feature_cols).sort_values(by=TIME_COL, kind="stable")
+
+        missing = [(t, h) for t in target_cols for h in horizons if f"target_{t}_h{h}" not in df.columns]
+        tensor = WeatherTensor.from_frame(df, variables=sorted({t for t, _ in missing})) if missing else None
 
+        labels = {}
+        for target_col in target_cols:
             for h in horizons:
-                # Prepare Targets for Horizon h
-                # We need to shift the target variable per city!
-                # But creating columns for every fold is inefficient.
-                # Better: The passed 'df' should already have the targets or we compute them on the fly.
-                # To be safe and correct with per-city shift:
-                
-                # We assume features are already prepared in 'df'.
-                # Now we need the target for horizon 'h'.
-                # Let's create a temporary target column for this horizon.
-                
-                # NOTE: This shifting should ideally be done before splitting to ensure consistency,
-                # but we must be careful not to leak data. 
-                # Actually, shifting -h means row T contains value at T+h.
-                # So if we split at T, row T is in Train. It contains y_{T+h}.
-                # This is "Direct Strategy". We train to predict T+h using info at T.
-                # So we can just use the shifted column.
-                
-                target_h_col = f"target_{target_col}_h{h}"
-                
-                # Check if target column exists, if not create it (inefficient to do in loop, but clear)
-                # Ideally, this should be done outside. I'll assume it's done outside or do it here carefully.
-                # Let's do it outside in the main script to avoid overhead.
-                # Assuming 'df' has 'target_{target_col}_h{h}'
-                
-                if target_h_col not in df.columns:
-                     # Fallback if not pre-calculated (for safety)
-                     # Group by city and shift
-                     df[target_h_col] = df.groupby(CITY_COL)[target_col].shift(-h)
-                     train_df = df[train_mask] # Re-slice
-                     test_df = df[test_mask]   # Re-slice
-                
-                # Drop NaNs in target (mostly at the end of the series)
-                train_data = train_df.dropna(subset=[target_h_col] + feature_cols)
-                test_data = test_df.dropna(subset=[target_h_col] + feature_cols)
-                
-                if len(train_data) == 0 or len(test_data) == 0:
-                    continue
-
-                X_train = train_data[feature_cols]
-                y_train = train_data[target_h_col]
-                X_test = test_data[feature_cols]
-                y_test = test_data[target_h_col]
-                
-                # --- Baseline ---
-                # Naive: Predict value at T (which is lag_0 or current value). 
-                # Since we are predicting T+h using data at T, the "most recent observation" is at T.
-                # The feature set should contain the current value.
-                # Let's assume the target_col itself (at T) is in features or available.
-                # Actually, in feature_engineering we usually keep the original columns.
-                # So X_test[target_col] is the value at T.
-                
-                # If target_col is in feature_cols, great. If not, we fetch it from test_data.
-                baseline_pred = test_data[target_col] # Persistence: pred(T+h) = val(T)
-                
-                mae_base = mean_absolute_error(y_test, baseline_pred)
-                rmse_base = np.sqrt(mean_squared_error(y_test, baseline_pred))
-                
-                results.append({
-                    "fold": i,
-                    "horizon": h,
-                    "model": "Baseline",
-                    "target": target_col,
-                    "mae": mae_base,
-                    "rmse": rmse_base
-                })
-                
-                # --- XGBoost ---
-                xgb_model = MLModelWrapper("xgboost", MODEL_PARAMS["xgboost"])
-                xgb_model.fit(X_train, y_train)
-                xgb_pred = xgb_model.predict(X_test)
-                
-                mae_xgb = mean_absolute_error(y_test, xgb_pred)
-                rmse_xgb = np.sqrt(mean_squared_error(y_test, xgb_pred))
-                
-                results.append({
-                    "fold": i,
-                    "horizon": h,
-                    "model": "XGBoost",
-                    "target": target_col,
-                    "mae": mae_xgb,
-                    "rmse": rmse_xgb
-                })
-                
-                # --- LightGBM ---
-                lgb_model = MLModelWrapper("lightgbm", MODEL_PARAMS["lightgbm"])
-                lgb_model.fit(X_train, y_train)
-                lgb_pred = lgb_model.predict(X_test)
-                
-                mae_lgb = mean_absolute_error(y_test, lgb_pred)
-                rmse_lgb = np.sqrt(mean_squared_error(y_test, lgb_pred))
-                
-                results.append({
-                    "fold": i,
-                    "horizon": h,
-                    "model": "LightGBM",
-                    "target": target_col,
-                    "mae": mae_lgb,
-                    "rmse": rmse_lgb
-                })
-        
-        return pd.DataFrame(results)
+                col = f"target_{target_col}_h{h}"
+                if col in df.columns:
+                    y = df[col]
+                else:
+                    y = tensor.horizon_targets(df, [h], variables=[target_col])[col]
+                labels[(target_col, h)] = np.ascontiguousarray(y.to_numpy(dtype=np.float32))
+
+        return {
+            "X": np.ascontiguousarray(df[feature_cols].to_numpy(dtype=np.float32)),
+            "times": df[TIME_COL].to_numpy(),
+            "labels": labels,
+            "current": {t: df[t].to_numpy(dtype=np.float32) for t in target_cols},
+        }
+
+    def evaluate_targets(self, df, feature_cols, target_cols, horizons=[1, 2, 4], n_splits=5):
+        """
+        Walk-Forward Validation of every target, fold, horizon and model.
+
+        Direct Strategy: row T holds the target at T+h in 'target_{target}_h{h}', so training
+        on rows up to the split time predicts T+h from information available at T. Missing
+        target columns are computed up front from the dense tensor.
+        """
+        data = self._build_matrices(df, feature_cols, target_cols, horizons)
+        times = data["times"]
+
+        folds = []
+        for i, split_time, next_split_time in self._folds(times, n_splits):
+            train_end = np.searchsorted(times, split_time, side="right")
+            test_end = np.searchsorted(times, next_split_time, side="right")
+            folds.append((i, train_end, test_end))
+
+        n_jobs = None if self.n_workers == 1 else max(1, self.thread_budget // self.n_workers)
+        if self.warm_start:
+            # Folds depend on each other, so each model walks through all of them in one task
+            tasks = [(folds, model_name, model_type, n_jobs, True) for model_name, model_type in self.models]
+        else:
+            tasks = [
+                ([fold], model_name, model_type, n_jobs, False)
+                for fold in folds
+                for model_name, model_type in self.models
+            ]
+
+        print(f"Starting Walk-Forward Validation with {n_splits} splits: {len(tasks)} tasks "
+              f"on {self.n_workers} worker(s)...")
+
+        if self.n_workers == 1:
+            _init_worker(data)
+            task_results = [_run_task(task) for task in tasks]
+        else:
+            with ProcessPoolExecutor(max_workers=self.n_workers, initializer=_init_worker,
+                                     initargs=(data,)) as executor:
+                # map preserves task order, so results are deterministic regardless of scheduling
+                task_results = list(executor.map(_run_task, tasks))
+
+        results = pd.DataFrame([r for task_result in task_results for r in task_result])
+        if results.empty:
+            return results
+
+        # Report order: target, fold, horizon, model
+        model_order = {name: n for n, (name, _) in enumerate(self.models)}
+        target_order = {t: n for n, t in enumerate(target_cols)}
+        results = results.sort_values(
+            by=["target", "fold", "horizon", "model"],
+            key=lambda col: col.map(target_order) if col.name == "target"
+            else col.map(model_order) if col.name == "model" else col,
+        )
+        return results.reset_index(drop=True)
+
+    def evaluate_walk_forward(self, df, feature_cols, target_col, horizons=[1, 2, 4], n_splits=5):
+        """
+        Perform Walk-Forward Validation.
+
+        horizons: list of steps to predict (e.g., [1, 2, 4] for 30m, 60m, 120m)
+        """
+        return self.evaluate_targets(df, feature_cols, [target_col], horizons=horizons, n_splits=n_splits)
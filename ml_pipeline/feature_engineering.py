@@ -1,17 +1,27 @@
 import pandas as pd
 import numpy as np
 from ml_pipeline.config import LAGS, ROLLING_WINDOWS, TIME_COL, CITY_COL
+from ml_pipeline.tensor import WeatherTensor
 
 class FeatureEngineer:
     def __init__(self):
         pass
 
-    def create_features(self, df: pd.DataFrame, target_cols=["temperature", "humidity"]):
+    def create_features(self, df: pd.DataFrame, target_cols=["temperature", "humidity"], tensor=None):
         """
-        Generate features for the given dataframe.
+        Generate features for the given dataframe from the dense city x time tensor.
+
+        Lags and windows are measured in grid steps rather than rows, so a missing
+        timestamp yields a NaN lag (and the row is dropped) instead of silently
+        pairing the row with an older observation, the same way horizon targets skip gaps.
+        `tensor` can be passed in when the caller already built it from `df`.
         """
-        df = df.copy()
+        # sort_values already returns a new frame, so no separate copy is needed
         df = df.sort_values(by=[CITY_COL, TIME_COL])
+        target_cols = list(target_cols)
+        if tensor is None or tensor.variables != target_cols:
+            tensor = WeatherTensor.from_frame(df, variables=target_cols)
+        city_idx, time_idx = tensor.locate(df)
         
         # 1. Temporal Variables
         df['hour'] = df[TIME_COL].dt.hour
@@ -21,33 +31,23 @@ class FeatureEngineer:
         df['hour_sin'] = np.sin(2 * np.pi * df['hour'] / 24)
         df['hour_cos'] = np.cos(2 * np.pi * df['hour'] / 24)
         
-        # 2. Lags and Rolling Windows (Per City)
-        # We need to ensure the time frequency is consistent (30 min)
-        # Resampling might be needed if there are gaps, but for now we assume consistent data
-        # or we treat the index as sequential steps.
-        
-        grouped = df.groupby(CITY_COL)
+        # 2. Lags and Rolling Windows as strided slices of the tensor
+        lags = {lag: tensor.gather(tensor.shift(lag), city_idx, time_idx) for lag in LAGS}
+        rolls = {
+            window: tuple(tensor.gather(stat, city_idx, time_idx) for stat in tensor.rolling(window))
+            for window in ROLLING_WINDOWS
+        }
         
-        feature_cols = []
-        
-        for target in target_cols:
-            # Lags
+        new_cols = {}
+        for t, target in enumerate(target_cols):
             for lag in LAGS:
-                col_name = f"{target}_lag_{lag}"
-                df[col_name] = grouped[target].shift(lag)
-                feature_cols.append(col_name)
-            
-            # Rolling Windows
+                new_cols[f"{target}_lag_{lag}"] = lags[lag][:, t]
             for window in ROLLING_WINDOWS:
-                # Rolling mean
-                col_mean = f"{target}_roll_mean_{window}"
-                df[col_mean] = grouped[target].transform(lambda x: x.rolling(window=window, min_periods=1).mean())
-                feature_cols.append(col_mean)
-                
-                # Rolling std
-                col_std = f"{target}_roll_std_{window}"
-                df[col_std] = grouped[target].transform(lambda x: x.rolling(window=window, min_periods=1).std())
-                feature_cols.append(col_std)
+                mean, std = rolls[window]
+                new_cols[f"{target}_roll_mean_{window}"] = mean[:, t]
+                new_cols[f"{target}_roll_std_{window}"] = std[:, t]
+        
+        df = pd.concat([df, pd.DataFrame(new_cols, index=df.index)], axis=1)
         
         # 3. Spatial Variables (already present: latitude, longitude)
         # We can ensure they are numeric
@@ -55,7 +55,7 @@ class FeatureEngineer:
         df['longitude'] = pd.to_numeric(df['longitude'])
         
         # 4. Preprocessing
-        # Drop rows with NaN created by lags (at the beginning of the series)
+        # Drop rows with NaN created by lags (at the beginning of the series and after gaps)
         # Alternatively, we could fill them, but for training it's better to drop
         df = df.dropna()
         
@@ -0,0 +1,277 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+from ml_pipeline.config import LAGS, ROLLING_WINDOWS, TARGET_VARIABLES, TIME_COL, CITY_COL, FEATURE_STATE_PATH, GRID_FREQ
+from ml_pipeline.neighbors import latest_neighbor_features
+
+class FeatureState:
+    """
+    Incremental per-city feature state for inference.
+
+    Keeps a ring buffer of the most recent grid steps per city and target (NaN for steps with no
+    observation), plus running sums, sums of squares and observation counts per rolling window,
+    so the latest feature vector of every city can be emitted without recomputing features over
+    the full history. Features match the ones FeatureEngineer.create_features produces for the
+    last row of each city: lags and windows count grid steps, not rows.
+    """
+    def __init__(self, target_cols=TARGET_VARIABLES, lags=LAGS, windows=ROLLING_WINDOWS, freq=GRID_FREQ):
+        self.target_cols = list(target_cols)
+        self.lags = list(lags)
+        self.windows = list(windows)
+        self.freq = pd.Timedelta(freq)
+        # Lag k needs the value k steps back; a window of w needs the value leaving it.
+        self.buffer_len = max(max(self.lags) + 1, max(self.windows))
+
+        self.cities = []
+        self.city_index = {}
+        n_targets = len(self.target_cols)
+        self.buffer = np.full((0, n_targets, self.buffer_len), np.nan)
+        self.pos = np.zeros(0, dtype=np.int64)
+        self.count = np.zeros(0, dtype=np.int64)  # Grid steps pushed
+        self.sums = np.zeros((0, n_targets, len(self.windows)))
+        self.sumsq = np.zeros((0, n_targets, len(self.windows)))
+        self.observed = np.zeros((0, n_targets, len(self.windows)), dtype=np.int64)
+        self.last_time = np.zeros(0, dtype=np.int64)
+        self.latitude = np.zeros(0)
+        self.longitude = np.zeros(0)
+
+    def config_key(self):
+        return {"target_cols": self.target_cols, "lags": self.lags, "windows": self.windows,
+                "freq": self.freq.isoformat()}
+
+    def _add_cities(self, names):
+        new = [name for name in names if name not in self.city_index]
+        if not new:
+            return
+        for name in new:
+            self.city_index[name] = len(self.cities)
+            self.cities.append(name)
+        n = len(new)
+        self.buffer = np.concatenate([self.buffer, np.full((n,) + self.buffer.shape[1:], np.nan)])
+        self.pos = np.concatenate([self.pos, np.zeros(n, dtype=np.int64)])
+        self.count = np.concatenate([self.count, np.zeros(n, dtype=np.int64)])
+        self.sums = np.concatenate([self.sums, np.zeros((n,) + self.sums.shape[1:])])
+        self.sumsq = np.concatenate([self.sumsq, np.zeros((n,) + self.sumsq.shape[1:])])
+        self.observed = np.concatenate([self.observed, np.zeros((n,) + self.observed.shape[1:], dtype=np.int64)])
+        self.last_time = np.concatenate([self.last_time, np.full(n, np.iinfo(np.int64).min)])
+        self.latitude = np.concatenate([self.latitude, np.full(n, np.nan)])
+        self.longitude = np.concatenate([self.longitude, np.full(n, np.nan)])
+
+    def _reset(self, idx):
+        self.buffer[idx] = np.nan
+        self.sums[idx] = 0
+        self.sumsq[idx] = 0
+        self.observed[idx] = 0
+
+    def _accumulate(self, idx, w, entering, leaving):
+        """
+        Window w of each city in `idx` gains `entering` and loses `leaving` (NaN: no observation).
+        """
+        enter_obs, leave_obs = ~np.isnan(entering), ~np.isnan(leaving)
+        entering, leaving = np.where(enter_obs, entering, 0.0), np.where(leave_obs, leaving, 0.0)
+        self.sums[idx, :, w] += entering - leaving
+        self.sumsq[idx, :, w] += entering ** 2 - leaving ** 2
+        self.observed[idx, :, w] += enter_obs.astype(np.int64) - leave_obs
+
+    def _push(self, idx, values):
+        """
+        Advance each city in `idx` by one grid step holding `values` (cities x targets, NaN
+        where the step has no observation).
+        """
+        pos = self.pos[idx]
+        for w, window in enumerate(self.windows):
+            self._accumulate(idx, w, values, self.buffer[idx, :, (pos - window) % self.buffer_len])
+        self.buffer[idx, :, pos] = values
+        self.pos[idx] = (pos + 1) % self.buffer_len
+        self.count[idx] += 1
+
+    def _replace_current(self, idx, values):
+        """
+        Overwrite the latest grid step of each city in `idx` (a later row in the same cell wins).
+        """
+        current = (self.pos[idx] - 1) % self.buffer_len
+        for w in range(len(self.windows)):
+            self._accumulate(idx, w, values, self.buffer[idx, :, current])
+        self.buffer[idx, :, current] = values
+
+    def update(self, df):
+        """
+        Apply new observations. Rows at or before a city's last applied timestamp are skipped,
+        so the full history can be passed in and only new rows take effect.
+        """
+        if df.empty:
+            return 0
+        self._add_cities(pd.unique(df[CITY_COL].astype(str)))
+
+        idx = df[CITY_COL].astype(str).map(self.city_index).to_numpy()
+        times = pd.DatetimeIndex(pd.to_datetime(df[TIME_COL], utc=True)).as_unit("ns").asi8
+        new = times > self.last_time[idx]
+        if not new.any():
+            return 0
+
+        freq = self.freq.value
+        rows = pd.DataFrame({
+            "idx": idx[new],
+            "time": times[new],
+            "step": times[new] // freq,
+            "latitude": df["latitude"].to_numpy(dtype=float)[new],
+            "longitude": df["longitude"].to_numpy(dtype=float)[new],
+        })
+        values = df[self.target_cols].to_numpy(dtype=float)[new]
+        order = np.lexsort((rows["time"].to_numpy(), rows["idx"].to_numpy()))
+        rows, values = rows.iloc[order].reset_index(drop=True), values[order]
+        # Several rows in one grid cell: the latest wins, as when the tensor is built
+        rows = rows.drop_duplicates(subset=["idx", "step"], keep="last")
+        values = values[rows.index.to_numpy()]
+        rows = rows.reset_index(drop=True)
+
+        row_idx, row_step = rows["idx"].to_numpy(), rows["step"].to_numpy()
+        started = self.count[row_idx] > 0
+        last_step = self.last_time[row_idx] // freq
+
+        # A later row in the cell of a city's latest step replaces that step
+        same = started & (row_step == last_step)
+        if same.any():
+            self._replace_current(row_idx[same], values[same])
+
+        ahead = ~same
+        if ahead.any():
+            row_idx, row_step, values = row_idx[ahead], row_step[ahead], values[ahead]
+            cities, city_pos = np.unique(row_idx, return_inverse=True)
+            end = pd.Series(row_step).groupby(city_pos).max().to_numpy()
+            prev = np.where(self.count[cities] > 0, self.last_time[cities] // freq, end - self.buffer_len)
+            # Only the last buffer_len steps of a city can influence its state; a longer jump
+            # displaces everything buffered, so those cities restart empty.
+            start = np.maximum(prev + 1, end - self.buffer_len + 1)
+            displaced = start > prev + 1
+            if displaced.any():
+                self._reset(cities[displaced])
+                self.count[cities[displaced]] += (start - prev - 1)[displaced]
+
+            # Steps to push per city, NaN where the grid step has no observation
+            n_push = end - start + 1
+            steps = np.full((len(cities), self.buffer_len, len(self.target_cols)), np.nan)
+            offset = row_step - start[city_pos]
+            keep = offset >= 0
+            steps[city_pos[keep], offset[keep]] = values[keep]
+            for k in range(int(n_push.max())):
+                step = k < n_push
+                self._push(cities[step], steps[step, k])
+
+        last = rows.groupby("idx").last()
+        city_idx = last.index.to_numpy()
+        self.last_time[city_idx] = last["time"].to_numpy()
+        self.latitude[city_idx] = last["latitude"].to_numpy()
+        self.longitude[city_idx] = last["longitude"].to_numpy()
+        return int(new.sum())
+
+    def resume_time(self):
+        """
+        Earliest last-applied timestamp over all cities (None when empty): rows before it
+        would be skipped by update(), so history older than it need not be read again.
+        """
+        if not self.cities:
+            return None
+        return pd.Timestamp(int(self.last_time.min()), tz="UTC")
+
+    def recent_values(self):
+        """
+        The buffered values of every city aligned on a common grid: (values, offsets), where
+        values[c, s] is city c's observation s grid steps before the newest timestamp of any
+        city (NaN if unknown) and offsets[c] is how many steps city c's latest row lags it.
+        """
+        n, length = len(self.cities), self.buffer_len
+        steps = self.last_time // self.freq.value
+        offsets = steps.max() - steps if n else steps
+        back = np.arange(length)
+        slots = (self.pos[:, None] - 1 - back) % length
+        # buffer[c, :, slot] for every (city, step back): (cities, steps, targets)
+        values = self.buffer[np.arange(n)[:, None], :, slots]
+        values[back >= np.minimum(self.count, length)[:, None]] = np.nan
+
+        aligned = np.full((n, length, len(self.target_cols)), np.nan)
+        step = offsets[:, None] + back
+        fits = step < length
+        aligned[np.broadcast_to(np.arange(n)[:, None], step.shape)[fits], step[fits]] = values[fits]
+        return aligned, offsets
+
+    def latest_features(self):
+        """
+        Latest feature vector per city, for cities whose own features are all defined: as in
+        training, a city whose latest lags or windows fall on missing grid steps is left out
+        until enough steps have been observed again.
+        """
+        ready = np.flatnonzero(self.count > 0)
+        if len(ready) == 0:
+            return pd.DataFrame()
+
+        timestamps = pd.to_datetime(self.last_time[ready], utc=True)
+        hour = timestamps.hour.to_numpy()
+        current = (self.pos[ready] - 1) % self.buffer_len
+
+        features = {
+            CITY_COL: [self.cities[i] for i in ready],
+            TIME_COL: timestamps,
+            "latitude": self.latitude[ready],
+            "longitude": self.longitude[ready],
+        }
+        for t, target in enumerate(self.target_cols):
+            features[target] = self.buffer[ready, t, current]
+        features["hour"] = hour
+        features["day_of_week"] = timestamps.dayofweek.to_numpy()
+        features["hour_sin"] = np.sin(2 * np.pi * hour / 24)
+        features["hour_cos"] = np.cos(2 * np.pi * hour / 24)
+
+        for t, target in enumerate(self.target_cols):
+            for lag in self.lags:
+                features[f"{target}_lag_{lag}"] = self.buffer[ready, t, (current - lag) % self.buffer_len]
+            for w, window in enumerate(self.windows):
+                n = self.observed[ready, t, w]
+                total = self.sums[ready, t, w]
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    mean = np.where(n >= 1, total / n, np.nan)
+                    var = np.where(n >= 2, np.maximum(self.sumsq[ready, t, w] - total * mean, 0) / (n - 1), np.nan)
+                features[f"{target}_roll_mean_{window}"] = mean
+                features[f"{target}_roll_std_{window}"] = np.sqrt(var)
+
+        # Neighbor means at each city's own latest step, as in training
+        recent, offsets = self.recent_values()
+        neighbors = latest_neighbor_features(self.cities, recent, offsets, target_cols=self.target_cols)
+        for col in neighbors.columns:
+            features[col] = neighbors[col].to_numpy()[ready]
+
+        features = pd.DataFrame(features)
+        own = [col for col in features.columns if col not in neighbors.columns]
+        return features[features[own].notna().all(axis=1)].reset_index(drop=True)
+
+    def save(self, path=FEATURE_STATE_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp.npz"
+        np.savez(
+            tmp_path,
+            config=json.dumps(self.config_key()),
+            cities=np.array(self.cities, dtype=str),
+            buffer=self.buffer, pos=self.pos, count=self.count,
+            sums=self.sums, sumsq=self.sumsq, observed=self.observed, last_time=self.last_time,
+            latitude=self.latitude, longitude=self.longitude,
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=FEATURE_STATE_PATH, **kwargs):
+        """
+        Load a persisted state, or start empty if none exists or its config has changed.
+        """
+        state = cls(**kwargs)
+        if not os.path.exists(path):
+            return state
+        with np.load(path) as data:
+            if json.loads(str(data["config"])) != state.config_key():
+                print("Feature state config changed, rebuilding from history.")
+                return state
+            state.cities = data["cities"].tolist()
+            state.city_index = {name: i for i, name in enumerate(state.cities)}
+            for name in ("buffer", "pos", "count", "sums", "sumsq", "observed", "last_time", "latitude", "longitude"):
+                setattr(state, name, data[name])
+        return state
@@ -0,0 +1,160 @@
+import os
+import glob
+import json
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from ml_pipeline.config import (
+    CACHE_DIR, TIME_COL, CITY_COL, ID_COL, INGESTION_COL, STREAM_CHUNK_DAYS, PIPELINE_COLUMNS, MEASUREMENT_COLUMNS
+)
+
+class HistoryCache:
+    """
+    On-disk Parquet copy of weather_data, partitioned by day of weather_timestamp.
+
+    A high-water mark on (ingestion_time, id) records how far the cache has been synced,
+    so later loads only transfer rows ingested since the previous run. Only PIPELINE_COLUMNS
+    are cached, with `city` as strings and the measurements as float32.
+    """
+    WATERMARK_FILE = "_watermark.json"
+
+    def __init__(self, loader=None, cache_dir=CACHE_DIR):
+        self.loader = loader
+        self.cache_dir = cache_dir
+
+    def _partition_path(self, day):
+        return os.path.join(self.cache_dir, f"day={day}", "data.parquet")
+
+    def read_watermark(self):
+        path = os.path.join(self.cache_dir, self.WATERMARK_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            mark = json.load(f)
+        return mark[INGESTION_COL], mark[ID_COL]
+
+    def _write_watermark(self, ingestion_time, row_id):
+        path = os.path.join(self.cache_dir, self.WATERMARK_FILE)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({INGESTION_COL: ingestion_time, ID_COL: row_id}, f)
+        os.replace(tmp_path, path)
+
+    def _write_partition(self, day, new_rows):
+        """
+        Merge new rows into a day partition; re-ingested (city, timestamp) rows replace old ones.
+        """
+        path = self._partition_path(day)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            existing = pq.read_table(path, memory_map=True).to_pandas()
+            new_rows = pd.concat([existing, new_rows], ignore_index=True)
+        new_rows = new_rows.drop_duplicates(subset=[CITY_COL, TIME_COL], keep="last")
+        new_rows = new_rows.sort_values(by=[TIME_COL, ID_COL])
+
+        tmp_path = path + ".tmp"
+        pq.write_table(pa.Table.from_pandas(new_rows, preserve_index=False), tmp_path)
+        os.replace(tmp_path, path)
+
+    def sync(self):
+        """
+        Fetch rows ingested after the watermark and merge them into the day partitions.
+
+        The first sync downloads the whole table as concurrent time-range shards; later ones
+        page through the rows ingested since, in (ingestion_time, id) order.
+        """
+        if self.loader is None:
+            raise ValueError("A DataLoader is required to sync the history cache.")
+
+        watermark = self.read_watermark()
+        print(f"Syncing history cache {'from scratch' if watermark is None else f'after {watermark[0]}'}...")
+        if watermark is None:
+            new_rows = self.loader.fetch_data_parallel(columns=PIPELINE_COLUMNS)
+        else:
+            new_rows = self.loader.fetch_data(sort_col=INGESTION_COL, after=watermark, columns=PIPELINE_COLUMNS)
+        if new_rows.empty:
+            return 0
+
+        # Same schema whichever loader and path fetched the rows, so partitions concatenate
+        new_rows = new_rows.astype({CITY_COL: str, **{col: "float32" for col in MEASUREMENT_COLUMNS}})
+        new_rows = new_rows.sort_values(by=[INGESTION_COL, ID_COL], na_position="first")
+        days = new_rows[TIME_COL].dt.strftime("%Y-%m-%d")
+        for day, rows in new_rows.groupby(days, sort=False):
+            self._write_partition(day, rows)
+
+        # Only advance the watermark once every partition is written. Rows without an
+        # ingestion time (older than the column) cannot set it; when there are only such rows
+        # the previous watermark stays.
+        stamped = new_rows[new_rows[INGESTION_COL].notna()]
+        if not stamped.empty:
+            last = stamped.iloc[-1]
+            self._write_watermark(pd.Timestamp(last[INGESTION_COL]).isoformat(), int(last[ID_COL]))
+        print(f"Cached {len(new_rows)} new records across {days.nunique()} day partitions.")
+        return len(new_rows)
+
+    def _partition_paths(self, since=None):
+        """
+        Day partition files, oldest first, optionally only days at or after `since`.
+        """
+        paths = sorted(glob.glob(os.path.join(self.cache_dir, "day=*", "data.parquet")))
+        if since is not None:
+            first = f"day={pd.Timestamp(since).strftime('%Y-%m-%d')}"
+            paths = [p for p in paths if os.path.basename(os.path.dirname(p)) >= first]
+        return paths
+
+    @staticmethod
+    def _concat_partitions(paths, columns=None):
+        """
+        Memory-mapped partitions as one table. Partitions cached before the schema was fixed
+        may hold extra columns, float64 measurements or a dictionary-encoded `city`; those
+        are unified instead of failing the read.
+        """
+        tables = []
+        for path in paths:
+            table = pq.read_table(path, columns=columns, memory_map=True)
+            for i, field in enumerate(table.schema):
+                if pa.types.is_dictionary(field.type):
+                    table = table.set_column(i, field.name, table.column(i).cast(field.type.value_type))
+            tables.append(table)
+        return pa.concat_tables(tables, promote_options="permissive")
+
+    def read(self, columns=None, since=None):
+        """
+        Read all cached partitions (or those from `since` on) memory-mapped into a single DataFrame.
+        """
+        paths = self._partition_paths(since)
+        if not paths:
+            return pd.DataFrame()
+        return self._concat_partitions(paths, columns).to_pandas()
+
+    def iter_chunks(self, days_per_chunk=STREAM_CHUNK_DAYS, columns=None, since=None):
+        """
+        Yield the cached history `days_per_chunk` day partitions at a time, oldest first.
+
+        Every chunk holds whole days, so all rows before a chunk's last day are in it or in
+        an earlier chunk; only one chunk is in memory at a time.
+        """
+        paths = self._partition_paths(since)
+        for i in range(0, len(paths), days_per_chunk):
+            yield self._concat_partitions(paths[i:i + days_per_chunk], columns).to_pandas()
+
+    def refresh(self):
+        """
+        Sync the cache if a loader is set; on failure keep serving what is cached. Returns the
+        number of new rows cached.
+        """
+        if self.loader is not None:
+            try:
+                return self.sync()
+            except Exception as e:
+                print(f"Error syncing history cache, using cached data: {e}")
+        return 0
+
+    def load(self, columns=None):
+        """
+        Sync the cache with Supabase and return the full history.
+        """
+        self.refresh()
+        df = self.read(columns=columns)
+        print(f"Loaded {len(df)} records from history cache.")
+        return df
@@ -8,121 +8,150 @@ from datetime import datetime, timezone
 # Ensure we can import from the current directory and siblings
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
-from ml_pipeline.config import TARGET_VARIABLES, CITY_COL, MODEL_PARAMS
-from ml_pipeline.data_loader import DataLoader
-from ml_pipeline.feature_engineering import FeatureEngineer
-from ml_pipeline.models import MLModelWrapper
-from etl.cities import CITIES
-from supabase import create_client
-
-# Supabase setup
-from dotenv import load_dotenv
-load_dotenv()
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
-supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+from ml_pipeline.config import (
+    TARGET_VARIABLES, HORIZONS, HORIZON_LABELS, TREE_TABLE_INFERENCE, STORAGE_BACKEND, PREDICTION_RETENTION_DAYS,
+    STREAMING_TRAINING
+)
+from ml_pipeline.data_loader import make_loader
+from ml_pipeline.history_cache import HistoryCache
+from ml_pipeline.feature_state import FeatureState
+from ml_pipeline.model_registry import ModelRegistry, ModelSchemaError
+from ml_pipeline.train_models import (
+    build_training_frame, train_models, train_models_streaming, predict_outputs, data_watermark
+)
+from ml_pipeline.lazy import get_supabase, get_postgres_store, get_locations
+
+def save_predictions(records):
+    """
+    Apply history retention, append the run to the predictions history, then upsert
+    latest_predictions (one row per city and model, read by the dashboard) in a single request.
+
+    The history is partitioned by month with no default partition, so maintenance runs first:
+    it creates the current month's partition the insert lands in, even without pg_cron.
+    """
+    if STORAGE_BACKEND == "postgres":
+        store = get_postgres_store()
+        dropped = store.maintain_predictions(PREDICTION_RETENTION_DAYS)
+        store.insert_predictions(records)
+        store.upsert_latest_predictions(records)
+    else:
+        supabase = get_supabase()
+        dropped = supabase.rpc("maintain_predictions", {"retention_days": PREDICTION_RETENTION_DAYS}).execute().data
+        supabase.table("predictions").insert(records).execute()
+        supabase.table("latest_predictions").upsert(records, on_conflict="city,model_type").execute()
+    if dropped:
+        print(f"🧹 Dropped {dropped} expired prediction history partitions.")
+
+def update_feature_state(cache, feature_state):
+    """
+    Apply the cached rows the feature state has not seen yet and persist it; returns the
+    number of rows applied.
+
+    The state only applies rows newer than what it has already seen, so only the day
+    partitions from its resume point on are read, one chunk at a time.
+    """
+    applied = sum(feature_state.update(chunk) for chunk in cache.iter_chunks(since=feature_state.resume_time()))
+    if feature_state.cities:
+        feature_state.save()
+    return applied
+
+def load_models(registry, cache, latest_features):
+    """
+    The latest compatible models (retrained on their own cron by scheduler.py, or by
+    train_models.py) as (models, feature_cols, version); trains and registers a version on
+    the full history when there is none yet.
+    """
+    try:
+        models, manifest = registry.load_latest(tree_tables=TREE_TABLE_INFERENCE)
+        feature_cols = manifest["feature_cols"]
+        missing = set(feature_cols) - set(latest_features.columns)
+        if missing:
+            raise ModelSchemaError(f"Model version {manifest['version']} expects missing features: {sorted(missing)}")
+        print(f"🧠 Loaded model version {manifest['version']} (trained on data up to {manifest['watermark']})")
+        return models, feature_cols, manifest["version"]
+    except ModelSchemaError as e:
+        # No usable version yet: train on the full history once and register the result
+        print(f"⚠️ {e}. Training XGBoost models...")
+        if STREAMING_TRAINING:
+            models, feature_cols, watermark = train_models_streaming(cache.iter_chunks)
+        else:
+            df = cache.read()
+            df_features, feature_cols = build_training_frame(df)
+            models = train_models(df_features, feature_cols)
+            watermark = data_watermark(df)
+        version = registry.save(models, feature_cols, watermark=watermark)
+        print(f"💾 Saved model version {version}")
+        return models, feature_cols, version
+
+def build_predictions(models, feature_cols, latest_features):
+    """
+    Prediction records (one per registered city) from every city's latest features.
+    """
+    # Only locations in the registry (O(1) lookup per city)
+    if len(latest_features):
+        latest_features = latest_features[get_locations().indices_of(latest_features['city']) >= 0]
+    if not len(latest_features):
+        return []
+
+    # One contiguous float32 matrix of every city's latest features, in training column order,
+    # scored by each model in a single call
+    X = np.ascontiguousarray(latest_features[feature_cols].to_numpy(dtype=np.float32))
+    output_preds = predict_outputs(models, X)
+
+    # Plain Python floats per output, assembled column-wise into the JSON records
+    columns = {key: np.asarray(pred, dtype=np.float64).tolist() for key, pred in output_preds.items()}
+    now = datetime.now(timezone.utc).isoformat()
+
+    # Construct records for 'predictions' table
+    # Table schema: id, user_id, city, model_type, prediction_results (jsonb), accuracy_score, created_at
+    # user_id is optional, can be null for system generated
+    return [
+        {
+            "city": city_name,
+            "model_type": "xgboost-ensemble",
+            "prediction_results": {
+                "timestamp": now,
+                "horizons": {
+                    HORIZON_LABELS[h]: {target: columns[(target, h)][i] for target in TARGET_VARIABLES}
+                    for h in HORIZONS
+                }
+            },
+            "created_at": now
+        }
+        for i, city_name in enumerate(latest_features['city'].tolist())
+    ]
 
 def main():
     print("🚀 Starting Inference for All Cities...")
 
-    # 1. Load historical data to train models
-    print("📥 Loading historical data...")
-    loader = DataLoader()
-    df = loader.fetch_data(limit=50000)
-    
-    if df.empty:
+    # 1. Sync the local history cache
+    print("📥 Syncing historical data...")
+    loader = make_loader()
+    cache = HistoryCache(loader)
+    cache.refresh()
+
+    # 2. Latest feature vector per city
+    print("🛠️ Updating feature state...")
+    feature_state = FeatureState.load()
+    applied = update_feature_state(cache, feature_state)
+    if not feature_state.cities:
         print("❌ No data found.")
         return
-
-    # 2. Feature Engineering
-    print("🛠️ Generating features...")
-    fe = FeatureEngineer()
-    df_features = fe.create_features(df, target_cols=TARGET_VARIABLES)
-    
-    # 3. Train Models (XGBoost) on full dataset
-    print("🧠 Training XGBoost models...")
-    models = {}
-    horizons = [1, 2, 4] # 30m, 60m, 120m
+    print(f"   Feature state updated with {applied} new rows.")
+    latest_features = feature_state.latest_features()
     
-    for target in TARGET_VARIABLES:
-        models[target] = {}
-        for h in horizons:
-            # Prepare target
-            target_col = f"target_{target}_h{h}"
-            df_features[target_col] = df_features.groupby(CITY_COL)[target].shift(-h)
-            
-            # Drop NaNs
-            train_data = df_features.dropna(subset=[target_col])
-            
-            # Features
-            metadata_cols = ['id', 'created_at', 'ingestion_time', 'data_source', 'weather_timestamp', 'city'] + [c for c in df_features.columns if c.startswith('target_')]
-            feature_cols = [c for c in df_features.columns if c not in metadata_cols]
-            
-            X = train_data[feature_cols]
-            y = train_data[target_col]
-            
-            model = MLModelWrapper("xgboost", MODEL_PARAMS["xgboost"])
-            model.fit(X, y)
-            models[target][h] = model
-            print(f"   ✅ Trained {target} model for horizon {h}")
+    # 3. Load the latest compatible models
+    models, feature_cols, _ = load_models(ModelRegistry(), cache, latest_features)
 
     # 4. Generate Predictions for Current State
     print("🔮 Generating predictions for all cities...")
-    
-    # We need the *latest* feature vector for each city
-    # Sort by time and take last row per city
-    latest_features = df_features.sort_values('weather_timestamp').groupby('city').tail(1)
-    
-    predictions_to_save = []
-    
-    for _, row in latest_features.iterrows():
-        city_name = row['city']
-        
-        # Find city metadata (lat/lon) from CITIES list for accuracy
-        city_meta = next((c for c in CITIES if c["name"] == city_name), None)
-        if not city_meta: continue
-
-        # Prepare input vector (same features as training)
-        # We need to construct a DataFrame with 1 row
-        input_features = row[feature_cols].to_frame().T
-        # Ensure numeric types
-        input_features = input_features.astype(float)
-        
-        pred_results = {
-            "timestamp": datetime.now(timezone.utc).isoformat(),
-            "horizons": {}
-        }
-        
-        for h in horizons:
-            horizon_label = "30m" if h == 1 else "60m" if h == 2 else "120m"
-            pred_results["horizons"][horizon_label] = {}
-            
-            for target in TARGET_VARIABLES:
-                model = models[target][h]
-                pred_val = model.predict(input_features)[0]
-                pred_results["horizons"][horizon_label][target] = float(pred_val)
-        
-        # Construct record for 'predictions' table
-        # Table schema: id, user_id, city, model_type, prediction_results (jsonb), accuracy_score, created_at
-        
-        record = {
-            "city": city_name,
-            "model_type": "xgboost-ensemble",
-            "prediction_results": pred_results,
-            "created_at": datetime.now(timezone.utc).isoformat()
-            # user_id is optional, can be null for system generated
-        }
-        predictions_to_save.append(record)
+    predictions_to_save = build_predictions(models, feature_cols, latest_features)
 
     # 5. Save to Supabase
     if predictions_to_save:
-        print(f"💾 Saving {len(predictions_to_save)} predictions to Supabase...")
+        print(f"💾 Saving {len(predictions_to_save)} predictions...")
         try:
-            # Insert in batches
-            batch_size = 50
-            for i in range(0, len(predictions_to_save), batch_size):
-                batch = predictions_to_save[i:i+batch_size]
-                supabase.table("predictions").insert(batch).execute()
+            save_predictions(predictions_to_save)
             print("✅ Predictions saved successfully!")
         except Exception as e:
             print(f"❌ Error saving predictions: {e}")
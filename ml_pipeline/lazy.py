@@ -0,0 +1,53 @@
+import sys
+import functools
+import importlib.util
+from ml_pipeline.config import SUPABASE_URL, SUPABASE_KEY, DATABASE_URL
+
+def lazy_import(name):
+    """
+    Module object whose import runs on first attribute access.
+
+    Lets modules refer to heavy libraries (xgboost, lightgbm) at module level while only
+    paying their import cost in code paths that actually use them.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named '{name}'", name=name)
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+@functools.lru_cache(maxsize=None)
+def get_supabase():
+    """
+    Supabase client shared by everything in the process, created on first use.
+    """
+    if not SUPABASE_URL or not SUPABASE_KEY:
+        raise ValueError("Supabase credentials not found in environment variables.")
+    from supabase import create_client
+    return create_client(SUPABASE_URL, SUPABASE_KEY)
+
+@functools.lru_cache(maxsize=None)
+def get_postgres_store():
+    """
+    Direct Postgres store shared by everything in the process, created on first use: the
+    ETL's own when STORAGE_BACKEND=postgres, so a process running both opens one pool.
+    """
+    from etl.main import get_postgres_store as etl_postgres_store
+    store = etl_postgres_store()
+    if store is None:
+        from etl.postgres_store import PostgresStore
+        store = PostgresStore(DATABASE_URL)
+    return store
+
+def get_locations():
+    """
+    Location registry shared by everything in the process (the ETL's): LOCATIONS_PATH if set,
+    otherwise CITIES.
+    """
+    from etl.main import get_locations as etl_locations
+    return etl_locations()
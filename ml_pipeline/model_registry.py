@@ -0,0 +1,148 @@
+import os
+import json
+import hashlib
+from datetime import datetime, timezone
+from ml_pipeline.config import (
+    MODEL_PARAMS, LAGS, ROLLING_WINDOWS, TARGET_VARIABLES, HORIZONS, MULTI_OUTPUT_STRATEGY, MODEL_REGISTRY_DIR,
+    NEIGHBOR_K, NEIGHBOR_LAGS, NEIGHBOR_POWER, GRID_FREQ
+)
+from ml_pipeline.tree_tables import export_tree_tables, TreeTableModel
+
+# Native file format per model type
+MODEL_FILE_EXTENSIONS = {"xgboost": "ubj", "lightgbm": "txt"}
+
+class ModelSchemaError(ValueError):
+    """
+    Raised when no stored model version matches the current feature and model configuration.
+    """
+
+def config_hash():
+    """
+    Hash of every setting that changes what a model expects as input or how it was trained.
+    """
+    config = {
+        "model_params": MODEL_PARAMS,
+        "lags": LAGS,
+        "rolling_windows": ROLLING_WINDOWS,
+        "grid_freq": GRID_FREQ,  # Lags and windows count steps of this grid
+        "target_variables": TARGET_VARIABLES,
+        "horizons": HORIZONS,
+        "multi_output_strategy": MULTI_OUTPUT_STRATEGY,
+        "neighbors": {"k": NEIGHBOR_K, "lags": NEIGHBOR_LAGS, "power": NEIGHBOR_POWER},
+    }
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()[:16]
+
+class ModelRegistry:
+    """
+    Versioned on-disk store of trained boosters.
+
+    Each version is a directory holding the boosters in their native formats (XGBoost UBJSON,
+    LightGBM text), the same models exported as NumPy tree tables, and a manifest with the
+    feature columns, the config hash and the watermark of the data the models were trained on.
+    """
+    MANIFEST_FILE = "manifest.json"
+
+    def __init__(self, registry_dir=MODEL_REGISTRY_DIR):
+        self.registry_dir = registry_dir
+
+    def versions(self):
+        """
+        Stored versions, newest first.
+        """
+        if not os.path.isdir(self.registry_dir):
+            return []
+        return sorted(
+            (d for d in os.listdir(self.registry_dir)
+             if os.path.exists(os.path.join(self.registry_dir, d, self.MANIFEST_FILE))),
+            reverse=True,
+        )
+
+    def save(self, models, feature_cols, watermark=None):
+        """
+        Store a dict of name -> MLModelWrapper as a new version and return its name.
+        """
+        version = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+        version_dir = os.path.join(self.registry_dir, version)
+        tmp_dir = version_dir + ".tmp"
+        os.makedirs(tmp_dir)
+
+        entries = {}
+        for name, model in models.items():
+            file_name = f"{name}.{MODEL_FILE_EXTENSIONS[model.model_type]}"
+            model.booster().save_model(os.path.join(tmp_dir, file_name))
+            entries[name] = {"model_type": model.model_type, "file": file_name, "params": model.params}
+            try:
+                export_tree_tables(model, os.path.join(tmp_dir, f"{name}.trees"))
+                entries[name]["tables"] = f"{name}.trees"
+            except ValueError as e:
+                print(f"Tree tables not exported for {name}: {e}")
+            if hasattr(model, "outputs"):
+                entries[name]["outputs"] = [list(output) for output in model.outputs]
+
+        manifest = {
+            "version": version,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "config_hash": config_hash(),
+            "feature_cols": list(feature_cols),
+            "watermark": None if watermark is None else str(watermark),
+            "models": entries,
+        }
+        with open(os.path.join(tmp_dir, self.MANIFEST_FILE), "w") as f:
+            json.dump(manifest, f, indent=2)
+
+        # The version only becomes visible once every file is written
+        os.replace(tmp_dir, version_dir)
+        return version
+
+    def _load_version(self, version, manifest, tree_tables=False):
+        version_dir = os.path.join(self.registry_dir, version)
+        if tree_tables and all("tables" in entry for entry in manifest["models"].values()):
+            # Memory-mapped NumPy tables: no booster library is imported or parsed
+            return {
+                name: TreeTableModel.load(os.path.join(version_dir, entry["tables"]))
+                for name, entry in manifest["models"].items()
+            }
+
+        import xgboost as xgb
+        import lightgbm as lgb
+        from ml_pipeline.models import MLModelWrapper, MultiOutputModelWrapper
+
+        models = {}
+        for name, entry in manifest["models"].items():
+            path = os.path.join(version_dir, entry["file"])
+            if "outputs" in entry:
+                model = MultiOutputModelWrapper([tuple(o) for o in entry["outputs"]], entry["params"])
+            else:
+                model = MLModelWrapper(entry["model_type"], entry["params"])
+            if entry["model_type"] == "xgboost":
+                model.model = xgb.Booster(model_file=path)
+            else:
+                model.model = lgb.Booster(model_file=path)
+            models[name] = model
+        return models
+
+    def load_latest(self, feature_cols=None, tree_tables=False):
+        """
+        Load the newest version trained with the current config (and, if given, on exactly
+        these feature columns). Returns (models, manifest).
+
+        With tree_tables the models are TreeTableModel instances scored with NumPy (predict
+        only, no warm start); versions saved without tables fall back to the native boosters.
+
+        Raises ModelSchemaError rather than returning models that expect different inputs.
+        """
+        current_hash = config_hash()
+        rejected = []
+        for version in self.versions():
+            with open(os.path.join(self.registry_dir, version, self.MANIFEST_FILE)) as f:
+                manifest = json.load(f)
+            if manifest["config_hash"] != current_hash:
+                rejected.append(f"{version}: config hash {manifest['config_hash']} != {current_hash}")
+                continue
+            if feature_cols is not None and manifest["feature_cols"] != list(feature_cols):
+                rejected.append(f"{version}: feature columns differ")
+                continue
+            return self._load_version(version, manifest, tree_tables), manifest
+
+        detail = "; ".join(rejected) if rejected else "registry is empty"
+        raise ModelSchemaError(f"No compatible model version in {self.registry_dir} ({detail})")
@@ -1,45 +1,164 @@
-from sklearn.base import BaseEstimator, RegressorMixin
-import xgboost as xgb
-import lightgbm as lgb
 import numpy as np
+from ml_pipeline.config import WARM_START_ROUNDS, MULTI_OUTPUT_STRATEGY
+from ml_pipeline.lazy import lazy_import
 
-class NaiveBaseline(BaseEstimator, RegressorMixin):
-    """
-    Naive Baseline Model: Predicts the last observed value.
-    """
-    def fit(self, X, y):
-        return self
+# Imported on first use, so loading this module (e.g. for tree-table inference) stays cheap
+xgb = lazy_import("xgboost")
+lgb = lazy_import("lightgbm")
 
-    def predict(self, X):
-        # Assuming the last observed value is one of the features.
-        # We need to know which feature corresponds to 't' (lag 0 or similar if available, otherwise lag 1)
-        # In our feature engineering, we generated lag_1, lag_2, etc.
-        # So the most recent known value is lag_1.
+def _define_naive_baseline():
+    from sklearn.base import BaseEstimator, RegressorMixin
+
+    class NaiveBaseline(BaseEstimator, RegressorMixin):
+        """
+        Naive Baseline Model: Predicts the last observed value.
+        """
+        def fit(self, X, y):
+            return self
+
+        def predict(self, X):
+            # Assuming the last observed value is one of the features.
+            # We need to know which feature corresponds to 't' (lag 0 or similar if available, otherwise lag 1)
+            # In our feature engineering, we generated lag_1, lag_2, etc.
+            # So the most recent known value is lag_1.
         
-        # We need to identify the column index or name for lag_1 of the target variable.
-        # This implementation assumes X is a DataFrame and has a column ending in '_lag_1' 
-        # that matches the target we are predicting.
+            # We need to identify the column index or name for lag_1 of the target variable.
+            # This implementation assumes X is a DataFrame and has a column ending in '_lag_1' 
+            # that matches the target we are predicting.
         
-        # This is a simplification. The caller should ensure X contains the reference value.
-        # For a generic 'predict' we might need to be passed the specific column name.
-        pass
+            # This is a simplification. The caller should ensure X contains the reference value.
+            # For a generic 'predict' we might need to be passed the specific column name.
+            pass
+
+    NaiveBaseline.__qualname__ = "NaiveBaseline"  # Picklable as ml_pipeline.models.NaiveBaseline
+    return NaiveBaseline
+
+def __getattr__(name):
+    # NaiveBaseline is a scikit-learn estimator (get_params, set_params, score, clone), so it is
+    # only defined on first access: importing this module must not load scikit-learn
+    if name == "NaiveBaseline":
+        global NaiveBaseline
+        NaiveBaseline = _define_naive_baseline()
+        return NaiveBaseline
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def build_dataset(model_type, X, reference=None):
+    """
+    Build the binned training dataset for a model type from a float32 feature matrix.
+
+    The dataset is built without a label so it can be reused across targets and horizons
+    with only the label swapped (see MLModelWrapper.fit_dataset). A `reference` dataset
+    shares its bin boundaries with the new one.
+    """
+    if model_type == 'xgboost':
+        return xgb.QuantileDMatrix(X, ref=reference)
+    elif model_type == 'lightgbm':
+        dataset = lgb.Dataset(X, reference=reference, params={"verbose": -1}, free_raw_data=False)
+        return dataset.construct()
+    else:
+        raise ValueError(f"Unknown model type: {model_type}")
+
+def subset_dataset(model_type, dataset, X, rows):
+    """
+    Dataset restricted to `rows` of X, reusing the bins of `dataset`.
+    """
+    if model_type == 'xgboost':
+        return xgb.QuantileDMatrix(X[rows], ref=dataset)
+    elif model_type == 'lightgbm':
+        return dataset.subset(rows).construct()
+    else:
+        raise ValueError(f"Unknown model type: {model_type}")
 
 class MLModelWrapper:
-    def __init__(self, model_type, params):
+    def __init__(self, model_type, params, warm_start=False, warm_start_rounds=WARM_START_ROUNDS):
+        """
+        warm_start: when the wrapper already holds a trained model, fit() and fit_dataset()
+        continue boosting from it on the rows they are given (only the new ones) instead of
+        training from scratch, adding `warm_start_rounds` trees.
+        """
         self.model_type = model_type
         self.params = params
+        self.warm_start = warm_start
+        self.warm_start_rounds = warm_start_rounds
         self.model = None
 
+    def booster(self):
+        """
+        Native booster of the trained model, whichever API trained it.
+        """
+        if isinstance(self.model, (xgb.Booster, lgb.Booster)):
+            return self.model
+        if isinstance(self.model, xgb.XGBRegressor):
+            return self.model.get_booster()
+        if isinstance(self.model, lgb.LGBMRegressor):
+            return self.model.booster_
+        return None
+
+    def _continuing(self):
+        return self.warm_start and self.model is not None
+
     def fit(self, X, y):
+        params = dict(self.params)
+        init_model = None
+        if self._continuing():
+            init_model = self.booster()
+            params["n_estimators"] = self.warm_start_rounds
+
         if self.model_type == 'xgboost':
-            self.model = xgb.XGBRegressor(**self.params)
+            self.model = xgb.XGBRegressor(**params)
+            self.model.fit(X, y, xgb_model=init_model)
         elif self.model_type == 'lightgbm':
-            self.model = lgb.LGBMRegressor(**self.params)
+            self.model = lgb.LGBMRegressor(**params)
+            self.model.fit(X, y, init_model=init_model)
         else:
             raise ValueError(f"Unknown model type: {self.model_type}")
             
-        self.model.fit(X, y)
+        return self
+
+    def fit_dataset(self, dataset, y=None):
+        """
+        Train through the native API on a prebuilt dataset (see build_dataset), setting
+        `y` as its label unless the dataset already carries one (e.g. an external-memory
+        matrix built from labelled chunks). Produces the same model as fit() on the same data.
+        """
+        params = dict(self.params)
+        num_boost_round = params.pop("n_estimators", 100)
+        init_model = None
+        if self._continuing():
+            init_model = self.booster()
+            num_boost_round = self.warm_start_rounds
+
+        if y is not None:
+            dataset.set_label(y)
+        if self.model_type == 'xgboost':
+            self.model = xgb.train(params, dataset, num_boost_round=num_boost_round, xgb_model=init_model)
+        elif self.model_type == 'lightgbm':
+            self.model = lgb.train(params, dataset, num_boost_round=num_boost_round, init_model=init_model)
+        else:
+            raise ValueError(f"Unknown model type: {self.model_type}")
         return self
 
     def predict(self, X):
+        if isinstance(self.model, xgb.Booster):
+            return self.model.inplace_predict(X)
         return self.model.predict(X)
+
+class MultiOutputModelWrapper(MLModelWrapper):
+    """
+    One XGBoost model over several (target, horizon) outputs.
+
+    The label is a stacked matrix with one column per output, so the quantized dataset and
+    histogram cuts are built once and a single predict call returns every output. The
+    'multi_output_tree' strategy grows vector-leaf trees instead of one tree per output.
+    """
+    def __init__(self, outputs, params, strategy=MULTI_OUTPUT_STRATEGY, **kwargs):
+        params = dict(params, multi_strategy=strategy, tree_method="hist")
+        super().__init__("xgboost", params, **kwargs)
+        self.outputs = list(outputs)
+
+    def predict_outputs(self, X):
+        """
+        Predictions as {(target, horizon): array}.
+        """
+        pred = np.asarray(self.predict(X)).reshape(len(X), len(self.outputs))
+        return {output: pred[:, k] for k, output in enumerate(self.outputs)}
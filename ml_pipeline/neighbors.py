@@ -0,0 +1,167 @@
+import os
+import json
+import hashlib
+import functools
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from ml_pipeline.config import (
+    NEIGHBOR_K, NEIGHBOR_LAGS, NEIGHBOR_POWER, NEIGHBOR_MIN_DISTANCE_KM, NEIGHBOR_GRAPH_PATH, TARGET_VARIABLES
+)
+from ml_pipeline.lazy import get_locations
+
+class NeighborGraph:
+    """
+    Sparse k-nearest-neighbor graph over the location registry.
+
+    Row i holds the inverse-distance weights of location i's k nearest other locations, so
+    neighbor aggregates for every location and time step are one sparse-dense product over
+    a (locations, ...) value array instead of a loop over locations.
+    """
+    def __init__(self, names, weights, key):
+        self.names = pd.Index(names)
+        self.weights = weights.tocsr()
+        self.key = key
+
+    @staticmethod
+    def graph_key(registry, k, power, min_distance_km):
+        """
+        Hash of everything the graph depends on; a cached graph is only reused if it matches.
+        """
+        digest = hashlib.sha256()
+        digest.update(json.dumps({"k": k, "power": power, "min_distance_km": min_distance_km}).encode())
+        digest.update("\0".join(registry.names.tolist()).encode())
+        digest.update(registry.latitude.tobytes())
+        digest.update(registry.longitude.tobytes())
+        return digest.hexdigest()[:16]
+
+    @classmethod
+    def build(cls, registry, k=NEIGHBOR_K, power=NEIGHBOR_POWER, min_distance_km=NEIGHBOR_MIN_DISTANCE_KM):
+        n = len(registry)
+        key = cls.graph_key(registry, k, power, min_distance_km)
+        k = min(k, n - 1)
+        if k <= 0:
+            return cls(registry.names, sp.csr_matrix((n, n)), key)
+
+        # k + 1 nearest includes the location itself; drop it (or the farthest hit if a
+        # co-located point came first)
+        idx, dist = registry.nearest(registry.latitude, registry.longitude, k=k + 1)
+        idx, dist = idx.reshape(n, k + 1), dist.reshape(n, k + 1)
+        is_self = idx == np.arange(n)[:, None]
+        drop = np.where(is_self.any(axis=1), is_self.argmax(axis=1), k)
+        keep = np.ones_like(is_self)
+        keep[np.arange(n), drop] = False
+        cols, dist = idx[keep].reshape(n, k), dist[keep].reshape(n, k)
+
+        weights = np.maximum(dist, min_distance_km) ** -power
+        rows = np.repeat(np.arange(n), k)
+        return cls(registry.names, sp.csr_matrix((weights.ravel(), (rows, cols.ravel())), shape=(n, n)), key)
+
+    def save(self, path=NEIGHBOR_GRAPH_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp.npz"
+        w = self.weights
+        np.savez(tmp_path, key=self.key, names=np.array(self.names, dtype=str),
+                 data=w.data, indices=w.indices, indptr=w.indptr, shape=np.array(w.shape))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load_or_build(cls, registry, path=NEIGHBOR_GRAPH_PATH, k=NEIGHBOR_K, power=NEIGHBOR_POWER,
+                      min_distance_km=NEIGHBOR_MIN_DISTANCE_KM):
+        """
+        The cached graph if it was built from the same locations and settings, else a new one
+        (which is then cached).
+        """
+        key = cls.graph_key(registry, k, power, min_distance_km)
+        if os.path.exists(path):
+            with np.load(path) as data:
+                if str(data["key"]) == key:
+                    weights = sp.csr_matrix((data["data"], data["indices"], data["indptr"]), shape=tuple(data["shape"]))
+                    return cls(data["names"].tolist(), weights, key)
+        graph = cls.build(registry, k, power, min_distance_km)
+        graph.save(path)
+        return graph
+
+    def weighted_mean(self, values):
+        """
+        Weighted mean over each location's neighbors of a (locations, ...) array, ignoring
+        missing (NaN) neighbor values; NaN where no neighbor is observed.
+        """
+        flat = values.reshape(len(values), -1)
+        observed = ~np.isnan(flat)
+        total = self.weights @ np.where(observed, flat, 0.0)
+        weight = self.weights @ observed.astype(flat.dtype)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = total / weight
+        mean[weight == 0] = np.nan
+        return mean.reshape(values.shape)
+
+    def scatter(self, names, values):
+        """
+        Place per-city arrays (in `names` order) on the graph's location axis; cities outside
+        the registry are left out and locations without data are NaN.
+        """
+        idx = self.names.get_indexer(pd.Index(names).astype(str))
+        known = idx >= 0
+        out = np.full((len(self.names),) + values.shape[1:], np.nan, dtype=np.float64)
+        out[idx[known]] = values[known]
+        return out, idx
+
+@functools.lru_cache(maxsize=None)
+def get_neighbor_graph():
+    """
+    Neighbor graph of the location registry, loaded from (or built into) NEIGHBOR_GRAPH_PATH once
+    per process.
+    """
+    return NeighborGraph.load_or_build(get_locations())
+
+def neighbor_feature_names(target_cols=TARGET_VARIABLES, lags=NEIGHBOR_LAGS):
+    names = []
+    for target in target_cols:
+        names.append(f"{target}_nbr_mean")
+        names += [f"{target}_nbr_mean_lag_{lag}" for lag in lags]
+    return names
+
+def neighbor_features(tensor, df, graph=None, lags=NEIGHBOR_LAGS):
+    """
+    Neighbor features for each row of `df` from the dense tensor: the neighbors' weighted mean
+    of every tensor variable at the row's grid step and `lags` steps earlier.
+    """
+    graph = graph or get_neighbor_graph()
+    values, idx = graph.scatter(tensor.cities, tensor.values)
+    # (locations, times, variables) -> weighted neighbor mean at every grid step in one product
+    mean = graph.weighted_mean(values)
+    per_city = np.full(tensor.values.shape, np.nan)
+    per_city[idx >= 0] = mean[idx[idx >= 0]]
+
+    city_idx, time_idx = tensor.locate(df)
+    columns = {}
+    for lag in [0] + list(lags):
+        gathered = tensor.gather(tensor.shift(lag, per_city), city_idx, time_idx)
+        for v, variable in enumerate(tensor.variables):
+            name = f"{variable}_nbr_mean" if lag == 0 else f"{variable}_nbr_mean_lag_{lag}"
+            columns[name] = gathered[:, v]
+    return pd.DataFrame(columns, index=df.index)[neighbor_feature_names(tensor.variables, lags)]
+
+def latest_neighbor_features(cities, recent, offsets, graph=None, lags=NEIGHBOR_LAGS, target_cols=TARGET_VARIABLES):
+    """
+    Neighbor features at each city's latest step from time-aligned recent values.
+
+    recent: (cities, steps, targets) values at `steps` grid steps back from a common reference
+    time (NaN where unknown); offsets: steps between the reference time and each city's
+    latest observation.
+    """
+    graph = graph or get_neighbor_graph()
+    values, idx = graph.scatter(cities, recent)
+    mean = graph.weighted_mean(values)
+
+    columns = {}
+    for lag in [0] + list(lags):
+        step = offsets + lag
+        valid = (idx >= 0) & (step < recent.shape[1])
+        out = np.full((len(cities), len(target_cols)), np.nan)
+        out[valid] = mean[idx[valid], step[valid]]
+        for t, target in enumerate(target_cols):
+            name = f"{target}_nbr_mean" if lag == 0 else f"{target}_nbr_mean_lag_{lag}"
+            columns[name] = out[:, t]
+    return pd.DataFrame(columns)[neighbor_feature_names(target_cols, lags)]
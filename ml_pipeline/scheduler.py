@@ -0,0 +1,479 @@
+"""
+Long-running scheduler: ETL -> incremental feature update -> prediction in one process.
+
+Each run fetches the current observations, stores them through the spool, syncs only the new
+rows into the history cache, applies them to the in-memory feature state and scores every
+city with models that stay loaded between runs. HTTP and database clients, the location
+registry and the per-city state are created once, so a run costs seconds instead of a cold
+job's dependency install, imports and history reload.
+
+Runs fire on a five-field cron expression (minute hour day-of-month month day-of-week)
+evaluated in local time. A second expression retrains the models on the shared history cache;
+the next run picks up the new version. GET /healthz returns the last run's status and
+GET /metrics exposes counters and stage timings in the Prometheus text format.
+
+    python ml_pipeline/scheduler.py [--cron "*/30 * * * *"] [--train-cron "0 3 * * *"] [--once] [--no-rollup]
+"""
+import os
+import sys
+import json
+import time
+import signal
+import asyncio
+import argparse
+import threading
+import traceback
+from datetime import datetime, timedelta, timezone, time as dtime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Ensure we can import from the current directory and siblings
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from etl import main as etl_main
+from ml_pipeline.config import (
+    SCHEDULER_CRON, SCHEDULER_TRAIN_CRON, SCHEDULER_TIMEZONE, SCHEDULER_HEALTH_HOST, SCHEDULER_HEALTH_PORT,
+    SCHEDULER_ROLLUP
+)
+from ml_pipeline.data_loader import make_loader
+from ml_pipeline.history_cache import HistoryCache
+from ml_pipeline.feature_state import FeatureState
+from ml_pipeline.model_registry import ModelRegistry
+from ml_pipeline.inference_all_cities import update_feature_state, load_models, build_predictions, save_predictions
+from ml_pipeline.train_models import main as train_main
+from ml_pipeline.lazy import get_locations
+
+# (name, lowest, highest) of the cron fields; day of week 7 is Sunday like 0
+CRON_FIELDS = [("minute", 0, 59), ("hour", 0, 23), ("day of month", 1, 31), ("month", 1, 12), ("day of week", 0, 7)]
+
+def local_timezone(name=SCHEDULER_TIMEZONE):
+    """
+    Time zone cron expressions are evaluated in: `name`, else TZ, else the system zone
+    (/etc/localtime), so fire times follow DST changes. Falls back to the current UTC offset.
+    """
+    from zoneinfo import ZoneInfo
+
+    if name:
+        return ZoneInfo(name)
+    try:
+        if os.getenv("TZ"):
+            return ZoneInfo(os.getenv("TZ").lstrip(":"))
+        with open("/etc/localtime", "rb") as f:
+            return ZoneInfo.from_file(f, key="localtime")
+    except (OSError, ValueError):
+        return datetime.now().astimezone().tzinfo
+
+def _parse_cron_field(expression, name, low, high):
+    values = set()
+    for part in expression.split(","):
+        try:
+            base, stepped, step = part.partition("/")
+            step = int(step) if stepped else 1
+            if base == "*":
+                start, end = low, high
+            elif "-" in base:
+                start, end = (int(v) for v in base.split("-", 1))
+            else:
+                # "5/15" means every 15 from 5 on
+                start = int(base)
+                end = high if stepped else start
+        except ValueError:
+            raise ValueError(f"Invalid cron {name} field: {expression!r}") from None
+        if step < 1 or not low <= start <= end <= high:
+            raise ValueError(f"Invalid cron {name} field: {expression!r}")
+        values.update(range(start, end + 1, step))
+    return values
+
+class CronSchedule:
+    """
+    Five-field cron expression in a local time zone.
+
+    As in cron, a day matches when both day fields match, or either one if both are
+    restricted (neither starts with "*"). Wall-clock times skipped by a DST change do not
+    fire, and times repeated by one fire once, on their first occurrence.
+    """
+    def __init__(self, expression, tz=None):
+        fields = expression.split()
+        if len(fields) != len(CRON_FIELDS):
+            raise ValueError(f"Cron expression needs {len(CRON_FIELDS)} fields: {expression!r}")
+        self.expression = expression
+        self.tz = tz or local_timezone()
+        minutes, hours, days, months, weekdays = (
+            _parse_cron_field(field, *spec) for field, spec in zip(fields, CRON_FIELDS)
+        )
+        self.minutes, self.hours = sorted(minutes), sorted(hours)
+        self.days, self.months = days, months
+        self.weekdays = {day % 7 for day in weekdays}
+        self.any_day = fields[2].startswith("*") or fields[4].startswith("*")
+
+    def _day_matches(self, day):
+        if day.month not in self.months:
+            return False
+        day_match = day.day in self.days
+        weekday_match = (day.weekday() + 1) % 7 in self.weekdays  # cron counts from Sunday
+        return (day_match and weekday_match) if self.any_day else (day_match or weekday_match)
+
+    def next_after(self, after):
+        """
+        First fire time strictly after the aware datetime `after`, as an aware local datetime.
+        """
+        after_utc = after.astimezone(timezone.utc)
+        day = after.astimezone(self.tz).date()
+        # Every valid expression fires within 8 years (29 February skips 2100)
+        for _ in range(8 * 366 + 1):
+            if self._day_matches(day):
+                for hour in self.hours:
+                    for minute in self.minutes:
+                        wall = datetime.combine(day, dtime(hour, minute))
+                        candidate = wall.replace(tzinfo=self.tz)
+                        fires_at = candidate.astimezone(timezone.utc)
+                        if fires_at <= after_utc:
+                            continue
+                        # A wall time inside a DST gap does not survive the round trip
+                        if fires_at.astimezone(self.tz).replace(tzinfo=None) != wall:
+                            continue
+                        return candidate
+            day += timedelta(days=1)
+        raise ValueError(f"Cron expression never fires: {self.expression!r}")
+
+class Metrics:
+    """
+    Run and training counters and last-run details, served as JSON on /healthz and Prometheus
+    text on /metrics.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self.runs = {"success": 0, "failure": 0}
+        self.running = False
+        self.last_run = None
+        self.last_success_at = None
+        self.next_run_at = None
+        self.trainings = {"success": 0, "failure": 0}
+        self.last_training = None
+        self.next_training_at = None
+        self.model_version = None
+        self.spool_pending = 0
+
+    def record_run(self, run):
+        with self.lock:
+            self.runs[run["status"]] += 1
+            self.last_run = run
+            if run["status"] == "success":
+                self.last_success_at = run["finished_at"]
+
+    def record_training(self, training):
+        with self.lock:
+            self.trainings[training["status"]] += 1
+            self.last_training = training
+
+    def health(self):
+        """
+        (HTTP status, body): 503 once the last run failed, 200 while starting or healthy.
+        A failed training keeps serving the loaded models, so it does not fail the check.
+        """
+        with self.lock:
+            last = self.last_run
+            status = "starting" if last is None else "ok" if last["status"] == "success" else "failing"
+            body = {
+                "status": status,
+                "running": self.running,
+                "last_run": last,
+                "last_success_at": self.last_success_at,
+                "next_run_at": self.next_run_at,
+                "last_training": self.last_training,
+                "next_training_at": self.next_training_at,
+                "model_version": self.model_version,
+                "spool_pending": self.spool_pending,
+            }
+        return (503 if status == "failing" else 200), body
+
+    def prometheus(self):
+        with self.lock:
+            last = self.last_run or {}
+            training = self.last_training or {}
+            lines = [
+                "# TYPE climate_scheduler_runs_total counter",
+                *(f'climate_scheduler_runs_total{{status="{s}"}} {n}' for s, n in self.runs.items()),
+                "# TYPE climate_scheduler_trainings_total counter",
+                *(f'climate_scheduler_trainings_total{{status="{s}"}} {n}' for s, n in self.trainings.items()),
+                "# TYPE climate_scheduler_stage_duration_seconds gauge",
+                *(f'climate_scheduler_stage_duration_seconds{{stage="{stage}"}} {seconds:.3f}'
+                  for stage, seconds in last.get("durations", {}).items()),
+            ]
+            gauges = {
+                "uptime_seconds": time.time() - self.started_at,
+                "running": int(self.running),
+                "last_run_timestamp_seconds": last.get("finished_at"),
+                "last_success_timestamp_seconds": self.last_success_at,
+                "next_run_timestamp_seconds": self.next_run_at,
+                "last_records_spooled": last.get("records_spooled"),
+                "last_rows_cached": last.get("rows_cached"),
+                "last_rows_applied": last.get("rows_applied"),
+                "last_predictions": last.get("predictions"),
+                "spool_pending": self.spool_pending,
+                "last_training_timestamp_seconds": training.get("finished_at"),
+                "last_training_duration_seconds": training.get("duration"),
+                "next_training_timestamp_seconds": self.next_training_at,
+            }
+            for name, value in gauges.items():
+                if value is not None:
+                    lines += [f"# TYPE climate_scheduler_{name} gauge", f"climate_scheduler_{name} {value}"]
+            if self.model_version:
+                lines += ["# TYPE climate_scheduler_model_info gauge",
+                          f'climate_scheduler_model_info{{version="{self.model_version}"}} 1']
+        return "\n".join(lines) + "\n"
+
+def start_health_server(metrics, host=SCHEDULER_HEALTH_HOST, port=SCHEDULER_HEALTH_PORT):
+    """
+    Serve /healthz and /metrics from a background thread.
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            path = self.path.split("?", 1)[0]
+            if path == "/healthz":
+                status, body = metrics.health()
+                payload, content_type = json.dumps(body).encode(), "application/json"
+            elif path == "/metrics":
+                status, payload, content_type = 200, metrics.prometheus().encode(), "text/plain; version=0.0.4"
+            else:
+                status, payload, content_type = 404, b"Not found\n", "text/plain"
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass  # Health checks would flood the run logs
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"🩺 Health and metrics on http://{host}:{port}/healthz and /metrics")
+    return server
+
+class Pipeline:
+    """
+    ETL -> feature update -> prediction, keeping the HTTP client, history cache, feature
+    state and loaded models between runs. Models are only reloaded when the registry gets a
+    new version, registered by train() or a separate train_models.py.
+    """
+    def __init__(self, metrics, rollup=SCHEDULER_ROLLUP):
+        self.metrics = metrics
+        self.rollup = rollup
+        self.cache = HistoryCache(make_loader())
+        self.feature_state = FeatureState.load()
+        self.registry = ModelRegistry()
+        self.models, self.feature_cols, self.newest_version = None, None, None
+        self.predicted = False
+        self.client = None
+
+    async def start(self):
+        """
+        Open the HTTP client and load everything a run needs before the first one fires.
+        """
+        import httpx
+
+        limits = httpx.Limits(max_connections=etl_main.MAX_CONCURRENT_REQUESTS,
+                              max_keepalive_connections=etl_main.MAX_CONCURRENT_REQUESTS)
+        self.client = httpx.AsyncClient(timeout=10, limits=limits)
+        await asyncio.to_thread(self.warm)
+
+    def warm(self):
+        print("🔥 Warming up clients, feature state and models...")
+        if etl_main.get_postgres_store() is None:
+            etl_main.get_supabase()
+        etl_main.get_spool()
+        etl_main.get_ingestion_state()
+        get_locations()
+        self.update_features()
+        latest_features = self.feature_state.latest_features()
+        if len(latest_features):
+            self.refresh_models(latest_features)
+        self.metrics.spool_pending = etl_main.get_spool().pending()
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+
+    def update_features(self):
+        """
+        Sync the rows stored since the last run into the cache and the feature state; returns
+        (rows cached, rows applied).
+        """
+        cached = self.cache.refresh()
+        applied = update_feature_state(self.cache, self.feature_state)
+        print(f"🛠️ Feature state updated with {applied} new rows ({cached} rows synced).")
+        return cached, applied
+
+    def refresh_models(self, latest_features):
+        """
+        (Re)load models if none are loaded or a newer version was registered; True if it did.
+        """
+        newest = next(iter(self.registry.versions()), None)
+        if self.models is not None and newest == self.newest_version:
+            return False
+        self.models, self.feature_cols, version = load_models(self.registry, self.cache, latest_features)
+        self.newest_version = next(iter(self.registry.versions()), None)
+        self.metrics.model_version = version
+        return True
+
+    def predict(self, applied):
+        """
+        Score every city and save the predictions; returns how many were saved. Skipped when
+        neither the features nor the models changed since the last saved predictions.
+        """
+        latest_features = self.feature_state.latest_features()
+        if not len(latest_features):
+            print("⚠️ No city has enough history to predict yet.")
+            return 0
+        reloaded = self.refresh_models(latest_features)
+        if self.predicted and not applied and not reloaded:
+            print("⏭️ No new observations or models; predictions unchanged.")
+            return 0
+
+        self.predicted = False
+        records = build_predictions(self.models, self.feature_cols, latest_features)
+        if records:
+            save_predictions(records)
+            print(f"✅ Saved {len(records)} predictions.")
+        self.predicted = True
+        return len(records)
+
+    async def run(self):
+        """
+        One scheduled run; failures are logged and recorded, never raised.
+        """
+        print(f"🚀 Pipeline run at {datetime.now(timezone.utc).isoformat()}")
+        self.metrics.running = True
+        run = {"started_at": time.time(), "durations": {}}
+        stage_start = time.perf_counter()
+
+        def stage_done(stage):
+            nonlocal stage_start
+            now = time.perf_counter()
+            run["durations"][stage] = now - stage_start
+            stage_start = now
+
+        try:
+            run["records_spooled"] = await etl_main.main_async(client=self.client)
+            stage_done("etl")
+            run["rows_cached"], run["rows_applied"] = await asyncio.to_thread(self.update_features)
+            stage_done("features")
+            run["predictions"] = await asyncio.to_thread(self.predict, run["rows_applied"])
+            stage_done("predict")
+            run["status"] = "success"
+        except Exception as e:
+            traceback.print_exc()
+            print(f"❌ Pipeline run failed: {e}")
+            run["status"], run["error"] = "failure", repr(e)
+        run["finished_at"] = time.time()
+        run["durations"]["total"] = run["finished_at"] - run["started_at"]
+        self.metrics.spool_pending = etl_main.get_spool().pending()
+        self.metrics.running = False
+        self.metrics.record_run(run)
+        print(f"⏱️ Run finished in {run['durations']['total']:.1f}s ({run['status']})")
+
+        # Off the data-to-prediction path
+        if self.rollup and run["status"] == "success":
+            await asyncio.to_thread(etl_main.rollup)
+        return run
+
+    async def train(self):
+        """
+        Retrain and register a model version on the shared history cache; the next run loads
+        it. Failures are logged and recorded, never raised.
+        """
+        print(f"🎓 Training run at {datetime.now(timezone.utc).isoformat()}")
+        training = {"started_at": time.time()}
+        try:
+            training["version"] = await asyncio.to_thread(train_main, cache=self.cache)
+            training["status"] = "success"
+        except Exception as e:
+            traceback.print_exc()
+            print(f"❌ Training failed: {e}")
+            training["status"], training["error"] = "failure", repr(e)
+        training["finished_at"] = time.time()
+        training["duration"] = training["finished_at"] - training["started_at"]
+        self.metrics.record_training(training)
+        print(f"⏱️ Training finished in {training['duration']:.1f}s ({training['status']})")
+        return training
+
+async def serve(schedule, pipeline, metrics, stop, train_schedule=None):
+    """
+    Run the pipeline at every fire time of `schedule`, and retrain at every fire time of
+    `train_schedule` if given, until `stop` is set. One job runs at a time: a job's own fire
+    times that pass while it is still going are skipped rather than queued, and a job that
+    falls due during the other one starts right after it.
+    """
+    jobs = {"run": (schedule, pipeline.run)}
+    if train_schedule is not None:
+        jobs["training"] = (train_schedule, pipeline.train)
+    now = datetime.now(timezone.utc)
+    due = {name: job_schedule.next_after(now) for name, (job_schedule, _) in jobs.items()}
+
+    while not stop.is_set():
+        metrics.next_run_at = due["run"].timestamp()
+        metrics.next_training_at = due["training"].timestamp() if "training" in due else None
+        # On a tie the run goes first, so predictions are not held up by training
+        name = min(due, key=lambda job: (due[job], job != "run"))
+        print(f"⏰ Next {name} at {due[name].isoformat()}")
+        # Sleep in short slices against the wall clock, so clock adjustments and suspends
+        # do not shift the schedule
+        while (remaining := due[name].timestamp() - time.time()) > 0:
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=min(remaining, 60))
+                return
+            except asyncio.TimeoutError:
+                pass
+        job_schedule, job = jobs[name]
+        await job()
+        due[name] = job_schedule.next_after(datetime.now(timezone.utc))
+
+async def main(cron=SCHEDULER_CRON, train_cron=SCHEDULER_TRAIN_CRON, once=False, rollup=SCHEDULER_ROLLUP,
+               host=SCHEDULER_HEALTH_HOST, port=SCHEDULER_HEALTH_PORT):
+    schedule = CronSchedule(cron)
+    train_schedule = CronSchedule(train_cron, tz=schedule.tz) if train_cron else None
+    metrics = Metrics()
+    pipeline = Pipeline(metrics, rollup=rollup)
+    if once:
+        try:
+            await pipeline.start()
+            run = await pipeline.run()
+        finally:
+            await pipeline.close()
+        return run
+
+    server = start_health_server(metrics, host, port)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass  # Windows: Ctrl+C still interrupts the loop
+
+    print(f"🗓️ Scheduler started: '{schedule.expression}' in {schedule.tz}")
+    if train_schedule is not None:
+        print(f"🎓 Retraining on '{train_schedule.expression}'")
+    try:
+        await pipeline.start()
+        await serve(schedule, pipeline, metrics, stop, train_schedule)
+    finally:
+        server.shutdown()
+        await pipeline.close()
+        print("👋 Scheduler stopped.")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run ETL, feature update and prediction on a cron schedule")
+    parser.add_argument("--cron", default=SCHEDULER_CRON,
+                        help="Five-field cron expression, evaluated in SCHEDULER_TIMEZONE or local time")
+    parser.add_argument("--train-cron", default=SCHEDULER_TRAIN_CRON,
+                        help='Cron expression for retraining the models; "" disables it')
+    parser.add_argument("--once", action="store_true", help="Run the pipeline once now and exit")
+    parser.add_argument("--no-rollup", dest="rollup", action="store_false", default=SCHEDULER_ROLLUP,
+                        help="Do not refresh the rollup tiers after each run")
+    parser.add_argument("--port", type=int, default=SCHEDULER_HEALTH_PORT, help="Health and metrics port")
+    args = parser.parse_args()
+    run = asyncio.run(main(cron=args.cron, train_cron=args.train_cron, once=args.once, rollup=args.rollup, port=args.port))
+    if args.once and run["status"] != "success":
+        sys.exit(1)
@@ -0,0 +1,113 @@
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+from ml_pipeline.config import (
+    LAGS, ROLLING_WINDOWS, NEIGHBOR_LAGS, HORIZONS, GRID_FREQ, TIME_COL, CITY_COL, INGESTION_COL, STREAM_CACHE_DIR
+)
+from ml_pipeline.train_models import build_training_frame
+
+# Grid steps before the first emitted row that its lags, rolling windows and neighbor lags can reach
+CONTEXT_STEPS = max(max(LAGS), max(ROLLING_WINDOWS) - 1, max(NEIGHBOR_LAGS, default=0))
+
+def iter_training_frames(chunks, horizons=HORIZONS, freq=GRID_FREQ):
+    """
+    Yield (features + horizon targets, feature columns) chunk by chunk, with every row exactly
+    as build_training_frame would produce it on the full history.
+
+    `chunks` are time-ordered frames of whole days (see HistoryCache.iter_chunks). Each chunk is
+    processed together with a carried tail of the previous one: the last CONTEXT_STEPS grid steps
+    of rows, for lags and windows, and the rows whose horizon targets lie past the chunk's end,
+    which are only emitted once the next chunk (or the end of the stream) completes them.
+    """
+    lookahead = max(horizons) * pd.Timedelta(freq)
+    context = CONTEXT_STEPS * pd.Timedelta(freq)
+    tail = None
+    emitted_until = None
+
+    def emit(frame, until):
+        df_features, feature_cols = build_training_frame(frame, horizons)
+        times = df_features[TIME_COL]
+        keep = times < until if until is not None else np.ones(len(df_features), dtype=bool)
+        if emitted_until is not None:
+            keep &= times >= emitted_until
+        return df_features[keep], feature_cols
+
+    for chunk in chunks:
+        if chunk.empty:
+            continue
+        chunk = chunk.assign(**{TIME_COL: pd.to_datetime(chunk[TIME_COL], utc=True)})
+        frame = chunk if tail is None else pd.concat([tail, chunk], ignore_index=True)
+        frame = frame.sort_values(by=[CITY_COL, TIME_COL], kind="stable").reset_index(drop=True)
+
+        # Rows whose furthest target cell ends before the next day are complete
+        chunk_end = chunk[TIME_COL].max().floor("D") + pd.Timedelta(days=1)
+        emit_until = chunk_end - lookahead
+        yield emit(frame, emit_until)
+
+        # Grid cells are floored, so the context starts at the cell CONTEXT_STEPS before emit_until
+        tail = frame[frame[TIME_COL] >= emit_until.floor(freq) - context].reset_index(drop=True)
+        emitted_until = emit_until
+
+    if tail is not None and (emitted_until is None or (tail[TIME_COL] >= emitted_until).any()):
+        yield emit(tail, None)
+
+class TrainingChunkIter(xgb.DataIter):
+    """
+    XGBoost data iterator over iter_training_frames.
+
+    XGBoost drives it through several passes (sketching the quantiles, then building the
+    compressed pages), restarting the chunk stream on reset(), so no pass holds more than one
+    chunk of features in memory. Rows missing any of `target_cols` are dropped.
+    """
+    def __init__(self, make_chunks, target_cols, horizons=HORIZONS, cache_prefix=None):
+        self.make_chunks = make_chunks
+        self.target_cols = list(target_cols)
+        self.horizons = horizons
+        self.feature_cols = None
+        self.n_rows = 0
+        self.watermark = None
+        self._frames = None
+        self._first_pass = True
+        super().__init__(cache_prefix=cache_prefix)
+
+    def next(self, input_data):
+        if self._frames is None:
+            self._frames = iter_training_frames(self.make_chunks(), self.horizons)
+        for df_features, feature_cols in self._frames:
+            train_data = df_features.dropna(subset=self.target_cols)
+            if train_data.empty:
+                continue
+            if self.feature_cols is None:
+                self.feature_cols = feature_cols
+            if self._first_pass:
+                self.n_rows += len(train_data)
+                col = INGESTION_COL if INGESTION_COL in train_data.columns else TIME_COL
+                newest = pd.to_datetime(train_data[col]).max()
+                self.watermark = newest if self.watermark is None else max(self.watermark, newest)
+            input_data(
+                data=np.ascontiguousarray(train_data[self.feature_cols].to_numpy(dtype=np.float32)),
+                label=train_data[self.target_cols].to_numpy(dtype=np.float32),
+            )
+            return True
+        return False
+
+    def reset(self):
+        if self._frames is not None:
+            self._first_pass = False
+        self._frames = None
+
+def build_external_dataset(make_chunks, target_cols, horizons=HORIZONS, cache_dir=STREAM_CACHE_DIR):
+    """
+    External-memory quantile matrix over the streamed chunks. Returns (dataset, iterator, tmpdir);
+    the iterator carries the feature columns, row count and watermark seen while building.
+
+    The compressed pages are cached under `cache_dir` in a temporary directory that is removed
+    when `tmpdir` is cleaned up (or garbage collected).
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    tmpdir = tempfile.TemporaryDirectory(dir=cache_dir)
+    it = TrainingChunkIter(make_chunks, target_cols, horizons, cache_prefix=os.path.join(tmpdir.name, "pages"))
+    dataset = xgb.ExtMemQuantileDMatrix(it)
+    return dataset, it, tmpdir
@@ -0,0 +1,145 @@
+import numpy as np
+import pandas as pd
+from ml_pipeline.config import TARGET_VARIABLES, TIME_COL, CITY_COL, GRID_FREQ
+
+class WeatherTensor:
+    """
+    Dense city x time x variable representation of weather_data on a regular time grid.
+
+    Missing observations are NaN and exposed through `mask`, so lags, horizon targets and
+    rolling windows are strided slices along the time axis that respect gaps: a lag of one
+    step is always the value one grid step earlier, never simply the previous row.
+    """
+    def __init__(self, cities, times, variables, values, latitude, longitude, freq=GRID_FREQ):
+        self.cities = pd.Index(cities)
+        self.times = pd.DatetimeIndex(times)
+        self.variables = list(variables)
+        self.values = values  # shape: (cities, times, variables)
+        self.latitude = latitude
+        self.longitude = longitude
+        self.freq = pd.Timedelta(freq)
+
+    @property
+    def mask(self):
+        """
+        True where an observation exists.
+        """
+        return ~np.isnan(self.values).any(axis=2)
+
+    @classmethod
+    def from_frame(cls, df, variables=TARGET_VARIABLES, freq=GRID_FREQ, dtype=np.float64):
+        """
+        Scatter a long frame onto the grid. Timestamps are floored to `freq`; if several rows
+        fall in the same cell the last one wins.
+        """
+        freq = pd.Timedelta(freq)
+        times = pd.to_datetime(df[TIME_COL], utc=True).dt.floor(freq)
+        city_idx, cities = pd.factorize(df[CITY_COL].astype(str), sort=True)
+        start, end = times.min(), times.max()
+        grid = pd.date_range(start, end, freq=freq)
+        time_idx = ((times - start) // freq).to_numpy()
+
+        values = np.full((len(cities), len(grid), len(variables)), np.nan, dtype=dtype)
+        values[city_idx, time_idx] = df[list(variables)].to_numpy(dtype=dtype)
+
+        latitude = np.full(len(cities), np.nan)
+        longitude = np.full(len(cities), np.nan)
+        latitude[city_idx] = pd.to_numeric(df["latitude"]).to_numpy(dtype=float)
+        longitude[city_idx] = pd.to_numeric(df["longitude"]).to_numpy(dtype=float)
+
+        return cls(cities, grid, variables, values, latitude, longitude, freq)
+
+    def locate(self, df):
+        """
+        (city index, time index) of each row of a long frame; -1 where it is off the grid.
+        """
+        city_idx = self.cities.get_indexer(df[CITY_COL].astype(str))
+        times = pd.to_datetime(df[TIME_COL], utc=True).dt.floor(self.freq)
+        time_idx = ((times - self.times[0]) // self.freq).to_numpy(dtype=np.int64, copy=True)
+        off_grid = (time_idx < 0) | (time_idx >= len(self.times)) | (city_idx < 0)
+        time_idx[off_grid] = -1
+        city_idx[off_grid] = -1
+        return city_idx, time_idx
+
+    def shift(self, steps, values=None):
+        """
+        out[:, t] = values[:, t - steps]. Positive steps look back (lags), negative steps
+        look ahead (horizon targets). Cells shifted in from outside the grid are NaN.
+        """
+        values = self.values if values is None else values
+        out = np.full_like(values, np.nan)
+        if steps > 0:
+            out[:, steps:] = values[:, :-steps]
+        elif steps < 0:
+            out[:, :steps] = values[:, -steps:]
+        else:
+            out[:] = values
+        return out
+
+    def rolling(self, window, min_periods=1):
+        """
+        Rolling mean and sample std over the last `window` grid steps, ignoring missing cells.
+
+        Window sums, sums of squares and observation counts are differences of cumulative
+        sums along the time axis, so no (cities, times, variables, window) array is built.
+        """
+        observed = ~np.isnan(self.values)
+        n_observed = observed.sum(axis=1, keepdims=True)
+        # Each series is centered on its mean first, which keeps the sum-of-squares variance stable
+        offset = np.where(observed, self.values, 0).sum(axis=1, keepdims=True) / np.maximum(n_observed, 1)
+        centered = np.where(observed, self.values - offset, 0.0)
+
+        end = np.arange(1, self.values.shape[1] + 1)
+        start = np.maximum(end - window, 0)
+
+        def window_sum(x):
+            cumulative = np.concatenate([np.zeros_like(x[:, :1]), np.cumsum(x, axis=1)], axis=1)
+            return cumulative[:, end] - cumulative[:, start]
+
+        count = window_sum(observed.astype(np.int64))
+        total = window_sum(centered)
+        total_sq = window_sum(centered ** 2)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = total / count
+            std = np.sqrt(np.maximum(total_sq - total * mean, 0) / (count - 1))
+        mean += offset
+        mean[count < min_periods] = np.nan
+        std[count < max(min_periods, 2)] = np.nan
+        return mean, std
+
+    def gather(self, array, city_idx, time_idx):
+        """
+        Pick the cells of a (cities, times, variables) array for located rows; NaN off the grid.
+        """
+        out = array[city_idx, time_idx]
+        out[time_idx < 0] = np.nan
+        return out
+
+    def horizon_targets(self, df, horizons, variables=None):
+        """
+        Direct-strategy targets for each row of `df`: the value `h` grid steps after the row's
+        timestamp, NaN when that observation is missing.
+        """
+        variables = self.variables if variables is None else variables
+        city_idx, time_idx = self.locate(df)
+        targets = {}
+        for h in horizons:
+            future = self.gather(self.shift(-h), city_idx, time_idx)
+            for variable in variables:
+                targets[f"target_{variable}_h{h}"] = future[:, self.variables.index(variable)]
+        return pd.DataFrame(targets, index=df.index)
+
+    def to_frame(self):
+        """
+        Long frame of the observed cells.
+        """
+        city_idx, time_idx = np.nonzero(self.mask)
+        frame = pd.DataFrame({
+            CITY_COL: self.cities[city_idx],
+            TIME_COL: self.times[time_idx],
+            "latitude": self.latitude[city_idx],
+            "longitude": self.longitude[city_idx],
+        })
+        for v, variable in enumerate(self.variables):
+            frame[variable] = self.values[city_idx, time_idx, v]
+        return frame
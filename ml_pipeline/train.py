@@ -5,18 +5,19 @@ import os
 # Ensure we can import from the current directory
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
-from ml_pipeline.config import TARGET_VARIABLES, CITY_COL
-from ml_pipeline.data_loader import DataLoader
-from ml_pipeline.feature_engineering import FeatureEngineer
+from ml_pipeline.config import TARGET_VARIABLES, CITY_COL, HORIZONS
+from ml_pipeline.data_loader import make_loader
+from ml_pipeline.history_cache import HistoryCache
 from ml_pipeline.evaluation import Evaluator
+from ml_pipeline.train_models import build_training_frame
 
 def main():
     print("🚀 Starting Climate Intelligence ML Pipeline...")
 
     # 1. Load Data
-    print("📥 Loading data from Supabase...")
-    loader = DataLoader()
-    df = loader.fetch_data()
+    print("📥 Loading data (local cache + incremental sync from Supabase)...")
+    loader = make_loader()
+    df = HistoryCache(loader).load()
     
     if df.empty:
         print("❌ No data found. Exiting.")
@@ -25,61 +26,34 @@ def main():
     print(f"✅ Loaded {len(df)} records.")
 
     # 2. Feature Engineering
-    print("🛠️ Generating features...")
-    fe = FeatureEngineer()
-    df_features = fe.create_features(df, target_cols=TARGET_VARIABLES)
-    
-    print(f"✅ Features generated. Shape: {df_features.shape}")
-    print(f"   Columns: {df_features.columns.tolist()}")
+    # Features and horizon targets come from the same helper training and inference use, so
+    # evaluation scores exactly what is deployed
+    horizons = HORIZONS
+    print("🛠️ Generating features and targets for horizons: 30m, 60m, 120m...")
+    df_features, feature_cols = build_training_frame(df, horizons=horizons)
 
-    # 3. Prepare Targets for Direct Strategy
-    # Horizons: 1 step (30m), 2 steps (60m), 4 steps (120m)
-    horizons = [1, 2, 4]
-    
-    print("🎯 Preparing targets for horizons: 30m, 60m, 120m...")
-    for target in TARGET_VARIABLES:
-        for h in horizons:
-            col_name = f"target_{target}_h{h}"
-            # Shift per city
-            df_features[col_name] = df_features.groupby(CITY_COL)[target].shift(-h)
-    
-    # Drop rows where targets are NaN (end of series)
-    # We only drop if ALL targets are NaN? No, we need valid rows for training.
-    # But for evaluation, we might want to keep as much as possible.
-    # The evaluator drops NaNs per horizon, so we can keep the DF as is, 
-    # just maybe drop the initial NaNs from lags (already done in FE).
-    
-    # Identify feature columns (exclude targets and metadata)
-    metadata_cols = ['id', 'created_at', 'ingestion_time', 'data_source', 'weather_timestamp', 'city']
-    target_cols = [c for c in df_features.columns if c.startswith('target_')]
-    feature_cols = [c for c in df_features.columns if c not in metadata_cols + target_cols]
-    
+    print(f"✅ Features generated. Shape: {df_features.shape}")
     print(f"   Feature columns used: {feature_cols}")
 
-    # 4. Evaluation
+    # 3. Evaluation
     print("⚖️ Starting Walk-Forward Evaluation...")
-    evaluator = Evaluator()
-    
-    all_results = []
+    # Compare the single multi-output model used by inference against the per-output models
+    evaluator = Evaluator(multi_output=True)
     
-    for target in TARGET_VARIABLES:
-        print(f"\n--- Evaluating for Target: {target} ---")
-        results_df = evaluator.evaluate_walk_forward(
-            df_features, 
-            feature_cols, 
-            target, 
-            horizons=horizons,
-            n_splits=5
-        )
-        all_results.append(results_df)
+    # All targets, folds, horizons and models run as one task set on the worker pool
+    final_results = evaluator.evaluate_targets(
+        df_features, 
+        feature_cols, 
+        TARGET_VARIABLES, 
+        horizons=horizons,
+        n_splits=5
+    )
 
-    if not all_results:
+    if final_results.empty:
         print("⚠️ No results generated.")
         return
-
-    final_results = pd.concat(all_results)
     
-    # 5. Summary Report
+    # 4. Summary Report
     print("\n" + "="*50)
     print("📊 VALIDATION RESULTS SUMMARY")
     print("="*50)
@@ -90,6 +64,10 @@ def main():
     summary_pivot = summary.pivot(index=['target', 'horizon'], columns='model', values=['mae', 'rmse'])
     print(summary_pivot)
     
+    timing = final_results.groupby('model')[['fit_seconds', 'total_seconds']].sum()
+    print("\n⏱️ Time per model (summed over tasks):")
+    print(timing)
+    
     # Check criteria
     print("\n✅ Validation Criteria Check:")
     for target in TARGET_VARIABLES:
@@ -0,0 +1,189 @@
+import pandas as pd
+import sys
+import os
+import argparse
+
+# Ensure we can import from the current directory
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from ml_pipeline.config import (
+    TARGET_VARIABLES, HORIZONS, MODEL_PARAMS, MULTI_OUTPUT_INFERENCE, STREAMING_TRAINING, INGESTION_COL, TIME_COL
+)
+from ml_pipeline.data_loader import make_loader
+from ml_pipeline.history_cache import HistoryCache
+from ml_pipeline.feature_engineering import FeatureEngineer
+from ml_pipeline.models import MLModelWrapper, MultiOutputModelWrapper
+from ml_pipeline.model_registry import ModelRegistry, ModelSchemaError
+from ml_pipeline.tensor import WeatherTensor
+from ml_pipeline.neighbors import neighbor_features
+
+METADATA_COLS = ['id', 'created_at', 'ingestion_time', 'data_source', 'weather_timestamp', 'city']
+MULTI_OUTPUT_NAME = "multi_output"
+
+def output_name(target, h):
+    return f"{target}_h{h}"
+
+def build_training_frame(df, horizons=HORIZONS):
+    """
+    Features (including neighbor features) plus gap-aware horizon targets for every row,
+    and the feature column list.
+    """
+    tensor = WeatherTensor.from_frame(df, variables=TARGET_VARIABLES)
+    df_features = FeatureEngineer().create_features(df, target_cols=TARGET_VARIABLES, tensor=tensor)
+    df_features = pd.concat([
+        df_features, neighbor_features(tensor, df_features), tensor.horizon_targets(df_features, horizons)
+    ], axis=1)
+
+    target_cols = [c for c in df_features.columns if c.startswith('target_')]
+    feature_cols = [c for c in df_features.columns if c not in METADATA_COLS + target_cols]
+    return df_features, feature_cols
+
+def data_watermark(df):
+    """
+    Newest ingestion time in the training data (newest observation if ingestion_time is absent).
+    """
+    col = INGESTION_COL if INGESTION_COL in df.columns else TIME_COL
+    return pd.to_datetime(df[col]).max()
+
+def train_models(df_features, feature_cols, horizons=HORIZONS, base_models=None):
+    """
+    Fit the production XGBoost models: one multi-output model, or one model per
+    (target, horizon) when MULTI_OUTPUT_INFERENCE is off.
+
+    With base_models (loaded from the registry) each model is warm-started and only
+    boosts on the rows in df_features, which should then be the rows added since.
+    """
+    models = {}
+    outputs = [(target, h) for target in TARGET_VARIABLES for h in horizons]
+
+    if MULTI_OUTPUT_INFERENCE:
+        target_cols = [f"target_{target}_h{h}" for target, h in outputs]
+        train_data = df_features.dropna(subset=target_cols)
+        model = MultiOutputModelWrapper(outputs, MODEL_PARAMS["xgboost"], warm_start=base_models is not None)
+        if base_models is not None:
+            model.model = base_models[MULTI_OUTPUT_NAME].model
+        if len(train_data):
+            model.fit(train_data[feature_cols], train_data[target_cols])
+        models[MULTI_OUTPUT_NAME] = model
+        print(f"   ✅ Trained multi-output model for {len(outputs)} target/horizon pairs on {len(train_data)} rows")
+        return models
+
+    for target, h in outputs:
+        name = output_name(target, h)
+        train_data = df_features.dropna(subset=[f"target_{target}_h{h}"])
+        model = MLModelWrapper("xgboost", MODEL_PARAMS["xgboost"], warm_start=base_models is not None)
+        if base_models is not None:
+            model.model = base_models[name].model
+        if len(train_data):
+            model.fit(train_data[feature_cols], train_data[f"target_{target}_h{h}"])
+        models[name] = model
+        print(f"   ✅ Trained {target} model for horizon {h} on {len(train_data)} rows")
+    return models
+
+def train_models_streaming(make_chunks, horizons=HORIZONS):
+    """
+    Out-of-core counterpart of build_training_frame + train_models (from scratch only).
+
+    make_chunks() must return a fresh iterator of time-ordered whole-day frames, e.g.
+    HistoryCache.iter_chunks; features are built chunk by chunk and streamed into XGBoost
+    external-memory matrices. Returns (models, feature_cols, watermark).
+    """
+    from ml_pipeline.streaming import build_external_dataset
+
+    models = {}
+    outputs = [(target, h) for target in TARGET_VARIABLES for h in horizons]
+    if MULTI_OUTPUT_INFERENCE:
+        groups = {MULTI_OUTPUT_NAME: outputs}
+    else:
+        groups = {output_name(target, h): [(target, h)] for target, h in outputs}
+
+    feature_cols, watermark = None, None
+    for name, group in groups.items():
+        target_cols = [f"target_{target}_h{h}" for target, h in group]
+        dataset, it, tmpdir = build_external_dataset(make_chunks, target_cols, horizons)
+        try:
+            if it.n_rows == 0:
+                print("   ⚠️ No complete training rows in the history.")
+                return {}, None, None
+            if MULTI_OUTPUT_INFERENCE:
+                model = MultiOutputModelWrapper(group, MODEL_PARAMS["xgboost"])
+            else:
+                model = MLModelWrapper("xgboost", dict(MODEL_PARAMS["xgboost"], tree_method="hist"))
+            model.fit_dataset(dataset)
+        finally:
+            del dataset
+            tmpdir.cleanup()
+        models[name] = model
+        feature_cols, watermark = it.feature_cols, it.watermark
+        print(f"   ✅ Trained {name} out of core on {it.n_rows} rows")
+    return models, feature_cols, watermark
+
+def predict_outputs(models, X, horizons=HORIZONS):
+    """
+    Predictions of a trained model set as {(target, horizon): array}.
+    """
+    if MULTI_OUTPUT_NAME in models:
+        return models[MULTI_OUTPUT_NAME].predict_outputs(X)
+    return {
+        (target, h): models[output_name(target, h)].predict(X)
+        for target in TARGET_VARIABLES for h in horizons
+    }
+
+def main(refresh=False, streaming=STREAMING_TRAINING, cache=None):
+    """
+    Train and register a model version; returns it, or None without data. `cache` lets a
+    long-running process (scheduler.py) share its history cache instead of opening another.
+    """
+    print("🚀 Training production models...")
+    cache = cache or HistoryCache(make_loader())
+
+    if streaming:
+        if refresh:
+            print("⚠️ Streaming training always starts from scratch; ignoring --refresh.")
+        print("📥 Syncing history cache...")
+        cache.refresh()
+        print("🧠 Training XGBoost models out of core...")
+        models, feature_cols, watermark = train_models_streaming(cache.iter_chunks)
+        if not models:
+            print("❌ No data found. Exiting.")
+            return None
+        version = ModelRegistry().save(models, feature_cols, watermark=watermark)
+        print(f"💾 Saved model version {version}")
+        return version
+
+    print("📥 Loading data (local cache + incremental sync from Supabase)...")
+    df = cache.load()
+    if df.empty:
+        print("❌ No data found. Exiting.")
+        return None
+
+    print("🛠️ Generating features...")
+    df_features, feature_cols = build_training_frame(df)
+
+    registry = ModelRegistry()
+    base_models = None
+    if refresh:
+        try:
+            base_models, manifest = registry.load_latest(feature_cols)
+            # Continue boosting on the rows ingested after the stored version was trained
+            watermark = pd.Timestamp(manifest["watermark"])
+            df_features = df_features[pd.to_datetime(df_features[INGESTION_COL]) > watermark]
+            print(f"♻️ Refreshing version {manifest['version']} with {len(df_features)} new rows")
+        except ModelSchemaError as e:
+            print(f"⚠️ {e}. Training from scratch.")
+
+    print("🧠 Training XGBoost models...")
+    models = train_models(df_features, feature_cols, base_models=base_models)
+
+    version = registry.save(models, feature_cols, watermark=data_watermark(df))
+    print(f"💾 Saved model version {version} to {registry.registry_dir}")
+    return version
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train and register production models")
+    parser.add_argument("--refresh", action="store_true",
+                        help="Warm-start the latest compatible version on rows ingested since it was trained")
+    parser.add_argument("--streaming", action="store_true", default=STREAMING_TRAINING,
+                        help="Build features chunk by chunk and train from an external-memory matrix")
+    args = parser.parse_args()
+    main(refresh=args.refresh, streaming=args.streaming)
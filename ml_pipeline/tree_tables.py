@@ -0,0 +1,232 @@
+import os
+import json
+import numpy as np
+
+# Node arrays of an exported model, one .npy file each so they can be memory-mapped
+NODE_ARRAYS = ("feature", "threshold", "left", "right", "default_left", "missing")
+META_FILE = "meta.json"
+
+# How a node treats NaN inputs (LightGBM missing_type; XGBoost always routes NaN by default_left)
+MISSING_NONE, MISSING_ZERO, MISSING_NAN = 0, 1, 2
+LIGHTGBM_MISSING = {"None": MISSING_NONE, "Zero": MISSING_ZERO, "NaN": MISSING_NAN}
+LIGHTGBM_ZERO_THRESHOLD = 1e-35
+
+# Objectives whose prediction is the raw sum of leaf values (plus base score)
+IDENTITY_OBJECTIVES = {"reg:squarederror", "reg:absoluteerror", "reg:pseudohubererror", "regression", "regression_l1"}
+
+# Rows scored at once; bounds the (rows x trees) node index matrix
+PREDICT_CHUNK_ROWS = 4096
+
+def _parse_base_score(value):
+    """
+    XGBoost stores base_score as "5E-1", or as "[a,b]" with one entry per target.
+    """
+    return [float(v) for v in value.strip("[]").split(",")]
+
+def _xgboost_tables(booster):
+    model = json.loads(booster.save_raw("json"))
+    learner = model["learner"]
+    objective = learner["objective"]["name"]
+    if objective not in IDENTITY_OBJECTIVES:
+        raise ValueError(f"Unsupported XGBoost objective for tree tables: {objective}")
+
+    trees = learner["gradient_booster"]["model"]["trees"]
+    tree_output = learner["gradient_booster"]["model"]["tree_info"]
+    n_outputs = max(1, int(learner["learner_model_param"].get("num_target", 1)))
+
+    nodes = {name: [] for name in NODE_ARRAYS}
+    value, roots, depths = [], [], []
+    offset = 0
+    for tree in trees:
+        if int(tree["tree_param"].get("size_leaf_vector", 1)) > 1:
+            raise ValueError("Vector-leaf trees (multi_output_tree) cannot be exported to tree tables")
+        if any(tree["split_type"]):
+            raise ValueError("Categorical splits cannot be exported to tree tables")
+
+        left = np.asarray(tree["left_children"], dtype=np.int32)
+        right = np.asarray(tree["right_children"], dtype=np.int32)
+        leaf = left < 0
+        nodes["feature"].append(np.where(leaf, -1, tree["split_indices"]).astype(np.int32))
+        # Split conditions hold the leaf value on leaf nodes
+        conditions = np.asarray(tree["split_conditions"], dtype=np.float32)
+        nodes["threshold"].append(conditions.astype(np.float64))
+        nodes["left"].append(np.where(leaf, -1, left + offset).astype(np.int32))
+        nodes["right"].append(np.where(leaf, -1, right + offset).astype(np.int32))
+        nodes["default_left"].append(np.asarray(tree["default_left"], dtype=bool))
+        nodes["missing"].append(np.full(len(left), MISSING_NAN, dtype=np.int8))
+        value.append(np.where(leaf, conditions, 0).astype(np.float64))
+        roots.append(offset)
+
+        depth = np.zeros(len(left), dtype=np.int32)
+        for node in range(len(left)):  # Children always come after their parent
+            if not leaf[node]:
+                depth[left[node]] = depth[right[node]] = depth[node] + 1
+        depths.append(int(depth.max()))
+        offset += len(left)
+
+    meta = {
+        "model_type": "xgboost",
+        # XGBoost goes left when x < threshold, on float32 inputs
+        "decision": "<",
+        "input_dtype": "float32",
+        "base_score": _parse_base_score(learner["learner_model_param"]["base_score"])[:n_outputs],
+        "n_outputs": n_outputs,
+        "max_depth": max(depths, default=0),
+    }
+    return nodes, value, roots, tree_output, meta
+
+def _lightgbm_tables(booster):
+    model = booster.dump_model()
+    if model.get("num_tree_per_iteration", 1) != 1 or model.get("average_output"):
+        raise ValueError("Only single-output, non-averaged LightGBM models can be exported to tree tables")
+    if model["objective"].split()[0] not in IDENTITY_OBJECTIVES:
+        raise ValueError(f"Unsupported LightGBM objective for tree tables: {model['objective']}")
+
+    nodes = {name: [] for name in NODE_ARRAYS}
+    value, roots, depths = [], [], []
+
+    def add_node(node, depth):
+        index = len(value)
+        value.append(node.get("leaf_value", 0.0))
+        for name in NODE_ARRAYS:
+            nodes[name].append(None)
+        if "leaf_value" in node:
+            nodes["feature"][index], nodes["threshold"][index] = -1, 0.0
+            nodes["left"][index] = nodes["right"][index] = -1
+            nodes["default_left"][index], nodes["missing"][index] = False, MISSING_NONE
+            depths.append(depth)
+            return index
+        if node["decision_type"] != "<=":
+            raise ValueError("Categorical splits cannot be exported to tree tables")
+        nodes["feature"][index] = node["split_feature"]
+        nodes["threshold"][index] = node["threshold"]
+        nodes["default_left"][index] = node["default_left"]
+        nodes["missing"][index] = LIGHTGBM_MISSING[node["missing_type"]]
+        nodes["left"][index] = add_node(node["left_child"], depth + 1)
+        nodes["right"][index] = add_node(node["right_child"], depth + 1)
+        return index
+
+    for tree in model["tree_info"]:
+        if tree.get("is_linear"):
+            raise ValueError("Linear trees cannot be exported to tree tables")
+        roots.append(add_node(tree["tree_structure"], 0))
+
+    dtypes = {"feature": np.int32, "threshold": np.float64, "left": np.int32, "right": np.int32,
+              "default_left": bool, "missing": np.int8}
+    nodes = {name: [np.asarray(values, dtype=dtypes[name])] for name, values in nodes.items()}
+    meta = {
+        "model_type": "lightgbm",
+        # LightGBM goes left when x <= threshold, on float64 inputs
+        "decision": "<=",
+        "input_dtype": "float64",
+        "base_score": [0.0],
+        "n_outputs": 1,
+        "max_depth": max(depths, default=0),
+    }
+    return nodes, [np.asarray(value, dtype=np.float64)], roots, [0] * len(roots), meta
+
+def export_tree_tables(model, path):
+    """
+    Write a trained MLModelWrapper as flat tree tables under the directory `path`.
+
+    Every tree is flattened into shared node arrays (split feature, threshold, child indices,
+    missing-value routing, leaf value) saved as .npy files, so TreeTableModel can score them
+    with NumPy alone after memory-mapping the files.
+    """
+    booster = model.booster()
+    if model.model_type == "xgboost":
+        nodes, value, roots, tree_output, meta = _xgboost_tables(booster)
+    elif model.model_type == "lightgbm":
+        nodes, value, roots, tree_output, meta = _lightgbm_tables(booster)
+    else:
+        raise ValueError(f"Unknown model type: {model.model_type}")
+    if hasattr(model, "outputs"):
+        meta["outputs"] = [list(output) for output in model.outputs]
+
+    os.makedirs(path, exist_ok=True)
+    arrays = {name: np.concatenate(parts) for name, parts in nodes.items()}
+    arrays["value"] = np.concatenate(value)
+    arrays["roots"] = np.asarray(roots, dtype=np.int32)
+    arrays["tree_output"] = np.asarray(tree_output, dtype=np.int32)
+    for name, array in arrays.items():
+        np.save(os.path.join(path, f"{name}.npy"), array)
+    with open(os.path.join(path, META_FILE), "w") as f:
+        json.dump(meta, f, indent=2)
+
+class TreeTableModel:
+    """
+    Gradient-boosted trees scored from exported tree tables with NumPy only.
+
+    Prediction walks every (row, tree) pair one level per step: node indices for a block
+    of rows are advanced together with gathers on the node arrays until all reach a leaf,
+    then leaf values are summed per output. Matches the native predict of the exported
+    booster within float tolerance.
+    """
+    def __init__(self, arrays, meta):
+        self.arrays = arrays
+        self.meta = meta
+        self.model_type = meta["model_type"]
+        if "outputs" in meta:
+            self.outputs = [tuple(output) for output in meta["outputs"]]
+
+    @classmethod
+    def load(cls, path, mmap_mode="r"):
+        with open(os.path.join(path, META_FILE)) as f:
+            meta = json.load(f)
+        arrays = {
+            name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode)
+            for name in NODE_ARRAYS + ("value", "roots", "tree_output")
+        }
+        return cls(arrays, meta)
+
+    def _leaves(self, X):
+        """
+        Leaf node reached by every row of X in every tree (rows x trees).
+        """
+        a = self.arrays
+        rows = np.arange(len(X))[:, None]
+        node = np.repeat(np.asarray(a["roots"])[None, :], len(X), axis=0)
+        for _ in range(self.meta["max_depth"]):
+            feature = a["feature"][node]
+            split = feature >= 0
+            if not split.any():
+                break
+            x = X[rows, np.maximum(feature, 0)]
+            missing = a["missing"][node]
+            nan = np.isnan(x)
+            x = np.where(nan & (missing != MISSING_NAN), 0.0, x)
+            is_missing = (nan & (missing == MISSING_NAN)) | (
+                (missing == MISSING_ZERO) & (np.abs(x) <= LIGHTGBM_ZERO_THRESHOLD)
+            )
+            threshold = a["threshold"][node]
+            go_left = x < threshold if self.meta["decision"] == "<" else x <= threshold
+            go_left = np.where(is_missing, a["default_left"][node], go_left)
+            node = np.where(split, np.where(go_left, a["left"][node], a["right"][node]), node)
+        return node
+
+    def predict(self, X):
+        """
+        Same shape as the native booster's predict: (rows,) for one output, else (rows, outputs).
+        """
+        X = np.asarray(X, dtype=self.meta["input_dtype"]).astype(np.float64)
+        n_outputs = self.meta["n_outputs"]
+        tree_output = np.asarray(self.arrays["tree_output"])
+        # (trees x outputs) indicator so leaf values are summed per output in one product
+        assign = np.zeros((len(tree_output), n_outputs))
+        assign[np.arange(len(tree_output)), tree_output] = 1.0
+
+        pred = np.empty((len(X), n_outputs))
+        for start in range(0, len(X), PREDICT_CHUNK_ROWS):
+            block = X[start:start + PREDICT_CHUNK_ROWS]
+            pred[start:start + len(block)] = self.arrays["value"][self._leaves(block)] @ assign
+        pred += np.asarray(self.meta["base_score"])
+
+        pred = pred.astype(np.float32) if self.meta["input_dtype"] == "float32" else pred
+        return pred[:, 0] if n_outputs == 1 else pred
+
+    def predict_outputs(self, X):
+        """
+        Predictions as {(target, horizon): array}, for models exported from MultiOutputModelWrapper.
+        """
+        pred = np.asarray(self.predict(X)).reshape(len(X), len(self.outputs))
+        return {output: pred[:, k] for k, output in enumerate(self.outputs)}
@@ -0,0 +1,83 @@
+"""
+Sync checks of the local history cache (ml_pipeline/history_cache.py) against a fake loader.
+
+Syncs a scratch cache from queued loader responses: a first sync, an incremental one, and
+syncs that only bring rows without an ingestion_time (written before the column existed),
+which must cache the rows without moving the (ingestion_time, id) watermark.
+
+    python scripts/check_history_cache.py
+"""
+import os
+import sys
+import tempfile
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from ml_pipeline.history_cache import HistoryCache
+
+def make_rows(first_id, times, ingestion_time):
+    return pd.DataFrame({
+        "id": range(first_id, first_id + len(times)),
+        "city": "Tokyo",
+        "latitude": 35.68,
+        "longitude": 139.69,
+        "temperature": 20.0,
+        "humidity": 50.0,
+        "weather_timestamp": pd.to_datetime(times, utc=True),
+        "ingestion_time": pd.Series([ingestion_time] * len(times), dtype="datetime64[us, UTC]"),
+    })
+
+class FakeLoader:
+    """
+    Answers each fetch_data / fetch_data_parallel call with the next queued frame.
+    """
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = []
+
+    def fetch_data_parallel(self, **kwargs):
+        self.calls.append(("parallel", None))
+        return self.responses.pop(0)
+
+    def fetch_data(self, after=None, **kwargs):
+        self.calls.append(("pages", after))
+        return self.responses.pop(0)
+
+def check(condition, message):
+    print(f"{'ok  ' if condition else 'FAIL'} {message}")
+    return condition
+
+def main():
+    results = []
+    stamped = pd.Timestamp("2026-01-02", tz="UTC")
+    loader = FakeLoader(
+        make_rows(1, ["2026-01-01 00:00", "2026-01-01 00:30"], pd.NaT),
+        make_rows(3, ["2026-01-01 01:00"], stamped),
+        make_rows(4, ["2026-01-01 01:30"], pd.NaT),
+        pd.DataFrame(),
+    )
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = HistoryCache(loader, cache_dir)
+
+        results.append(check(cache.sync() == 2, "first sync caches rows without an ingestion time"))
+        results.append(check(cache.read_watermark() is None, "they do not set a watermark"))
+
+        cache.sync()
+        watermark = cache.read_watermark()
+        results.append(check(
+            watermark is not None and pd.Timestamp(watermark[0]) == stamped and watermark[1] == 3,
+            "the watermark is the newest stamped row",
+        ))
+
+        results.append(check(cache.sync() == 1, "a sync of only unstamped rows caches them"))
+        results.append(check(cache.read_watermark() == watermark, "and keeps the previous watermark"))
+
+        cache.sync()
+        results.append(check(loader.calls[-1] == ("pages", watermark), "the next sync resumes from it"))
+        results.append(check(len(cache.read()) == 4, "every row is cached once"))
+
+    return 0 if all(results) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,90 @@
+"""
+Replay checks of the ETL spool (etl/spool.py) against a simulated store.
+
+Spools records into a scratch SQLite file and drains them through a fake write that fails
+like the real stores do: a store-wide outage that later recovers must leave every record
+spooled and then store all of them, and a record the store rejects must be isolated and
+dead-lettered without holding back the rest of its batch.
+
+    python scripts/check_spool.py
+"""
+import os
+import sys
+import asyncio
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from etl.spool import Spool, drain
+from etl.main import write_rejected
+
+class ConstraintViolation(Exception):
+    sqlstate = "23514"  # check_violation, as psycopg reports it
+
+class FakeStore:
+    """
+    write() for drain: fails with ConnectionError while `down`, and rejects any batch holding
+    a record whose city is in `poison`.
+    """
+    def __init__(self, down=0, poison=()):
+        self.down = down  # Calls that fail before the store recovers
+        self.poison = set(poison)
+        self.calls = 0
+        self.stored = []
+
+    def write(self, records):
+        self.calls += 1
+        if self.calls <= self.down:
+            raise ConnectionError("connection refused")
+        if any(record["city"] in self.poison for record in records):
+            raise ConstraintViolation("new row violates check constraint")
+        self.stored.extend(records)
+
+def check(condition, message):
+    print(f"{'ok  ' if condition else 'FAIL'} {message}")
+    return condition
+
+def replay(records, store, batch_size):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        spool = Spool(os.path.join(tmpdir, "spool.sqlite3"))
+        spool.append(records)
+
+        async def run():
+            stop = asyncio.Event()
+            stop.set()
+            return await asyncio.wait_for(
+                drain(spool, store.write, stop, batch_size, 0.001, 0.01, write_rejected, poll_interval=0.01), 60
+            )
+
+        stored = asyncio.run(run())
+        counts = stored, spool.pending(), spool.dead_letters()
+        spool.conn.close()
+    return counts
+
+def main():
+    records = [{"city": f"City {i}", "temperature": 20.0} for i in range(200)]
+    results = []
+
+    results.append(check(write_rejected(ConstraintViolation()), "constraint violations reject the records"))
+    results.append(check(not write_rejected(ConnectionError()), "connection errors do not"))
+
+    # Outage longer than any per-record retry budget, then recovery
+    store = FakeStore(down=50)
+    stored, pending, dead = replay(records, store, batch_size=100)
+    results.append(check(dead == 0, "an outage dead-letters nothing"))
+    results.append(check(stored == len(records) and pending == 0, "every record is stored after recovery"))
+    results.append(check(store.calls == 50 + 2, "full batches resume after recovery"))
+
+    store = FakeStore(down=3, poison=["City 57"])
+    stored, pending, dead = replay(records, store, batch_size=100)
+    results.append(check(dead == 1 and pending == 0, "a rejected record is isolated and dead-lettered"))
+    results.append(check(
+        stored == len(records) - 1 and "City 57" not in {r["city"] for r in store.stored},
+        "the rest of its batch is stored",
+    ))
+    results.append(check(store.calls < 3 + 2 + 2 * 7 + 1, "isolating it takes a logarithmic number of writes"))
+
+    return 0 if all(results) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,81 @@
+"""
+Startup-time check for the Python entry points.
+
+Imports each entry point in a fresh interpreter under `python -X importtime` and fails
+when its cumulative import time exceeds the budget, or when a heavy library that should
+only load on demand is imported eagerly. The cron jobs pay this cost on every run.
+
+    python scripts/check_startup_time.py [--runs N]
+"""
+import os
+import re
+import sys
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (name, working directory, module, budget in ms, modules that must not load at import)
+ENTRY_POINTS = [
+    ("etl", os.path.join(ROOT, "etl"), "main", 250,
+     ["supabase", "httpx", "requests", "pandas", "numpy"]),
+    ("inference", ROOT, "ml_pipeline.inference_all_cities", 1200,
+     ["supabase", "xgboost", "lightgbm", "sklearn"]),
+    ("train_models", ROOT, "ml_pipeline.train_models", 1200,
+     ["supabase", "xgboost", "lightgbm", "sklearn"]),
+    ("train", ROOT, "ml_pipeline.train", 1200,
+     ["supabase", "xgboost", "lightgbm", "sklearn"]),
+]
+
+IMPORT_LINE = re.compile(r"^import time:\s+\d+ \|\s+(\d+) \| (\s*)(\S+)$")
+
+def measure(cwd, module):
+    """
+    (cumulative import time of `module` in ms, set of top-level modules imported).
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=cwd, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+
+    cumulative, imported = None, set()
+    for line in result.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if not match:
+            continue
+        imported.add(match.group(3).split(".")[0])
+        if match.group(3) == module:
+            cumulative = int(match.group(1)) / 1000
+    return cumulative, imported
+
+def main(runs=3):
+    failures = []
+    for name, cwd, module, budget, forbidden in ENTRY_POINTS:
+        # Best of several runs, so a cold disk cache does not fail the check
+        timings, imported = [], set()
+        for _ in range(runs):
+            elapsed, modules = measure(cwd, module)
+            timings.append(elapsed)
+            imported |= modules
+        best = min(timings)
+        eager = sorted(imported & set(forbidden))
+
+        status = "ok" if best <= budget and not eager else "FAIL"
+        print(f"{name:<14} {best:8.1f} ms (budget {budget} ms) {status}"
+              + (f" eager imports: {', '.join(eager)}" if eager else ""))
+        if status == "FAIL":
+            failures.append(name)
+
+    if failures:
+        print(f"Startup budget exceeded: {', '.join(failures)}")
+        return 1
+    print("All entry points within their startup budget.")
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check import-time budgets of the entry points")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+    sys.exit(main(runs=args.runs))
@@ -29,15 +29,10 @@ export interface PredictionRecord {
 }
 
 export const fetchLatestPredictions = async (): Promise<PredictionRecord[]> => {
-  // Fetch the latest prediction for each city
-  // Since we just inserted a batch, we can fetch all predictions created in the last hour
-  // or use a distinct on city query.
-  
-  // Using a simple query for now, assuming the table is mostly clean or we filter by recent.
-  // Ideally, we'd do a postgres DISTINCT ON (city) ORDER BY city, created_at DESC
-  
+  // The pipeline upserts one row per (city, model_type) into latest_predictions on every run,
+  // so this reads O(cities) rows no matter how long the predictions history grows.
   const { data, error } = await supabase
-    .from('predictions')
+    .from('latest_predictions')
     .select('*')
     .order('created_at', { ascending: false });
 
@@ -48,7 +43,7 @@ export const fetchLatestPredictions = async (): Promise<PredictionRecord[]> => {
 
   if (!data) return [];
 
-  // Filter to keep only the latest per city
+  // Keep the newest model's prediction per city
   const latestByCity = new Map<string, PredictionRecord>();
   
   data.forEach((record: any) => {
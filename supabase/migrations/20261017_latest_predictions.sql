@@ -0,0 +1,165 @@
+-- Latest predictions and history retention
+-- The dashboard only needs the newest prediction per city, but reading it from the append-only
+-- 'predictions' history meant scanning (and downloading) every run ever made. This migration:
+--   1. adds 'latest_predictions', one row per (city, model_type), upserted once per inference run;
+--   2. turns 'predictions' into a table range-partitioned by month on created_at;
+--   3. adds maintain_predictions(), which creates upcoming partitions and drops expired ones.
+-- Partitions are tables of their own, which PostgREST would expose without the parent's policies,
+-- so each one gets RLS with no policies and no grants: the history is only read through 'predictions'.
+
+-- 1. Latest prediction per city and model
+CREATE TABLE IF NOT EXISTS latest_predictions (
+    id BIGSERIAL UNIQUE, -- Stable per (city, model_type): upserts update the row in place
+    city VARCHAR(100) NOT NULL,
+    model_type VARCHAR(50) NOT NULL,
+    prediction_results JSONB NOT NULL,
+    accuracy_score DECIMAL(5,4),
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    PRIMARY KEY (city, model_type)
+);
+
+ALTER TABLE latest_predictions ENABLE ROW LEVEL SECURITY;
+
+-- Only the pipeline writes here, so every row is a public system prediction
+DROP POLICY IF EXISTS "Anyone can view latest predictions" ON latest_predictions;
+CREATE POLICY "Anyone can view latest predictions" ON latest_predictions FOR SELECT USING (true);
+
+GRANT SELECT ON latest_predictions TO anon, authenticated;
+
+-- Seed from the existing history
+INSERT INTO latest_predictions (city, model_type, prediction_results, accuracy_score, created_at)
+SELECT DISTINCT ON (city, model_type) city, model_type, prediction_results, accuracy_score, created_at
+FROM predictions
+WHERE user_id IS NULL
+ORDER BY city, model_type, created_at DESC
+ON CONFLICT (city, model_type) DO NOTHING;
+
+-- 2. Monthly partitions for the prediction history
+CREATE OR REPLACE FUNCTION public.ensure_prediction_partitions(from_month DATE, months_ahead INTEGER DEFAULT 2)
+RETURNS VOID AS $$
+DECLARE
+    month_start DATE := date_trunc('month', from_month)::DATE;
+    partition_name TEXT;
+BEGIN
+    WHILE month_start <= date_trunc('month', NOW() + make_interval(months => months_ahead))::DATE LOOP
+        partition_name := 'predictions_' || to_char(month_start, 'YYYY_MM');
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS public.%I PARTITION OF public.predictions FOR VALUES FROM (%L) TO (%L)',
+            partition_name, month_start, (month_start + INTERVAL '1 month')::DATE
+        );
+        -- Queried directly, a partition ignores the parent's policies: lock it down completely
+        EXECUTE format('ALTER TABLE public.%I ENABLE ROW LEVEL SECURITY', partition_name);
+        EXECUTE format('REVOKE ALL ON public.%I FROM PUBLIC, anon, authenticated', partition_name);
+        month_start := (month_start + INTERVAL '1 month')::DATE;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+DO $$
+DECLARE
+    first_month DATE;
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'public.predictions'::regclass) THEN
+        RETURN; -- Already partitioned
+    END IF;
+
+    -- Free the names the new table's sequence and primary key index will take
+    ALTER TABLE predictions RENAME TO predictions_unpartitioned;
+    EXECUTE format('ALTER SEQUENCE %s RENAME TO predictions_unpartitioned_id_seq',
+                   pg_get_serial_sequence('predictions_unpartitioned', 'id'));
+    ALTER INDEX IF EXISTS predictions_pkey RENAME TO predictions_unpartitioned_pkey;
+
+    -- The partition key must be part of the primary key
+    CREATE TABLE predictions (
+        id BIGSERIAL,
+        user_id UUID REFERENCES users(id) ON DELETE CASCADE, -- Nullable for system/public predictions
+        city VARCHAR(100) NOT NULL,
+        model_type VARCHAR(50) NOT NULL,
+        prediction_results JSONB NOT NULL,
+        accuracy_score DECIMAL(5,4),
+        created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+        PRIMARY KEY (id, created_at)
+    ) PARTITION BY RANGE (created_at);
+
+    SELECT COALESCE(date_trunc('month', MIN(created_at))::DATE, date_trunc('month', NOW())::DATE)
+    INTO first_month FROM predictions_unpartitioned;
+    PERFORM ensure_prediction_partitions(first_month);
+
+    INSERT INTO predictions (id, user_id, city, model_type, prediction_results, accuracy_score, created_at)
+    SELECT id, user_id, city, model_type, prediction_results, accuracy_score, COALESCE(created_at, NOW())
+    FROM predictions_unpartitioned;
+    PERFORM setval(pg_get_serial_sequence('predictions', 'id'), COALESCE((SELECT MAX(id) FROM predictions), 0) + 1, false);
+
+    DROP TABLE predictions_unpartitioned;
+END $$;
+
+CREATE INDEX IF NOT EXISTS idx_predictions_city_created_at ON predictions(city, created_at DESC);
+
+-- Policies and grants do not carry over from the renamed table
+ALTER TABLE predictions ENABLE ROW LEVEL SECURITY;
+DROP POLICY IF EXISTS "Users can view own predictions" ON predictions;
+CREATE POLICY "Users can view own predictions" ON predictions FOR SELECT USING (auth.uid() = user_id);
+DROP POLICY IF EXISTS "Admin can view all predictions" ON predictions;
+CREATE POLICY "Admin can view all predictions" ON predictions FOR SELECT USING (is_admin());
+DROP POLICY IF EXISTS "Anyone can view system predictions" ON predictions;
+CREATE POLICY "Anyone can view system predictions" ON predictions FOR SELECT USING (user_id IS NULL);
+GRANT SELECT ON predictions TO anon;
+GRANT ALL PRIVILEGES ON predictions TO authenticated;
+GRANT ALL PRIVILEGES ON SEQUENCE predictions_id_seq TO authenticated;
+
+-- 3. Retention: keep the next partitions ready and drop whole months past the retention window
+CREATE OR REPLACE FUNCTION public.maintain_predictions(retention_days INTEGER DEFAULT 30)
+RETURNS INTEGER AS $$
+DECLARE
+    part RECORD;
+    dropped INTEGER := 0;
+BEGIN
+    PERFORM ensure_prediction_partitions(NOW()::DATE);
+
+    FOR part IN
+        SELECT child.relname
+        FROM pg_inherits
+        JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE parent.relname = 'predictions' AND child.relname ~ '^predictions_\d{4}_\d{2}$'
+    LOOP
+        -- A month is dropped once all of it is older than the retention window
+        IF to_date(substring(part.relname FROM 13), 'YYYY_MM') + INTERVAL '1 month'
+           <= NOW() - make_interval(days => retention_days) THEN
+            EXECUTE format('DROP TABLE public.%I', part.relname);
+            dropped := dropped + 1;
+        END IF;
+    END LOOP;
+    RETURN dropped;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+-- Partitions created before they were locked down (the function above does it for new ones)
+DO $$
+DECLARE
+    part RECORD;
+BEGIN
+    FOR part IN
+        SELECT child.relname
+        FROM pg_inherits
+        JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE parent.relname = 'predictions'
+    LOOP
+        EXECUTE format('ALTER TABLE public.%I ENABLE ROW LEVEL SECURITY', part.relname);
+        EXECUTE format('REVOKE ALL ON public.%I FROM PUBLIC, anon, authenticated', part.relname);
+    END LOOP;
+END $$;
+
+-- Partition management is for the pipeline (service role) only
+REVOKE EXECUTE ON FUNCTION public.ensure_prediction_partitions(DATE, INTEGER) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION public.maintain_predictions(INTEGER) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.maintain_predictions(INTEGER) TO service_role;
+
+-- Run it daily where pg_cron is available; the inference job also calls it before each insert
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_cron') THEN
+        PERFORM cron.schedule('maintain-predictions', '15 3 * * *', 'SELECT public.maintain_predictions(30)');
+    END IF;
+END $$;
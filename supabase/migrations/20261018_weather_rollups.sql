@@ -0,0 +1,163 @@
+-- Rollup and retention tiers for weather_data
+-- Raw observations arrive every 30 minutes per city and were kept forever. This migration adds
+-- hourly and daily aggregate tables and rollup_weather_data(), which:
+--   1. re-aggregates the complete hourly buckets (older than `rollup_after`) that gained rows
+--      since its previous run, then the complete days containing them;
+--   2. deletes raw rows past `raw_retention` and hourly rows past `hourly_retention`.
+-- Only buckets touched since the previous run are recomputed, so late and backfilled rows are
+-- picked up while the cost of a run stays proportional to what was ingested. Raw rows are only
+-- pruned on whole-day boundaries that have already been rolled up.
+
+-- 1. Aggregate tables (one row per city and bucket)
+CREATE TABLE IF NOT EXISTS weather_data_hourly (
+    city VARCHAR(100) NOT NULL,
+    bucket TIMESTAMP WITH TIME ZONE NOT NULL,
+    latitude DECIMAL(8,6) NOT NULL,
+    longitude DECIMAL(9,6) NOT NULL,
+    temperature_mean DOUBLE PRECISION NOT NULL,
+    temperature_min DECIMAL(5,2) NOT NULL,
+    temperature_max DECIMAL(5,2) NOT NULL,
+    humidity_mean DOUBLE PRECISION NOT NULL,
+    humidity_min DECIMAL(5,2) NOT NULL,
+    humidity_max DECIMAL(5,2) NOT NULL,
+    sample_count INTEGER NOT NULL,
+    PRIMARY KEY (city, bucket)
+);
+
+CREATE TABLE IF NOT EXISTS weather_data_daily (LIKE weather_data_hourly INCLUDING ALL);
+
+CREATE INDEX IF NOT EXISTS idx_weather_data_hourly_bucket ON weather_data_hourly(bucket);
+CREATE INDEX IF NOT EXISTS idx_weather_data_daily_bucket ON weather_data_daily(bucket);
+
+ALTER TABLE weather_data_hourly ENABLE ROW LEVEL SECURITY;
+ALTER TABLE weather_data_daily ENABLE ROW LEVEL SECURITY;
+
+-- Same visibility as weather_data
+DROP POLICY IF EXISTS "Anyone can view hourly weather" ON weather_data_hourly;
+CREATE POLICY "Anyone can view hourly weather" ON weather_data_hourly FOR SELECT USING (true);
+DROP POLICY IF EXISTS "Anyone can view daily weather" ON weather_data_daily;
+CREATE POLICY "Anyone can view daily weather" ON weather_data_daily FOR SELECT USING (true);
+
+GRANT SELECT ON weather_data_hourly, weather_data_daily TO anon, authenticated;
+
+-- Finds rows ingested since the previous rollup run
+CREATE INDEX IF NOT EXISTS idx_weather_data_ingestion ON weather_data(ingestion_time, id);
+
+-- 2. Rollup and retention job
+-- Single row: ingestion_time and bucket cutoff reached by the previous run
+CREATE TABLE IF NOT EXISTS weather_rollup_state (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    last_ingestion TIMESTAMP WITH TIME ZONE NOT NULL,
+    last_cutoff TIMESTAMP WITH TIME ZONE NOT NULL
+);
+ALTER TABLE weather_rollup_state ENABLE ROW LEVEL SECURITY;
+
+CREATE OR REPLACE FUNCTION public.rollup_weather_data(
+    rollup_after INTERVAL DEFAULT INTERVAL '2 hours',
+    raw_retention INTERVAL DEFAULT INTERVAL '90 days',
+    hourly_retention INTERVAL DEFAULT INTERVAL '365 days'
+)
+RETURNS JSONB AS $$
+DECLARE
+    cutoff TIMESTAMPTZ := date_trunc('hour', NOW() - rollup_after);
+    ingested_until TIMESTAMPTZ;
+    previous weather_rollup_state%ROWTYPE;
+    raw_prune_before TIMESTAMPTZ;
+    hourly_rows INTEGER := 0;
+    daily_rows INTEGER := 0;
+    raw_pruned INTEGER := 0;
+    hourly_pruned INTEGER := 0;
+BEGIN
+    -- One run at a time; a concurrent call waits and then sees the new state
+    LOCK TABLE weather_rollup_state IN EXCLUSIVE MODE;
+    SELECT * INTO previous FROM weather_rollup_state;
+    SELECT COALESCE(MAX(ingestion_time), '-infinity') INTO ingested_until FROM weather_data;
+
+    -- Complete hours that gained rows since the previous run, or became complete since then
+    DROP TABLE IF EXISTS rollup_hours;
+    CREATE TEMP TABLE rollup_hours ON COMMIT DROP AS
+    SELECT city, date_trunc('hour', weather_timestamp) AS bucket
+    FROM weather_data
+    WHERE ingestion_time > COALESCE(previous.last_ingestion, '-infinity') AND weather_timestamp < cutoff
+    UNION
+    SELECT city, date_trunc('hour', weather_timestamp)
+    FROM weather_data
+    WHERE weather_timestamp >= COALESCE(previous.last_cutoff, '-infinity') AND weather_timestamp < cutoff;
+
+    INSERT INTO weather_data_hourly
+    SELECT w.city, h.bucket,
+           (array_agg(w.latitude ORDER BY w.weather_timestamp DESC))[1],
+           (array_agg(w.longitude ORDER BY w.weather_timestamp DESC))[1],
+           AVG(w.temperature)::DOUBLE PRECISION, MIN(w.temperature), MAX(w.temperature),
+           AVG(w.humidity)::DOUBLE PRECISION, MIN(w.humidity), MAX(w.humidity),
+           COUNT(*)
+    FROM rollup_hours h
+    JOIN weather_data w ON w.city = h.city
+        AND w.weather_timestamp >= h.bucket AND w.weather_timestamp < h.bucket + INTERVAL '1 hour'
+    GROUP BY w.city, h.bucket
+    ON CONFLICT (city, bucket) DO UPDATE SET
+        latitude = EXCLUDED.latitude, longitude = EXCLUDED.longitude,
+        temperature_mean = EXCLUDED.temperature_mean,
+        temperature_min = EXCLUDED.temperature_min, temperature_max = EXCLUDED.temperature_max,
+        humidity_mean = EXCLUDED.humidity_mean,
+        humidity_min = EXCLUDED.humidity_min, humidity_max = EXCLUDED.humidity_max,
+        sample_count = EXCLUDED.sample_count;
+    GET DIAGNOSTICS hourly_rows = ROW_COUNT;
+
+    -- Complete (UTC) days containing those hours, from the hourly tier, means weighted by count
+    INSERT INTO weather_data_daily
+    SELECT hr.city, d.day,
+           (array_agg(hr.latitude ORDER BY hr.bucket DESC))[1],
+           (array_agg(hr.longitude ORDER BY hr.bucket DESC))[1],
+           SUM(hr.temperature_mean * hr.sample_count) / SUM(hr.sample_count),
+           MIN(hr.temperature_min), MAX(hr.temperature_max),
+           SUM(hr.humidity_mean * hr.sample_count) / SUM(hr.sample_count),
+           MIN(hr.humidity_min), MAX(hr.humidity_max),
+           SUM(hr.sample_count)
+    FROM (
+        SELECT DISTINCT city, date_trunc('day', bucket, 'UTC') AS day
+        FROM rollup_hours
+        WHERE bucket < date_trunc('day', cutoff, 'UTC')
+    ) d
+    JOIN weather_data_hourly hr ON hr.city = d.city
+        AND hr.bucket >= d.day AND hr.bucket < d.day + INTERVAL '1 day'
+    GROUP BY hr.city, d.day
+    ON CONFLICT (city, bucket) DO UPDATE SET
+        latitude = EXCLUDED.latitude, longitude = EXCLUDED.longitude,
+        temperature_mean = EXCLUDED.temperature_mean,
+        temperature_min = EXCLUDED.temperature_min, temperature_max = EXCLUDED.temperature_max,
+        humidity_mean = EXCLUDED.humidity_mean,
+        humidity_min = EXCLUDED.humidity_min, humidity_max = EXCLUDED.humidity_max,
+        sample_count = EXCLUDED.sample_count;
+    GET DIAGNOSTICS daily_rows = ROW_COUNT;
+
+    -- Only whole days that are already in both tiers are removed from the raw table
+    raw_prune_before := LEAST(date_trunc('day', NOW() - raw_retention, 'UTC'), date_trunc('day', cutoff, 'UTC'));
+    DELETE FROM weather_data WHERE weather_timestamp < raw_prune_before;
+    GET DIAGNOSTICS raw_pruned = ROW_COUNT;
+
+    -- Hourly rows outlive the raw rows they were built from, so days can still be recomputed
+    DELETE FROM weather_data_hourly
+    WHERE bucket < LEAST(date_trunc('day', NOW() - hourly_retention, 'UTC'), raw_prune_before);
+    GET DIAGNOSTICS hourly_pruned = ROW_COUNT;
+
+    INSERT INTO weather_rollup_state (last_ingestion, last_cutoff) VALUES (ingested_until, cutoff)
+    ON CONFLICT (id) DO UPDATE SET last_ingestion = EXCLUDED.last_ingestion, last_cutoff = EXCLUDED.last_cutoff;
+
+    RETURN jsonb_build_object(
+        'hourly_rows', hourly_rows, 'daily_rows', daily_rows,
+        'raw_pruned', raw_pruned, 'hourly_pruned', hourly_pruned
+    );
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+REVOKE EXECUTE ON FUNCTION public.rollup_weather_data(INTERVAL, INTERVAL, INTERVAL) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.rollup_weather_data(INTERVAL, INTERVAL, INTERVAL) TO service_role;
+
+-- Hourly where pg_cron is available; otherwise `python etl/main.py --rollup` runs it after the ETL
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_cron') THEN
+        PERFORM cron.schedule('rollup-weather-data', '5 * * * *', 'SELECT public.rollup_weather_data()');
+    END IF;
+END $$;